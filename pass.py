@@ -15,9 +15,26 @@ def main():
     if args.oper == 'version':
         print('{0} {1}'.format(vaultpass.constants.NAME,
                                vaultpass.constants.VERSION))
+        return(None)
+    if args.oper == 'agent':
+        vp = vaultpass.VaultPass(**vars(args))
+        vaultpass.agent.Agent(vp,
+                              args.cfg,
+                              socket_path = args.socket,
+                              cache_ttl = args.cache_ttl,
+                              cache_size = args.cache_size).serve()
+        return(None)
+    if not args.no_agent and vaultpass.agent.request(socket_path = args.socket, **vars(args)):
+        return(None)
     args.initialize = (True if args.oper == 'init' else False)
     args.verify_cfg = (True if args.oper == 'verify' else False)
     vp = vaultpass.VaultPass(**vars(args))
+    try:
+        vp.execute(**vars(args))
+    finally:
+        # Even a failed (or partial) write may have changed something.
+        if not args.no_agent:
+            vaultpass.agent.invalidate(socket_path = args.socket, **vars(args))
     return(None)
 
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Guards CLI cold-start time: imports vaultpass and parses the arguments for a few common operations (in fresh
+# interpreters, the way the CLI is actually run), then fails if any of the heavy modules got imported along the way or
+# if the median time is over budget.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+_repo_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# None of these should be needed to import vaultpass and parse the command line.
+_heavy_modules = ('dpath', 'gpg', 'hvac', 'lxml', 'passlib', 'psutil', 'qrcode', 'requests', 'systemd',
+                  'vaultpass.auth', 'vaultpass.clipboard', 'vaultpass.config', 'vaultpass.connection',
+                  'vaultpass.mounts', 'vaultpass.pwgen', 'vaultpass.QR')
+_default_argvs = (['show', 'some/secret'],
+                  ['ls', '-o', 'json', 'some/path'],
+                  ['grep', '-i', 'pattern'],
+                  ['generate', 'some/secret', '32'],
+                  ['version'])
+_probe = ('import json, sys, time\n'
+          'argv = json.loads(sys.argv[1])\n'
+          'start = time.perf_counter()\n'
+          'import vaultpass\n'
+          'vaultpass.args.parseArgs(argv).parse_args(argv)\n'
+          'elapsed = time.perf_counter() - start\n'
+          'heavy = [m for m in json.loads(sys.argv[2]) if m in sys.modules]\n'
+          'print(json.dumps({"elapsed": elapsed, "heavy": heavy}))\n')
+
+
+def probe(argv):
+    cmd = subprocess.run([sys.executable, '-c', _probe, json.dumps(argv), json.dumps(_heavy_modules)],
+                         cwd = _repo_dir,
+                         stdout = subprocess.PIPE,
+                         stderr = subprocess.PIPE)
+    if cmd.returncode != 0:
+        raise RuntimeError('Probe for {0} failed: {1}'.format(argv, cmd.stderr.decode('utf-8').strip()))
+    return(json.loads(cmd.stdout.decode('utf-8')))
+
+
+def parseArgs():
+    args = argparse.ArgumentParser(description = 'Benchmark (and guard) VaultPass import/startup time')
+    args.add_argument('-n', '--runs',
+                      dest = 'runs',
+                      type = int,
+                      default = 10,
+                      help = 'How many times to run each probe. Default: 10')
+    args.add_argument('-b', '--budget',
+                      dest = 'budget',
+                      type = float,
+                      default = None,
+                      help = ('If specified, fail if the median time (in milliseconds) for any probe exceeds this. '
+                              'Timing is machine-dependent, so there is no default budget'))
+    return(args)
+
+
+def main():
+    args = parseArgs().parse_args()
+    failed = False
+    for argv in _default_argvs:
+        times = []
+        heavy = set()
+        for _ in range(args.runs):
+            rslt = probe(argv)
+            times.append(rslt['elapsed'] * 1000)
+            heavy.update(rslt['heavy'])
+        median = statistics.median(times)
+        status = 'OK'
+        if heavy:
+            status = 'FAIL (imported: {0})'.format(', '.join(sorted(heavy)))
+            failed = True
+        elif args.budget is not None and median > args.budget:
+            status = 'FAIL (over {0:.1f} ms budget)'.format(args.budget)
+            failed = True
+        print('{0:<40} median {1:>7.2f} ms  min {2:>7.2f} ms  {3}'.format(' '.join(argv), median, min(times), status))
+    if failed:
+        sys.exit(1)
+    return(None)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,33 +11,59 @@ import time
 from . import logger
 _logger = logging.getLogger('VaultPass')
 ##
-import hvac.exceptions
-##
 from . import args
-from . import auth
-from . import clipboard
-from . import config
+from . import cache
 from . import constants
-from . import editor
-from . import gpg_handler
-from . import mounts
-from . import pwgen
-from . import QR
+from . import lazy
+from . import metrics
+from . import profiler
+# These (and what they import) are heavy, and most operations only need some of them; they're imported on first use.
+hvac = lazy.lazyImport('hvac')
+agent = lazy.lazyImport('.agent', __name__)
+auth = lazy.lazyImport('.auth', __name__)
+clipboard = lazy.lazyImport('.clipboard', __name__)
+config = lazy.lazyImport('.config', __name__)
+connection = lazy.lazyImport('.connection', __name__)
+editor = lazy.lazyImport('.editor', __name__)
+gpg_handler = lazy.lazyImport('.gpg_handler', __name__)
+governor = lazy.lazyImport('.governor', __name__)
+mounts = lazy.lazyImport('.mounts', __name__)
+pwgen = lazy.lazyImport('.pwgen', __name__)
+QR = lazy.lazyImport('.QR', __name__)
+
+# These don't change anything, so they're safe to retry.
+_readonly_opers = ('find', 'grep', 'list', 'ls', 'search', 'show')
+# What Vault says when a mount doesn't exist (anymore) or a KV path doesn't match the mount's version, i.e. the cached
+# mount types are out of date; anything else (e.g. an InvalidPath for a missing secret) isn't a mount problem.
+_mount_errors = ('no handler for route', 'invalid path for a versioned k/v')
+# How many secret paths bulk generation writes (concurrently) before streaming their results out.
+_generate_batch = 64
+
+
+def _isMountError(e):
+    return(any(i in str(e).lower() for i in _mount_errors))
 
 
 class VaultPass(object):
     client = None
     auth = None
     uri = None
+    uris = None
     mount = None
+    session = None
+    # Only set in long-lived processes (i.e. the agent); see secretcache.SecretCache.
+    secret_cache = None
 
     def __init__(self,
                  initialize = False,
                  cfg = '~/.config/vaultpass.xml',
                  verify_cfg = True,
                  loglevel = constants.DEFAULT_LOGLEVEL,
+                 profile = False,
                  *args,
                  **kwargs):
+        if profile:
+            profiler.enable()
         rootlogger = logging.getLogger()
         if loglevel != constants.DEFAULT_LOGLEVEL:
             if not isinstance(loglevel, int):
@@ -46,17 +72,36 @@ class VaultPass(object):
         if loglevel != constants.DEFAULT_LOGLEVEL:  # And again in case we transformed it above.
             rootlogger.setLevel(loglevel)
         self.initialize = initialize
-        self.cfg = config.getConfig(cfg, validate = verify_cfg)
+        with profiler.phase('config load'):
+            self.cfg = config.getConfig(cfg, validate = verify_cfg)
+        metrics_xml = self.cfg.xml.find('metrics')
+        if metrics_xml is not None:
+            metrics.enable(metrics_xml)
         self._getURI()
-        self.getClient()
+        self._getSession()
+        with profiler.phase('auth'):
+            self.getClient()
         if not self.initialize:
-            self._checkSeal()
-            self._getMount()
+            with profiler.phase('seal check'):
+                self._checkSeal()
+            with profiler.phase('mount discovery'):
+                self._getMount()
 
-    def _checkSeal(self):
+    def _checkSeal(self, refresh = False):
         _logger.debug('Checking and attempting unseal if necessary and possible.')
-        if not self.client.sys.is_sealed():
+        # Only "initialized and unsealed" is cached; anything else is always checked.
+        if not refresh and cache.readState('server', self.uri, constants.SERVER_STATE_TTL):
+            _logger.debug('Vault was recently initialized and unsealed; not checking again.')
+            return(None)
+        # One request for both the init and seal status.
+        status = self.client.sys.read_seal_status()
+        if not status.get('initialized') and not self.initialize:
+            _logger.debug('Vault instance is not initialized. Please initialize (and configure, if necessary) first.')
+            _logger.error('Not initialized')
+            raise RuntimeError('Not initialized')
+        if not status.get('sealed'):
             _logger.debug('Unsealing unnecessary; Vault is already unsealed.')
+            cache.writeState('server', self.uri, {'initialized': True, 'sealed': False})
             return(None)
         shard = self.cfg.xml.find('unseal')
         if shard is None:
@@ -64,11 +109,12 @@ class VaultPass(object):
             _logger.error('Vault is sealed')
             raise RuntimeError('Vault is sealed')
         self.client.sys.submit_unseal_key(shard.text)
-        if self.client.sys.is_sealed:
+        if self.client.sys.is_sealed():
             _logger.debug(('Vault is sealed and either our unseal shard is incorrect or it is not enough to meet the '
                            'unseal shard threshold.'))
             _logger.error('Unable to unseal')
             raise RuntimeError('Unable to unseal')
+        cache.writeState('server', self.uri, {'initialized': True, 'sealed': False})
         return(None)
 
     def _getConfirm(self, msg = None):
@@ -81,7 +127,7 @@ class VaultPass(object):
         return(False)
 
     def _getHandler(self, mount, func = 'read', *args, **kwargs):
-        funcs = ('read', 'write', 'list', 'delete', 'destroy')
+        funcs = ('read', 'write', 'list', 'delete', 'destroy', 'update')
         if func not in funcs:
             _logger.error('Invalid func')
             _logger.debug('Invalid func; must be one of: {0}'.format(', '.join(funcs)))
@@ -115,25 +161,44 @@ class VaultPass(object):
 
     def _getMount(self):
         mounts_xml = self.cfg.xml.find('.//mounts')
-        self.mount = mounts.MountHandler(self.client, mounts_xml = mounts_xml)
+        self.mount = mounts.MountHandler(self.client,
+                                         mounts_xml = mounts_xml,
+                                         cache_key = cache.getKey(self.uri, self.auth.name, str(self.auth.identity)))
+        return(None)
+
+    def _getSession(self):
+        conn_xml = self.cfg.xml.find('.//server/connection')
+        retry_xml = self.cfg.xml.find('.//server/retry')
+        concurrency_xml = self.cfg.xml.find('.//server/concurrency')
+        self.session = connection.getSession(conn_xml = conn_xml,
+                                             retry_xml = retry_xml,
+                                             concurrency_xml = concurrency_xml)
+        self.session.setURIs(self.uris)
+        self.session.setReaders(reads_xml = self.cfg.xml.find('server/reads'))
         return(None)
 
     def _getURI(self):
-        uri = self.cfg.xml.find('.//uri')
-        if uri is None:
+        # Any of these can be used; the first is the one clients are built with, and the session routes requests to
+        # whichever node is best (see connection.Session.setURIs()).
+        uris = [u.text for u in self.cfg.xml.findall('server/uri')]
+        if not uris:
             _logger.debug('No server URI specified; checking ${VAULT_ADDR}')
             _uri = os.environ.get('VAULT_ADDR')
             if not _uri:
                 _logger.debug('No ${VAULT_ADDR}; using default of http://localhost:8200/')
-                uri = 'http://localhost:8200/'
+                uris = ['http://localhost:8200/']
             else:
-                uri = _uri
-        else:
-            uri = uri.text
-        self.uri = uri
+                uris = [_uri]
+        self.uris = uris
+        self.uri = uris[0]
         _logger.debug('Set URI to {0}'.format(self.uri))
         return(None)
 
+    def _invalidate(self, mount, path):
+        if self.secret_cache is not None:
+            self.secret_cache.invalidate(mount = mount, path = path)
+        return(None)
+
     def _pathExists(self, path, mount, is_secret = False, *args, **kwargs):
         kname = None
         path = path.rstrip('/')
@@ -150,6 +215,76 @@ class VaultPass(object):
                     return(True)
         return(False)
 
+    def _readManifest(self, manifest):
+        # One PATH/TO/SECRET per line, optionally followed by a length; blank lines and #comments are ignored.
+        if manifest == '-':
+            content = sys.stdin.read()
+        else:
+            manifest = os.path.abspath(os.path.expanduser(manifest))
+            if not os.path.isfile(manifest):
+                _logger.error('Manifest does not exist')
+                _logger.debug('The manifest {0} does not exist.'.format(manifest))
+                raise ValueError('Manifest does not exist')
+            with open(manifest, 'r') as fh:
+                content = fh.read()
+        paths = []
+        for lineno, line in enumerate(content.splitlines(), 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) == 1:
+                paths.append(fields[0])
+                continue
+            try:
+                if len(fields) != 2:
+                    raise ValueError()
+                paths.append((fields[0], int(fields[1])))
+            except ValueError:
+                _logger.error('Invalid manifest line')
+                _logger.debug('Line {0} of the manifest ("{1}") is not PATH/TO/SECRET [LENGTH].'.format(lineno, line))
+                raise ValueError('Invalid manifest line')
+        return(paths)
+
+    def _showSecret(self, data, clip = None, qr = None, seconds = constants.CLIP_TIMEOUT, printme = False):
+        if qr not in (False, None):
+            qrdata, has_x = QR.genQr(data, image = True)
+            if has_x:
+                fpath = tempfile.mkstemp(prefix = '.vaultpass.qr.', suffix = '.svg', dir = '/dev/shm')[1]
+                _logger.debug('Writing to {0} so it can be displayed'.format(fpath))
+                with open(fpath, 'wb') as fh:
+                    fh.write(qrdata.read())
+                if printme:
+                    _logger.debug('Opening {0} in the default image viwer application'.format(fpath))
+                    # We intentionally want this to block, as most image viewers will  unload the image once the file
+                    # is deleted and we can probably delete it faster than the user can save it elsewhere or
+                    # scan it with their phone.
+                    # TODO: we could use Popen() and do a countdown for "seconds" seconds, and then kill the viewer.
+                    #       But that breaks compat with Pass' behaviour.
+                    if printme:
+                        print('Now displaying generated QR code. Please close the viewer when done saving/scanning to '
+                              'securely clean up the generated file and continue...')
+                    cmd = subprocess.run(['xdg-open', fpath], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+                    if cmd.returncode != 0:
+                        _logger.error('xdg-open returned non-zero status code')
+                        for x in ('stdin', 'stdout'):
+                            o = getattr(cmd, x)
+                            if not o:
+                                continue
+                            o = o.decode('utf-8').strip()
+                            if o != '':
+                                _logger.debug('{0}: {1}'.format(x.upper(), o))
+                    if printme:
+                        print('Done. Deleting generated file.')
+                    os.remove(fpath)
+            elif printme:
+                print(qrdata.read())
+            qrdata.seek(0, 0)
+            del(qrdata)
+        if clip not in (False, None):
+            clipboard.pasteClipboard(data, seconds = seconds, printme = printme)
+        return(None)
+
     def convert(self,
                 mount,
                 force = False,
@@ -160,8 +295,9 @@ class VaultPass(object):
         pass_dir = os.path.abspath(os.path.expanduser(pass_dir))
         gpg = gpg_handler.GPG(home = gpghome)
         kname_re = re.compile(r'^(?P<kname>[^/]+)\.(gpg|asc)$')
+        jobs = []
         for root, dirs, files in os.walk(pass_dir):
-            rel_root = pathlib.Path(root).relative_to(pass_dir)
+            rel_root = str(pathlib.Path(root).relative_to(pass_dir))
             for f in files:
                 r = kname_re.search(f)
                 if not r:
@@ -171,7 +307,7 @@ class VaultPass(object):
                 if flat:
                     path = os.path.dirname(rel_root)
                     data = {kname: dcryptdata}
-                    self.createSecret(data, path, mount, force = force)
+                    jobs.append((data, path))
                 else:
                     data = {}
                     k = None
@@ -186,7 +322,12 @@ class VaultPass(object):
                             data[k] = v
                             k = l[0]
                             v = l[1]
-                    self.createSecret(data, path = '/'.join((rel_root, kname)), mount = mount, force = force)
+                    jobs.append((data, '/'.join((rel_root, kname))))
+        # Decryption stays serial (it may need pinentry); the writes draw from the shared concurrency budget.
+        # Build the path index once up front so the workers don't each walk the tree.
+        self.mount.getPath('/', mount)
+        gov = governor.getGovernor()
+        gov.map((lambda j: self.createSecret(j[0], path = j[1], mount = mount, force = force)), jobs)
         return(None)
 
     def copySecret(self, oldpath, newpath, mount, newmount = None, force = False, remove_old = False, *args, **kwargs):
@@ -245,6 +386,7 @@ class VaultPass(object):
         else:
             handler = self._getHandler(mount, func = 'write')
         resp = handler(**args)
+        self._invalidate(mount, path)
         return(resp)
 
     def deleteSecret(self, path, mount, force = False, recursive = False, destroy = False, *args, **kwargs):
@@ -283,7 +425,9 @@ class VaultPass(object):
         if op == 'destroy':
             if mtype == 'kv2':
                 pass  # TODO: how tf do i recurse
-        return(handler(**args))
+        resp = handler(**args)
+        self._invalidate(mount, path)
+        return(resp)
 
     def editSecret(self, path, mount, editor_prog = constants.EDITOR, *args, **kwargs):
         data = self.getSecret(path, mount)
@@ -293,6 +437,129 @@ class VaultPass(object):
         self.createSecret(newdata, path, mount, force = True)
         return(newdata)
 
+    def _execute(self, oper, **kwargs):
+        mount = kwargs.get('mount')
+        if oper in ('cp', 'copy', 'mv', 'rename', 'move'):
+            newmount = kwargs.get('newmount')
+            if isinstance(newmount, list):
+                newmount = newmount[0]
+            self.copySecret(kwargs['oldpath'],
+                            kwargs['newpath'],
+                            mount,
+                            newmount = newmount,
+                            force = kwargs.get('force', False),
+                            remove_old = (oper in ('mv', 'rename', 'move')))
+        elif oper == 'edit':
+            self.editSecret(kwargs['path'], mount, editor_prog = kwargs.get('editor', constants.EDITOR))
+        elif oper in ('find', 'search'):
+            self.searchSecretNames(kwargs['pattern'], mount)
+        elif oper == 'generate':
+            genargs = {'symbols': kwargs.get('symbols', True),
+                       'chars': kwargs.get('chars', constants.SELECTED_PASS_CHARS),
+                       'chars_plain': kwargs.get('chars_plain', constants.SELECTED_PASS_NOSYMBOL_CHARS),
+                       'force': kwargs.get('force', False),
+                       'length': kwargs.get('length', constants.GENERATED_LENGTH),
+                       'words': kwargs.get('words'),
+                       'wordlist_path': kwargs.get('wordlist_path'),
+                       'delimiter': kwargs.get('delimiter', constants.PASSPHRASE_DELIMITER)}
+            if kwargs.get('manifest'):
+                if any((kwargs.get('clip'), kwargs.get('qr'))):
+                    _logger.error('Cannot use the clipboard or QR codes with a manifest')
+                    raise ValueError('Cannot use the clipboard or QR codes with a manifest')
+                paths = self._readManifest(kwargs['manifest'])
+                if kwargs.get('path'):
+                    paths.insert(0, kwargs['path'])
+                self.generateSecrets(paths,
+                                     mount,
+                                     output = kwargs.get('output'),
+                                     recipients = kwargs.get('recipients'),
+                                     gpghome = kwargs.get('gpghome', constants.GPG_HOMEDIR),
+                                     printme = True,
+                                     **genargs)
+            elif kwargs.get('output'):
+                _logger.error('-o/--output requires -M/--manifest')
+                raise ValueError('-o/--output requires -M/--manifest')
+            elif kwargs.get('path'):
+                passwd = self.generateSecret(kwargs['path'],
+                                             mount,
+                                             clip = kwargs.get('clip', False),
+                                             qr = kwargs.get('qr', False),
+                                             seconds = kwargs.get('seconds', constants.CLIP_TIMEOUT),
+                                             printme = True,
+                                             **genargs)
+                if not any((kwargs.get('clip'), kwargs.get('qr'))):
+                    print(passwd)
+            else:
+                _logger.error('No path to generate')
+                _logger.debug('Specify PATH/TO/SECRET and/or -M/--manifest.')
+                raise ValueError('No path to generate')
+        elif oper == 'grep':
+            self.searchSecrets(kwargs['pattern'], mount)
+        elif oper == 'init':
+            self.initVault()
+        elif oper in ('insert', 'add'):
+            self.insertSecret(kwargs['path'],
+                              mount,
+                              allow_shouldersurf = kwargs.get('allow_shouldersurf', False),
+                              multiline = kwargs.get('multiline', False),
+                              force = kwargs.get('force', False),
+                              confirm = kwargs.get('confirm', True))
+        elif oper in ('ls', 'list'):
+            self.listSecretNames(kwargs['path'],
+                                 mount,
+                                 output = kwargs.get('output'),
+                                 indent = kwargs.get('indent', 4))
+        elif oper in ('rm', 'remove', 'delete', 'destroy'):
+            self.deleteSecret(kwargs['path'],
+                              mount,
+                              force = kwargs.get('force', False),
+                              recursive = kwargs.get('recurse', False),
+                              destroy = (oper == 'destroy'))
+        elif oper == 'show':
+            data = self.getSecret(kwargs['path'],
+                                  mount,
+                                  clip = kwargs.get('clip'),
+                                  qr = kwargs.get('qr'),
+                                  seconds = kwargs.get('seconds', constants.CLIP_TIMEOUT),
+                                  printme = True)
+            if not any((kwargs.get('clip'), kwargs.get('qr'))):
+                print(data)
+        elif oper == 'import':
+            self.convert(mount,
+                         force = kwargs.get('force', False),
+                         gpghome = kwargs.get('gpghome', constants.GPG_HOMEDIR),
+                         pass_dir = kwargs.get('pass_dir', constants.PASS_DIR),
+                         flat = kwargs.get('flat', False))
+        # git, verify, help, and version have nothing to do here (verify happens on config load).
+        return(None)
+
+    def execute(self, oper, **kwargs):
+        # Run a CLI operation (as named in args.parseArgs()) with the parsed arguments.
+        start = time.monotonic()
+        with profiler.phase('command'):
+            try:
+                self._execute(oper, **kwargs)
+            except hvac.exceptions.VaultDown:
+                # The cached seal status is stale (Vault was sealed since); check again (and unseal if we can).
+                cache.clearState('server', self.uri)
+                if oper not in _readonly_opers:
+                    raise
+                _logger.debug('Vault is down or sealed; re-checking seal status and retrying {0}.'.format(oper))
+                self._checkSeal(refresh = True)
+                self._execute(oper, **kwargs)
+            except hvac.exceptions.InvalidPath as e:
+                # A mount may have been removed or changed type since the mounts were cached.
+                if not (self.mount is not None and self.mount.from_cache and _isMountError(e)):
+                    raise
+                self.mount.clearCache()
+                self.mount.getSysMounts(refresh = True)
+                if oper not in _readonly_opers:
+                    raise
+                _logger.debug('Cached mounts are out of date ({0}); retrying {1}.'.format(e, oper))
+                self._execute(oper, **kwargs)
+        metrics.observe('vaultpass_operation_duration_seconds', (('operation', oper), ), (time.monotonic() - start))
+        return(None)
+
     def generateSecret(self,
                        path,
                        mount,
@@ -307,26 +574,163 @@ class VaultPass(object):
                        force = False,
                        length = constants.GENERATED_LENGTH,
                        printme = False,
+                       words = None,
+                       wordlist_path = None,
+                       delimiter = constants.PASSPHRASE_DELIMITER,
                        *args, **kwargs):
+        if kname:
+            path = '/'.join((path.strip('/'), kname))
+        written = self.generateSecrets([path],
+                                       mount,
+                                       symbols = symbols,
+                                       chars = chars,
+                                       chars_plain = chars_plain,
+                                       force = force,
+                                       length = length,
+                                       words = words,
+                                       wordlist_path = wordlist_path,
+                                       delimiter = delimiter)
+        passwd = list(written.values())[0]
+        self._showSecret(passwd, clip = clip, qr = qr, seconds = seconds, printme = printme)
+        return(passwd)
+
+    def generateSecrets(self,
+                        paths,
+                        mount,
+                        symbols = True,
+                        chars = constants.SELECTED_PASS_CHARS,
+                        chars_plain = constants.SELECTED_PASS_NOSYMBOL_CHARS,
+                        force = False,
+                        length = constants.GENERATED_LENGTH,
+                        words = None,
+                        wordlist_path = None,
+                        delimiter = constants.PASSPHRASE_DELIMITER,
+                        output = None,
+                        recipients = None,
+                        gpghome = constants.GPG_HOMEDIR,
+                        printme = False,
+                        *args, **kwargs):
+        # paths are PATH/TO/SECRET (the last component being the key name) or (PATH/TO/SECRET, LENGTH) pairs. All the
+        # keys of a secret path are written in one request, and those writes are fanned out within the shared
+        # concurrency budget. Returns {(path, kname): password} for everything that was written.
+        if output and not recipients:
+            _logger.error('No recipient for encrypted output')
+            _logger.debug('Writing generated secrets to {0} requires at least one GPG recipient.'.format(output))
+            raise ValueError('No recipient for encrypted output')
+        keys = None
+        if output:
+            # All of this is checked before anything is written, so there's never a reason to print them instead.
+            output = os.path.abspath(os.path.expanduser(output))
+            if not os.path.isdir(os.path.dirname(output)):
+                _logger.error('Output directory does not exist')
+                _logger.debug('The directory for {0} does not exist.'.format(output))
+                raise ValueError('Output directory does not exist')
+            gpg = gpg_handler.GPG(home = gpghome)
+            keys = gpg.getKeys(recipients)
         charset = {'simple': chars_plain,
                    'complex': chars}
-        pg_args = {'length': length,
-                   'chars': charset,
-                   'charset': ('complex' if symbols else 'simple')}
-        pg = pwgen.genPass(**pg_args)
-        pg.genPW()
-        passwd = pg.pw
-        if not kname:
-            lpath = path.split('/')
-            kname = lpath[-1]
-            path = '/'.join(lpath[0:-1])
-        args = {'secret_dict': {kname: passwd},
-                'path': path,
-                'mount': mount,
-                'force': force}
-        self.createSecret(**args)
-        self.getSecret(path, mount, kname = kname, clip = clip, qr = qr, seconds = seconds, printme = printme)
-        return(passwd)
+        streams = {}
+        jobs = {}
+        for p in paths:
+            plen = length
+            if isinstance(p, (tuple, list)):
+                p, plen = p
+            lpath = p.strip('/').split('/')
+            if len(lpath) < 2:
+                _logger.error('Invalid secret path')
+                _logger.debug('The path {0} must be PATH/TO/SECRET (a path and a key name).'.format(p))
+                raise ValueError('Invalid secret path')
+            if plen not in streams:
+                pg = pwgen.genPass(passlen = plen,
+                                   chars = charset,
+                                   charset = ('complex' if symbols else 'simple'),
+                                   words = words,
+                                   wordlist_path = wordlist_path,
+                                   delimiter = delimiter)
+                streams[plen] = pg.genPasswords()
+            jobs.setdefault('/'.join(lpath[0:-1]), {})[lpath[-1]] = next(streams[plen])
+        mtype = self.mount.getMountType(mount)
+        reader = self._getHandler(mount, func = 'read')
+        writer = self._getHandler(mount, func = 'write')
+
+        def _write(job):
+            # Returns (status, error). status is 'ok', 'clash' or 'failed' (nothing was written), or 'unknown' (the
+            # write itself failed, so it may or may not have been stored).
+            path, data = job
+            try:
+                try:
+                    existing = reader(path = path, mount_point = mount)
+                    if mtype in ('cubbyhole', 'kv1'):
+                        existing = existing['data']
+                    elif mtype == 'kv2':
+                        existing = existing['data']['data']
+                except hvac.exceptions.InvalidPath:
+                    existing = {}
+                existing = dict(existing or {})
+            except Exception as e:
+                return('failed', e)
+            clashes = [k for k in data.keys() if k in existing]
+            if clashes and not force:
+                return('clash', ', '.join(clashes))
+            for k in clashes:
+                _logger.warning('A secret named {0} at {1}:{2} exists; overwriting it.'.format(k, mount, path))
+            existing.update(data)
+            try:
+                writer(path = path, mount_point = mount, secret = existing)
+            except Exception as e:
+                return('unknown', e)
+            finally:
+                self._invalidate(mount, path)
+            return('ok', None)
+
+        gov = governor.getGovernor()
+        written = {}
+        failed = {'clash': [], 'failed': [], 'unknown': []}
+        lines = []
+        jobs = list(jobs.items())
+        try:
+            for idx in range(0, len(jobs), _generate_batch):
+                batch = jobs[idx:(idx + _generate_batch)]
+                for (path, data), (status, err) in zip(batch, gov.map(_write, batch)):
+                    if status != 'ok':
+                        _logger.debug('Could not write {0}:{1} ({2}): {3}'.format(mount, path, status, err))
+                        if status == 'clash':
+                            failed[status].append('{0}:{1} ({2})'.format(mount, path, err))
+                        else:
+                            failed[status].append('{0}:{1}'.format(mount, path))
+                        if status != 'unknown':
+                            continue
+                    for k, v in data.items():
+                        if status == 'ok':
+                            written[(path, k)] = v
+                        # Even if it's unknown whether Vault has it, the value shouldn't be lost.
+                        line = '{0}\t{1}'.format('/'.join((mount, path, k)), v)
+                        if output:
+                            lines.append(line)
+                        elif printme:
+                            print(line, flush = True)
+        finally:
+            if output and lines:
+                try:
+                    cache.writeFile(output, gpg.encryptData('\n'.join(lines) + '\n', keys))
+                    _logger.debug('Wrote {0} generated secret(s) to {1}'.format(len(lines), output))
+                except Exception as e:
+                    # They're already in Vault; printing them is better than losing them.
+                    _logger.error('Could not write encrypted output; printing the generated secrets instead')
+                    _logger.debug('Writing {0} failed: {1}'.format(output, e))
+                    for line in lines:
+                        print(line, flush = True)
+                    raise RuntimeError('Could not write encrypted output')
+        if failed['clash']:
+            _logger.error('Not overwriting existing secrets (use -f/--force): {0}'.format(', '.join(failed['clash'])))
+        if failed['failed']:
+            _logger.error('Could not write: {0}'.format(', '.join(failed['failed'])))
+        if failed['unknown']:
+            _logger.error('Writes failed, but may have been stored (their values are in the output '
+                          'anyway): {0}'.format(', '.join(failed['unknown'])))
+        if any(failed.values()):
+            raise RuntimeError('Some secrets could not be generated')
+        return(written)
 
     def getClient(self):
         auth_xml = self.cfg.xml.find('.//auth')
@@ -346,7 +750,9 @@ class VaultPass(object):
             if not confname or confname != authmethod_xml.tag:
                 continue
             self.auth = c(self.uri,
-                          authmethod_xml)
+                          authmethod_xml,
+                          session = self.session,
+                          cache_token = (auth_xml.attrib.get('cacheToken', 'true').lower() in ('true', '1')))
             _logger.debug('Found auth method: {0}'.format(self.auth.name))
             break
         if not self.auth:
@@ -354,10 +760,7 @@ class VaultPass(object):
             _logger.error('Invalid auth configuration')
             raise RuntimeError('Invalid auth configuration')
         self.client = self.auth.client
-        if not self.client.sys.is_initialized() and not self.initialize:
-            _logger.debug('Vault instance is not initialized. Please initialize (and configure, if necessary) first.')
-            _logger.error('Not initialized')
-            raise RuntimeError('Not initialized')
+        # Whether Vault is initialized is checked (along with the seal status) in _checkSeal().
         return(None)
 
     def getSecret(self,
@@ -374,7 +777,10 @@ class VaultPass(object):
                 'mount_point': mount}
         handler = self._getHandler(mount, func = 'read')
         try:
-            data = handler(**args)
+            if self.secret_cache is not None:
+                data = self.secret_cache.get(mount, path, (lambda: handler(**args)))
+            else:
+                data = handler(**args)
             if mtype in ('cubbyhole', 'kv1'):
                 data = data['data']
             elif mtype == 'kv2':
@@ -382,7 +788,10 @@ class VaultPass(object):
             if kname:
                 data = data.get(kname)
         except hvac.exceptions.InvalidPath as e:
-            lpath = path.split('/')
+            lpath = path.strip('/').split('/')
+            if len(lpath) < 2 or _isMountError(e):
+                # Nothing further up to look for it as a key in (or it's the mount that's wrong; see execute()).
+                raise
             path = '/'.join(lpath[0:-1])
             args = {'path': path,
                     'kname': lpath[-1],
@@ -393,42 +802,7 @@ class VaultPass(object):
                     'printme': printme}
             # Add return here?
             data = self.getSecret(**args)
-        if qr not in (False, None):
-            qrdata, has_x = QR.genQr(data, image = True)
-            if has_x:
-                fpath = tempfile.mkstemp(prefix = '.vaultpass.qr.', suffix = '.svg', dir = '/dev/shm')[1]
-                _logger.debug('Writing to {0} so it can be displayed'.format(fpath))
-                with open(fpath, 'wb') as fh:
-                    fh.write(qrdata.read())
-                if printme:
-                    _logger.debug('Opening {0} in the default image viwer application'.format(fpath))
-                    # We intentionally want this to block, as most image viewers will  unload the image once the file
-                    # is deleted and we can probably delete it faster than the user can save it elsewhere or
-                    # scan it with their phone.
-                    # TODO: we could use Popen() and do a countdown for "seconds" seconds, and then kill the viewer.
-                    #       But that breaks compat with Pass' behaviour.
-                    if printme:
-                        print('Now displaying generated QR code. Please close the viewer when done saving/scanning to '
-                              'securely clean up the generated file and continue...')
-                    cmd = subprocess.run(['xdg-open', fpath], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-                    if cmd.returncode != 0:
-                        _logger.error('xdg-open returned non-zero status code')
-                        for x in ('stdin', 'stdout'):
-                            o = getattr(cmd, x)
-                            if not o:
-                                continue
-                            o = o.decode('utf-8').strip()
-                            if o != '':
-                                _logger.debug('{0}: {1}'.format(x.upper(), o))
-                    if printme:
-                        print('Done. Deleting generated file.')
-                    os.remove(fpath)
-            elif printme:
-                print(qrdata.read())
-            qrdata.seek(0, 0)
-            del(qrdata)
-        if clip not in (False, None):
-            clipboard.pasteClipboard(data, seconds = seconds, printme = printme)
+        self._showSecret(data, clip = clip, qr = qr, seconds = seconds, printme = printme)
         return(data)
 
     def initVault(self, *args, **kwargs):
@@ -550,18 +924,36 @@ class VaultPass(object):
         print('This may take a while...')
         ptrn = re.compile(pattern)
         self.mount.getSecretsTree(mounts = mount)
-        for p in self.mount.flatpaths:
-            data = self.getSecret(p, mount)
+        mtype = self.mount.getMountType(mount)
+        handler = self._getHandler(mount, func = 'read')
+        prefix = '{0}/'.format(mount)
+        # The flattened paths include the mount itself and the directories; only secrets can be read.
+        paths = sorted(p[len(prefix):] for p in self.mount.getFlatPaths() if p.startswith(prefix) and p != prefix)
+
+        def _read(p):
+            try:
+                data = handler(path = p, mount_point = mount)
+            except hvac.exceptions.InvalidPath:
+                return(None)
+            if mtype in ('cubbyhole', 'kv1'):
+                data = data['data']
+            elif mtype == 'kv2':
+                data = data['data']['data']
+            return(data)
+
+        # Reads are fanned out within the shared concurrency budget.
+        gov = governor.getGovernor()
+        for p, data in zip(paths, gov.map(_read, paths)):
             if data:
                 for k, v in data.items():
-                    if ptrn.search(v):
+                    if ptrn.search(str(v)):
                         print('/'.join((mount, p, k)))
         return(None)
 
     def searchSecretNames(self, pattern, mount, *args, **kwargs):
         ptrn = re.compile(pattern)
         self.mount.getSecretsTree(mounts = mount)
-        for p in self.mount.flatpaths:
+        for p in sorted(self.mount.getFlatPaths()):
             n = p.split('/')[-1]
             if ptrn.search(n):
                 print(p)
@@ -0,0 +1,227 @@
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+##
+from . import constants
+from . import secretcache
+
+
+_logger = logging.getLogger()
+# These (see VaultPass.execute()) don't prompt or need the caller's terminal/display, so the agent can run them.
+_agent_opers = ('find', 'grep', 'list', 'ls', 'search', 'show')
+# These change secrets, so the agent's cache is invalidated after they're run locally.
+_write_opers = ('add', 'copy', 'cp', 'delete', 'destroy', 'edit', 'generate', 'import', 'insert', 'move', 'mv',
+                'remove', 'rename', 'rm')
+# Never sent to (or used from) the agent; these are the client's own.
+_local_args = ('cfg', 'loglevel', 'no_agent', 'profile', 'socket')
+
+
+def _getPeerUID(sock):
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    return(uid)
+
+
+def _recv(fh):
+    line = fh.readline()
+    if not line:
+        return(None)
+    return(json.loads(line.decode('utf-8')))
+
+
+def _send(fh, obj):
+    fh.write(json.dumps(obj).encode('utf-8') + b'\n')
+    fh.flush()
+    return(None)
+
+
+def _call(socket_path, req):
+    if not os.path.exists(socket_path):
+        return(None)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(constants.AGENT_CONNECT_TIMEOUT)
+        sock.connect(socket_path)
+        sock.settimeout(None)  # Some operations (e.g. grep) legitimately take a while.
+        with sock.makefile('rwb') as fh:
+            _send(fh, req)
+            resp = _recv(fh)
+    except (OSError, ValueError) as e:
+        _logger.debug('Could not use the agent at {0}: {1}'.format(socket_path, e))
+        return(None)
+    finally:
+        sock.close()
+    return(resp)
+
+
+def canServe(oper, **kwargs):
+    if oper not in _agent_opers:
+        return(False)
+    if kwargs.get('clip') or kwargs.get('qr'):
+        # The clipboard and QR viewer belong to the caller's session, not the agent's.
+        return(False)
+    return(True)
+
+
+def request(oper, cfg, socket_path = constants.AGENT_SOCKET, **kwargs):
+    # Run an operation in the agent. Returns None (so the caller should just do it itself) if there's no agent for
+    # this config or it can't run this operation.
+    if not canServe(oper, **kwargs):
+        return(None)
+    resp = _call(socket_path, {'cfg': os.path.abspath(os.path.expanduser(cfg)),
+                               'oper': oper,
+                               'kwargs': {k: v for k, v in kwargs.items() if k not in _local_args}})
+    if not resp or resp.get('status') == 'unsupported':
+        return(None)
+    sys.stdout.write(resp.get('stdout', ''))
+    sys.stdout.flush()
+    if resp.get('status') != 'ok':
+        _logger.error('Agent operation failed: {0}'.format(resp.get('error')))
+        raise RuntimeError('Agent operation failed: {0}'.format(resp.get('error')))
+    return(True)
+
+
+def invalidate(oper, cfg, socket_path = constants.AGENT_SOCKET, **kwargs):
+    # Tell the agent (if there is one) to drop its cached secrets after oper was run locally.
+    if oper not in _write_opers:
+        return(None)
+    _call(socket_path, {'cfg': os.path.abspath(os.path.expanduser(cfg)), 'oper': 'invalidate'})
+    return(None)
+
+
+class _StdoutProxy(object):
+    # Stands in for sys.stdout in the agent so that each request's thread can capture its own output
+    # (contextlib.redirect_stdout() is process-wide).
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def __getattr__(self, attr):
+        buf = getattr(self.local, 'buf', None)
+        return(getattr((self.stream if buf is None else buf), attr))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        uid = _getPeerUID(self.request)
+        if uid != os.getuid():
+            # The socket's directory is 0700, so this shouldn't happen; but root (or a mistake) could get here.
+            _logger.warning('Refused agent connection from UID {0}'.format(uid))
+            return(None)
+        try:
+            req = _recv(self.rfile)
+        except ValueError:
+            _logger.debug('Ignoring malformed agent request.')
+            return(None)
+        if not req:
+            return(None)
+        _send(self.wfile, self.server.agent.execute(req))
+        return(None)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Agent(object):
+    def __init__(self,
+                 vaultpass,
+                 cfg,
+                 socket_path = constants.AGENT_SOCKET,
+                 cache_ttl = constants.SECRET_CACHE_TTL,
+                 cache_size = constants.SECRET_CACHE_SIZE):
+        self.vp = vaultpass
+        self.cfg = os.path.abspath(os.path.expanduser(cfg))
+        self.socket_path = os.path.abspath(os.path.expanduser(socket_path))
+        self.server = None
+        self.stdout = None
+        if cache_ttl > 0 and cache_size > 0:
+            self.vp.secret_cache = secretcache.SecretCache(ttl = cache_ttl, size = cache_size)
+
+    def _bind(self):
+        sockdir = os.path.dirname(self.socket_path)
+        os.makedirs(sockdir, exist_ok = True, mode = 0o0700)
+        os.chmod(sockdir, 0o0700)
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                _logger.debug('Removing stale agent socket {0}'.format(self.socket_path))
+                os.remove(self.socket_path)
+            else:
+                _logger.error('An agent is already running')
+                _logger.debug('An agent is already listening on {0}.'.format(self.socket_path))
+                raise RuntimeError('An agent is already running')
+            finally:
+                probe.close()
+        oldmask = os.umask(0o0077)
+        try:
+            self.server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(oldmask)
+        self.server.agent = self
+        return(None)
+
+    def execute(self, req):
+        if req.get('cfg') != self.cfg:
+            _logger.debug('Agent request for config {0}, but we have {1}.'.format(req.get('cfg'), self.cfg))
+            return({'status': 'unsupported'})
+        oper = req.get('oper')
+        kwargs = req.get('kwargs') or {}
+        if oper == 'invalidate':
+            if self.vp.secret_cache is not None:
+                self.vp.secret_cache.clear()
+            # Paths may have been added, moved or removed; the next find/grep/ls walks the tree again.
+            if self.vp.mount is not None:
+                self.vp.mount.clearPaths()
+            # Read nodes may not have that write yet either.
+            if self.vp.session is not None:
+                self.vp.session.pinReads()
+            return({'status': 'ok'})
+        if not canServe(oper, **kwargs):
+            return({'status': 'unsupported'})
+        kwargs['oper'] = oper
+        out = io.StringIO()
+        self.stdout.local.buf = out
+        try:
+            self.vp.execute(**kwargs)
+        except Exception as e:
+            _logger.debug('Agent operation {0} failed: {1}'.format(oper, e))
+            return({'status': 'error', 'error': str(e), 'stdout': out.getvalue()})
+        finally:
+            self.stdout.local.buf = None
+        return({'status': 'ok', 'stdout': out.getvalue()})
+
+    def serve(self):
+        self._bind()
+        self.stdout = _StdoutProxy(sys.stdout)
+        sys.stdout = self.stdout
+        # So systemd (or kill) stopping us still cleans up the socket.
+        signal.signal(signal.SIGTERM, (lambda signum, frame: sys.exit(0)))
+        if self.vp.auth is not None:
+            self.vp.auth.keepAlive()
+        _logger.info('Agent listening on {0}'.format(self.socket_path))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            sys.stdout = self.stdout.stream
+            if self.vp.auth is not None:
+                self.vp.auth.stopKeepAlive()
+            if self.vp.secret_cache is not None:
+                self.vp.secret_cache.clear()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+        return(None)
@@ -1,100 +1,50 @@
 import argparse
 import os
+import sys
 ##
 from . import constants
 
 
-def parseArgs():
-    args = argparse.ArgumentParser(description = 'VaultPass - a Vault-backed Pass replacement',
-                                   prog = constants.NAME,
-                                   epilog = ('This program has context-specific help. Try "... cp --help". '
-                                             'This help output is intentionally terse; see "man 1 vaultpass" and the '
-                                             'README for more complete information, configuration, and usage.'))
-    args.add_argument('-V', '--version',
-                      action = 'version',
-                      version = '{0} {1}'.format(constants.NAME, constants.VERSION))
-    args.add_argument('-c', '--config',
-                      dest = 'cfg',
-                      default = '~/.config/vaultpass.xml',
-                      help = ('The path to your configuration file. Default: ~/.config/vaultpass.xml'))
-    args.add_argument('-l', '--loglevel',
-                      dest = 'loglevel',
-                      default = constants.DEFAULT_LOGLEVEL,
-                      help = ('The log level. Default: {0}').format(constants.DEFAULT_LOGLEVEL_NAME))
-    # I can't get this to change in the logger root. TODO.
-    # args.add_argument('-L', '--logfile',
-    #                   dest = 'logfile',
-    #                   default = constants.DEFAULT_LOGFILE,
-    #                   help = ('The file to use for logging. '
-    #                           'Default: {0}').format(constants.DEFAULT_LOGFILE))
-    args.add_argument('-m', '--mount',
-                      dest = 'mount',
-                      default = constants.SELECTED_DEFAULT_MOUNT,
-                      help = (('The mount to use in OPERATION. '
-                               'If not specified, assume a mount named '
-                               '"{0}"').format(constants.SELECTED_DEFAULT_MOUNT)))
-    # I wish argparse supported default subcommands. It doesn't as of python 3.8.
-    subparser = args.add_subparsers(help = ('Operation to perform'),
-                                    metavar = 'OPERATION',
-                                    dest = 'oper')
-    cp = subparser.add_parser('cp',
-                              description = ('Copy a secret from one path to another'),
-                              help = ('Copy a secret from one path to another'),
-                              aliases = ['copy'])
-    edit = subparser.add_parser('edit',
-                                description = ('Edit an existing secret or create it if it does not exist'),
-                                help = ('Edit an existing secret or create it if it does not exist'))
-    find = subparser.add_parser('find',
-                                description = ('Find the path to a secret given a regex of the name'),
-                                help = ('Find the path to a secret given a regex of the name'),
-                                aliases = ['search'])
-    gen = subparser.add_parser('generate',
-                               description = ('Generate a password/passphrase'),
-                               help = ('Generate a password/passphrase'))
-    # Dummy opt; do nothing
-    git = subparser.add_parser('git',
-                               description = ('This operation does nothing except maintain compatibility'))
-    grep = subparser.add_parser('grep',
-                                description = ('Search secret content by regex'),
-                                help = ('Search secret content by regex'))
-    # This just does the same as -h/--help.
-    helpme = subparser.add_parser('help',
-                                  description = ('Show this help and exit'),
-                                  help = ('Show this help and exit'))
-    initvault = subparser.add_parser('init',
-                                     description = ('This operation does nothing except maintain compatibility'),
-                                     help = ('This operation does nothing except maintain compatibility'))
-    insertval = subparser.add_parser('insert',
-                                     description = ('Add a new secret (or overwrite one)'),
-                                     help = ('Add a new secret (or overwrite one)'),
-                                     aliases = ['add'])
-    ls = subparser.add_parser('ls',
-                              description = ('List names of secrets available'),
-                              help = ('List names of secrets available'),
-                              aliases = ['list'])
-    mv = subparser.add_parser('mv',
-                              description = ('Moves a secret to a different path'),
-                              help = ('Moves a secret to a different path'),
-                              aliases = ['rename', 'move'])
-    rm = subparser.add_parser('rm',
-                              description = ('Delete a secret'),
-                              help = ('Delete a secret'),
-                              aliases = ['remove', 'delete'])
-    destroy = subparser.add_parser('destroy',
-                                   description = ('Destroy a secret permanently'),
-                                   help = ('Destroy a secret permanently'))
-    show = subparser.add_parser('show',
-                                description = ('Print/fetch a secret'),
-                                help = ('Print/fetch a secret'))
-    version = subparser.add_parser('version',
-                                   description = ('Print the VaultPass version and exit'),
-                                   help = ('Print the VaultPass version and exit'))
-    importvault = subparser.add_parser('import',
-                                       description = ('Import your existing Pass into Vault'),
-                                       help = ('Import your existing Pass into Vault'))
-    verify = subparser.add_parser('verify',
-                                  description = ('Verify the validity and syntax of your configuration file'),
-                                  help = ('Verify the validity and syntax of your configuration file'))
+# Global options that take a value, so we can skip over them when looking for the operation.
+_valued_opts = ('-c', '--config', '-l', '--loglevel', '-m', '--mount', '-S', '--socket')
+
+
+def _getOper(argv, choices):
+    # Returns the subparser for the operation in argv, or None if it can't be (cheaply) determined.
+    skip = False
+    for a in argv:
+        if skip:
+            skip = False
+            continue
+        if a in _valued_opts:
+            skip = True
+            continue
+        if a.startswith('-'):
+            continue
+        return(choices.get(a))
+    return(None)
+
+
+def _addAgent(agent):
+    # AGENT
+    # agent.Agent().serve()
+    agent.add_argument('-t', '--cache-ttl',
+                       dest = 'cache_ttl',
+                       type = float,
+                       default = constants.SECRET_CACHE_TTL,
+                       help = ('How many seconds to keep secrets that were read in memory, to answer repeated '
+                               'requests for them. 0 disables the cache. Default: {0}').format(
+                                                                                    constants.SECRET_CACHE_TTL))
+    agent.add_argument('-n', '--cache-size',
+                       dest = 'cache_size',
+                       type = int,
+                       default = constants.SECRET_CACHE_SIZE,
+                       help = ('The most secrets to keep in memory at once. 0 disables the cache. '
+                               'Default: {0}').format(constants.SECRET_CACHE_SIZE))
+    return(None)
+
+
+def _addCp(cp):
     # CP/COPY
     # vp.copySecret()
     cp.add_argument('-f', '--force',
@@ -112,6 +62,10 @@ def parseArgs():
     cp.add_argument('newpath',
                     metavar = 'NEWPATH',
                     help = ('The new ("destination") path for the secret'))
+    return(None)
+
+
+def _addEdit(edit):
     # EDIT
     # vp.editSecret()
     edit.add_argument('-e', '--editor',
@@ -124,11 +78,19 @@ def parseArgs():
                       metavar = 'PATH_TO_SECRET',
                       help = ('Insert a new secret at PATH_TO_SECRET if it does not exist, otherwise edit it using '
                               'your default editor (see -e/--editor)'))
+    return(None)
+
+
+def _addFind(find):
     # FIND/SEARCH
     # vp.searchSecretNames()
     find.add_argument('pattern',
                       metavar = 'NAME_PATTERN',
                       help = ('List secrets\' paths whose names match the regex NAME_PATTERN'))
+    return(None)
+
+
+def _addGenerate(gen):
     # GENERATE
     # vp.generateSecret(printme = True)
     # TODO: feature parity with passgen (spaces? etc.)
@@ -167,12 +129,60 @@ def parseArgs():
                      action = 'store_true',
                      help = ('If specified, display the password as a QR code (graphically or in-terminal depending '
                              'on supported environment)'))
+    gen.add_argument('-w', '--words',
+                     dest = 'words',
+                     metavar = 'WORDS',
+                     type = int,
+                     default = None,
+                     help = ('If specified, generate a passphrase of this many words (from -W/--wordlist) instead of '
+                             'a password; LENGTH is ignored'))
+    gen.add_argument('-W', '--wordlist',
+                     dest = 'wordlist_path',
+                     metavar = 'PATH',
+                     default = None,
+                     help = ('The wordlist (one word per line, or diceware-style) to generate passphrases from. '
+                             'Default: the first of {0}').format(', '.join(constants.WORDLISTS)))
+    gen.add_argument('-d', '--delimiter',
+                     dest = 'delimiter',
+                     default = constants.PASSPHRASE_DELIMITER,
+                     help = ('What to put between the words of a passphrase. '
+                             'Default: "{0}"').format(constants.PASSPHRASE_DELIMITER))
     gen.add_argument('-f', '--force',
                      dest = 'force',
+                     action = 'store_true',
                      help = ('If specified and PATH/TO/SECRET exists, overwrite without prompting first'))
+    gen.add_argument('-M', '--manifest',
+                     dest = 'manifest',
+                     metavar = 'FILE',
+                     default = None,
+                     help = ('If specified, generate every secret listed in FILE ("-" for stdin) in one batch. Each '
+                             'line is a PATH/TO/SECRET, optionally followed by a LENGTH; blank lines and lines '
+                             'starting with "#" are ignored. Each secret is printed as MOUNT/PATH/TO/SECRET, a tab, and '
+                             'its value (unless -o/--output is given)'))
+    gen.add_argument('-o', '--output',
+                     dest = 'output',
+                     metavar = 'FILE',
+                     default = None,
+                     help = ('If specified (with -M/--manifest), write the generated secrets to FILE, encrypted '
+                             'with GPG (see -r/--recipient), instead of printing them'))
+    gen.add_argument('-r', '--recipient',
+                     dest = 'recipients',
+                     metavar = 'KEY',
+                     action = 'append',
+                     default = None,
+                     help = ('A GPG key (fingerprint, key ID, or exact user ID or email; it must match exactly one '
+                             'fully valid key) to encrypt -o/--output to. May be specified multiple times'))
+    gen.add_argument('-H', '--gpg-homedir',
+                     dest = 'gpghome',
+                     default = constants.GPG_HOMEDIR,
+                     metavar = '/PATH/TO/GNUPG/HOMEDIR',
+                     help = ('The GnuPG "homedir" to find -r/--recipient keys in. '
+                             'Default: {0}').format(constants.GPG_HOMEDIR))
     gen.add_argument('path',
                      metavar = 'PATH/TO/SECRET',
-                     help = ('The path to the secret'))
+                     nargs = '?',
+                     default = None,
+                     help = ('The path to the secret (optional if -M/--manifest is given)'))
     gen.add_argument('length',
                      type = int,
                      default = constants.GENERATED_LENGTH,
@@ -180,12 +190,20 @@ def parseArgs():
                      metavar = 'LENGTH',
                      help = ('The length (number of characters) in the generated password. '
                              'Default: {0}').format(constants.GENERATED_LENGTH))
+    return(None)
+
+
+def _addGit(git):
     # GIT
     git.add_argument('dummy_opts',
                      nargs = '+',
                      default = None,
                      metavar = 'dummy',
                      help = ('(Unused; kept for compatibility reasons)'))
+    return(None)
+
+
+def _addGrep(grep):
     # GREP
     # vp.searchSecrets()
     # I wish argparse supported arbitrary arguments.
@@ -349,7 +367,10 @@ def parseArgs():
     grep.add_argument('pattern',
                       metavar = 'REGEX_PATTERN',
                       help = ('Regex pattern to search passwords'))
-    # HELP has no arguments.
+    return(None)
+
+
+def _addInit(initvault):
     # INIT
     # vp.initVault()
     initvault.add_argument('-p', '--path',
@@ -358,6 +379,10 @@ def parseArgs():
     initvault.add_argument('gpg_id',
                            metavar = 'GPG_KEY_ID',
                            help = ('(Dummy option; kept for compatibility reasons)'))
+    return(None)
+
+
+def _addInsert(insertval):
     # INSERT
     # vp.insertSecret()
     # TODO: if -e/--echo is specified and sys.stdin, use sys.stdin rather than prompt
@@ -381,6 +406,10 @@ def parseArgs():
     insertval.add_argument('path',
                            metavar = 'PATH/TO/SECRET',
                            help = ('The path to the secret'))
+    return(None)
+
+
+def _addLs(ls):
     # LS
     # vp.listSecretNames()/vp.mount.print() ?
     ls.add_argument('-o', '--output',
@@ -400,6 +429,10 @@ def parseArgs():
     ls.add_argument('path',
                     metavar = 'PATH/TO/TREE/BASE',
                     help = ('List names of secrets recursively, starting at PATH/TO/TREE/BASE'))
+    return(None)
+
+
+def _addMv(mv):
     # MV
     # vp.copySecret(remove_old = True)
     mv.add_argument('-f', '--force',
@@ -412,6 +445,10 @@ def parseArgs():
     mv.add_argument('newpath',
                     metavar = 'NEWPATH',
                     help = ('The new ("destination") path for the secret'))
+    return(None)
+
+
+def _addRm(rm):
     # RM
     # vp.deleteSecret()
     # Is this argument even sensible since it isn't a filesystem?
@@ -426,6 +463,10 @@ def parseArgs():
     rm.add_argument('path',
                     metavar = 'PATH/TO/SECRET',
                     help = ('The path to the secret or subdirectory'))
+    return(None)
+
+
+def _addDestroy(destroy):
     # DESTROY
     destroy.add_argument('-r', '--recursive',
                          dest = 'recurse',
@@ -438,6 +479,10 @@ def parseArgs():
     destroy.add_argument('path',
                          metavar = 'PATH/TO/SECRET',
                          help = ('The path to the secret or subdirectory'))
+    return(None)
+
+
+def _addShow(show):
     # SHOW
     # vp.getSecret(printme = True)
     # TODO: does the default overwrite the None if not specified?
@@ -459,7 +504,10 @@ def parseArgs():
     show.add_argument('path',
                       metavar = 'PATH/TO/SECRET',
                       help = ('The path to the secret'))
-    # VERSION has no args.
+    return(None)
+
+
+def _addImport(importvault):
     # IMPORT
     # vp.convert()
     importvault.add_argument('-d', '--directory',
@@ -487,5 +535,138 @@ def parseArgs():
                              help = 'The mount name in Vault to import into (Pass\' hierarchy will be recreated). '
                                     'This mount MUST exist first and MUST be KV2 if auth is provided that does not '
                                     'have CREATE access on /sys/mounts!')
-    # VERIFY has no args.
+    return(None)
+
+
+def parseArgs(argv = None, lazy = True):
+    args = argparse.ArgumentParser(description = 'VaultPass - a Vault-backed Pass replacement',
+                                   prog = constants.NAME,
+                                   epilog = ('This program has context-specific help. Try "... cp --help". '
+                                             'This help output is intentionally terse; see "man 1 vaultpass" and the '
+                                             'README for more complete information, configuration, and usage.'))
+    args.add_argument('-V', '--version',
+                      action = 'version',
+                      version = '{0} {1}'.format(constants.NAME, constants.VERSION))
+    args.add_argument('-c', '--config',
+                      dest = 'cfg',
+                      default = '~/.config/vaultpass.xml',
+                      help = ('The path to your configuration file. Default: ~/.config/vaultpass.xml'))
+    args.add_argument('-l', '--loglevel',
+                      dest = 'loglevel',
+                      default = constants.DEFAULT_LOGLEVEL,
+                      help = ('The log level. Default: {0}').format(constants.DEFAULT_LOGLEVEL_NAME))
+    args.add_argument('-P', '--profile',
+                      dest = 'profile',
+                      action = 'store_true',
+                      help = ('If specified, time every request to Vault and each phase of the operation and print a '
+                              'summary (with p50/p95/p99 latencies per endpoint) to stderr on exit'))
+    # I can't get this to change in the logger root. TODO.
+    # args.add_argument('-L', '--logfile',
+    #                   dest = 'logfile',
+    #                   default = constants.DEFAULT_LOGFILE,
+    #                   help = ('The file to use for logging. '
+    #                           'Default: {0}').format(constants.DEFAULT_LOGFILE))
+    args.add_argument('-m', '--mount',
+                      dest = 'mount',
+                      default = constants.SELECTED_DEFAULT_MOUNT,
+                      help = (('The mount to use in OPERATION. '
+                               'If not specified, assume a mount named '
+                               '"{0}"').format(constants.SELECTED_DEFAULT_MOUNT)))
+    args.add_argument('-S', '--socket',
+                      dest = 'socket',
+                      default = constants.AGENT_SOCKET,
+                      help = ('The path to the agent\'s socket (see the "agent" operation). '
+                              'Default: {0}').format(constants.AGENT_SOCKET))
+    args.add_argument('-A', '--no-agent',
+                      dest = 'no_agent',
+                      action = 'store_true',
+                      help = ('If specified, do not use a running agent even if there is one'))
+    # I wish argparse supported default subcommands. It doesn't as of python 3.8.
+    subparser = args.add_subparsers(help = ('Operation to perform'),
+                                    metavar = 'OPERATION',
+                                    dest = 'oper')
+    agent = subparser.add_parser('agent',
+                                 description = ('Run in the foreground as an agent, keeping the configuration, '
+                                                'authentication, and connections to Vault ready; other invocations '
+                                                'use it (over a Unix socket) instead of setting all that up '
+                                                'themselves'),
+                                 help = ('Run as an agent for other invocations to use'))
+    cp = subparser.add_parser('cp',
+                              description = ('Copy a secret from one path to another'),
+                              help = ('Copy a secret from one path to another'),
+                              aliases = ['copy'])
+    edit = subparser.add_parser('edit',
+                                description = ('Edit an existing secret or create it if it does not exist'),
+                                help = ('Edit an existing secret or create it if it does not exist'))
+    find = subparser.add_parser('find',
+                                description = ('Find the path to a secret given a regex of the name'),
+                                help = ('Find the path to a secret given a regex of the name'),
+                                aliases = ['search'])
+    gen = subparser.add_parser('generate',
+                               description = ('Generate a password/passphrase'),
+                               help = ('Generate a password/passphrase'))
+    # Dummy opt; do nothing
+    git = subparser.add_parser('git',
+                               description = ('This operation does nothing except maintain compatibility'))
+    grep = subparser.add_parser('grep',
+                                description = ('Search secret content by regex'),
+                                help = ('Search secret content by regex'))
+    # This just does the same as -h/--help.
+    helpme = subparser.add_parser('help',
+                                  description = ('Show this help and exit'),
+                                  help = ('Show this help and exit'))
+    initvault = subparser.add_parser('init',
+                                     description = ('This operation does nothing except maintain compatibility'),
+                                     help = ('This operation does nothing except maintain compatibility'))
+    insertval = subparser.add_parser('insert',
+                                     description = ('Add a new secret (or overwrite one)'),
+                                     help = ('Add a new secret (or overwrite one)'),
+                                     aliases = ['add'])
+    ls = subparser.add_parser('ls',
+                              description = ('List names of secrets available'),
+                              help = ('List names of secrets available'),
+                              aliases = ['list'])
+    mv = subparser.add_parser('mv',
+                              description = ('Moves a secret to a different path'),
+                              help = ('Moves a secret to a different path'),
+                              aliases = ['rename', 'move'])
+    rm = subparser.add_parser('rm',
+                              description = ('Delete a secret'),
+                              help = ('Delete a secret'),
+                              aliases = ['remove', 'delete'])
+    destroy = subparser.add_parser('destroy',
+                                   description = ('Destroy a secret permanently'),
+                                   help = ('Destroy a secret permanently'))
+    show = subparser.add_parser('show',
+                                description = ('Print/fetch a secret'),
+                                help = ('Print/fetch a secret'))
+    version = subparser.add_parser('version',
+                                   description = ('Print the VaultPass version and exit'),
+                                   help = ('Print the VaultPass version and exit'))
+    importvault = subparser.add_parser('import',
+                                       description = ('Import your existing Pass into Vault'),
+                                       help = ('Import your existing Pass into Vault'))
+    verify = subparser.add_parser('verify',
+                                  description = ('Verify the validity and syntax of your configuration file'),
+                                  help = ('Verify the validity and syntax of your configuration file'))
+    # Building every subcommand's arguments (grep alone has ~40) is wasted work for all but one of them, so by
+    # default only the one actually being run gets its arguments.
+    selected = (_getOper(sys.argv[1:] if argv is None else argv, subparser.choices) if lazy else None)
+    for p, builder in ((agent, _addAgent),
+                       (cp, _addCp),
+                       (edit, _addEdit),
+                       (find, _addFind),
+                       (gen, _addGenerate),
+                       (git, _addGit),
+                       (grep, _addGrep),
+                       (initvault, _addInit),
+                       (insertval, _addInsert),
+                       (ls, _addLs),
+                       (mv, _addMv),
+                       (rm, _addRm),
+                       (destroy, _addDestroy),
+                       (show, _addShow),
+                       (importvault, _addImport)):
+        if selected is None or p is selected:
+            builder(p)
     return(args)
@@ -1,8 +1,15 @@
 import logging
 import os
+import threading
+import time
 import warnings
 ##
 import hvac
+import hvac.exceptions
+##
+from . import cache
+from . import constants
+from . import keystore
 
 
 _logger = logging.getLogger()
@@ -11,12 +18,170 @@ _logger = logging.getLogger()
 class _AuthBase(object):
     name = '_AuthBase'
     client = None
+    # For the token cache; the identity is whatever distinguishes logins for this method (e.g. a username), and the
+    # secret is what the cached entry is encrypted with.
+    identity = None
+    cache_secret = None
+    high_entropy = False
 
-    def __init__(self, uri, auth_xml, *args, **kwargs):
+    def __init__(self, uri, auth_xml, session = None, cache_token = True, *args, **kwargs):
         self.uri = uri
         self.xml = auth_xml
+        self.session = session
+        self.cache_token = cache_token
+        self._use_cached = True
+        self._renewer = None
+        self._relogin_lock = threading.RLock()
+        self._upkeep = None
+        self._upkeep_stop = threading.Event()
         _logger.debug('Intialized instance of {0}'.format(self.name))
 
+    def _cacheName(self):
+        # Never the secret (the name isn't secret); keystore checks the entry was stored with the same one.
+        return(cache.getKey('token', self.uri, self.name, str(self.identity)))
+
+    def _getCachedToken(self):
+        # Applies a cached token if there's a usable one; returns True if so.
+        if not (self.cache_token and self._use_cached and self.cache_secret and keystore.isAvailable()):
+            return(False)
+        entry = keystore.getEntry(self._cacheName(), self.cache_secret, high_entropy = self.high_entropy)
+        if not entry:
+            _logger.debug('No cached token.')
+            return(False)
+        remaining = None
+        if entry.get('expires'):
+            remaining = entry['expires'] - time.time()
+            if remaining < constants.TOKEN_MIN_TTL:
+                _logger.debug('Cached token is about to expire; not using it.')
+                return(False)
+        self.client.token = entry['token']
+        if self.session is not None:
+            self.session.reauth = self._reauth
+        _logger.info('Using cached token.')
+        if remaining is not None and entry.get('renewable') and remaining < (entry['ttl'] *
+                                                                             constants.TOKEN_RENEW_FRACTION):
+            # Not a daemon thread; exiting waits for the renewal (one request) to finish.
+            self._renewer = threading.Thread(target = self._renewToken, name = 'vaultpass-renew')
+            self._renewer.start()
+        return(True)
+
+    def _reauth(self, rejected = None):
+        # The token was rejected (revoked, expired, etc.), so throw it away and log in again.
+        with self._relogin_lock:
+            if not self._use_cached:
+                # The login itself was rejected (so it's this thread, already logging in again).
+                return(None)
+            if rejected is not None and self.client.token != rejected:
+                # Another thread already did.
+                return(self.client.token)
+            keystore.delEntry(self._cacheName())
+            client = self.client
+            self._use_cached = False
+            try:
+                self.getClient()
+            finally:
+                self._use_cached = True
+            if self.client is not client:
+                # Everything else already holds a reference to the original client.
+                client.token = self.client.token
+                self.client = client
+            return(self.client.token)
+
+    def _keepToken(self):
+        # See keepAlive(). Renews the token once less than TOKEN_RENEW_FRACTION of its TTL is left; if it can't be
+        # renewed (any further), logs in again shortly before it expires.
+        renewed = False
+        while not self._upkeep_stop.is_set():
+            try:
+                data = self.client.auth.token.lookup_self()['data']
+            except Exception as e:
+                # A rejected token was already dealt with by the session (and this is retried with the new one).
+                _logger.debug('Could not look up token: {0}'.format(e))
+                self._upkeep_stop.wait(constants.TOKEN_UPKEEP_RETRY)
+                continue
+            ttl = data.get('ttl', 0)
+            if not ttl:
+                _logger.debug('Token never expires; no upkeep needed.')
+                return(None)
+            delay = ttl - (data.get('creation_ttl', ttl) * constants.TOKEN_RENEW_FRACTION)
+            if delay > 0:
+                renewed = False
+                self._upkeep_stop.wait(delay)
+                continue
+            if data.get('renewable') and not renewed:
+                renewed = True
+                self._renewToken()
+                continue
+            delay = ttl - constants.TOKEN_MIN_TTL
+            if delay > 0:
+                self._upkeep_stop.wait(delay)
+                continue
+            token = self.client.token
+            try:
+                self._reauth(rejected = token)
+            except Exception as e:
+                _logger.debug('Could not authenticate again: {0}'.format(e))
+                self._upkeep_stop.wait(constants.TOKEN_UPKEEP_RETRY)
+                continue
+            if self.client.token == token:
+                # e.g. a static token from the config; there's nothing to log in again with.
+                _logger.warning('Token is about to expire and cannot be renewed')
+                return(None)
+            _logger.info('Token could not be renewed; authenticated again.')
+            renewed = False
+        return(None)
+
+    def keepAlive(self):
+        # For long-running processes (the agent): the token is renewed on a schedule, and if Vault rejects it anyways
+        # (e.g. it was revoked), we log in again every time rather than only for a cached token's first use.
+        if self.session is not None:
+            self.session.reauth = self._reauth
+            self.session.keep_reauth = True
+        if self._upkeep is None:
+            self._upkeep = threading.Thread(target = self._keepToken, name = 'vaultpass-upkeep', daemon = True)
+            self._upkeep.start()
+        return(None)
+
+    def stopKeepAlive(self):
+        self._upkeep_stop.set()
+        return(None)
+
+    def _renewToken(self):
+        try:
+            resp = self.client.auth.token.renew_self()
+        except hvac.exceptions.VaultError as e:
+            _logger.debug('Could not renew cached token: {0}'.format(e))
+            return(None)
+        _logger.debug('Renewed cached token.')
+        self.storeToken(auth = resp.get('auth'))
+        return(None)
+
+    def storeToken(self, auth):
+        # auth is the "auth" section of a login/renewal response.
+        if not (self.cache_token and self.cache_secret and keystore.isAvailable()) or not auth:
+            return(None)
+        ttl = auth.get('lease_duration', 0)
+        renewable = auth.get('renewable', False)
+        entry = {'token': auth.get('client_token', self.client.token),
+                 'ttl': ttl,
+                 'renewable': renewable,
+                 'expires': ((time.time() + ttl) if ttl else None)}  # A TTL of 0 means it never expires.
+        if keystore.setEntry(self._cacheName(),
+                             entry,
+                             self.cache_secret,
+                             timeout = (ttl or None),
+                             high_entropy = self.high_entropy):
+            _logger.debug('Cached token.')
+        return(None)
+
+    def _newClient(self):
+        args = {'url': self.uri}
+        if self.session is not None:
+            args['session'] = self.session
+            args['timeout'] = self.session.timeout
+        client = hvac.Client(**args)
+        return(client)
+
     def authCheck(self):
         if not self.client.is_authenticated():
             _logger.debug('Could not authenticate to {0} using {1}.'.format(self.uri, self.name))
@@ -52,7 +217,9 @@ class _BasicAuthBase(_AuthBase):
         else:
             self.mount = self.default_mountpoint
         _logger.debug('Set mountpoint: {0}'.format(self.mount))
-        self.client = hvac.Client(url = self.uri)
+        self.identity = '{0}@{1}'.format(self.username, self.mount)
+        self.cache_secret = self.password
+        self.client = self._newClient()
         _logger.info('Initialized client.')
         return(None)
 
@@ -72,11 +239,17 @@ class AppRole(_AuthBase):
         _logger.debug('Set role: {0}'.format(self.role))
         self.secret = self.xml.find('.//secret').text
         _logger.debug('Set secret: {0}'.format(self.secret))
-        self.client = hvac.Client(url = self.uri)
+        self.identity = self.role
+        self.cache_secret = self.secret
+        self.high_entropy = True  # Secret IDs are UUIDs.
+        self.client = self._newClient()
         _logger.info('Initialized client.')
-        self.client.auth_approle(self.role, secret_id = self.secret)
+        if self._getCachedToken():
+            return(None)
+        resp = self.client.auth.approle.login(self.role, secret_id = self.secret)
         _logger.debug('Attempted to authenticate client.')
         self.authCheck()
+        self.storeToken(auth = resp.get('auth'))
         return(None)
 
 
@@ -89,11 +262,14 @@ class LDAP(_BasicAuthBase):
         self.getClient()
 
     def getClient(self):
-        self.client.auth.ldap.login(username = self.username,
-                                    password = self.password,
-                                    mount_point = self.mount)
+        if self._getCachedToken():
+            return(None)
+        resp = self.client.auth.ldap.login(username = self.username,
+                                           password = self.password,
+                                           mount_point = self.mount)
         _logger.debug('Attempted to authenticate client.')
         self.authCheck()
+        self.storeToken(auth = resp.get('auth'))
         return(None)
 
 
@@ -134,12 +310,12 @@ class Token(_AuthBase):
                 # try, in order, env var and then ~/.vault-token
                 while not _exhausted:
                     try:
-                        self._getEnv('VAULT_TOKEN')
+                        self.token = self._getEnv('VAULT_TOKEN')
                         break
                     except OSError as e:
                         pass
                     try:
-                        self._getFile('~/.vault-token')
+                        self.token = self._getFile('~/.vault-token')
                         _exhausted = True
                     except Exception as e:
                         _exhausted = True
@@ -152,17 +328,33 @@ class Token(_AuthBase):
                     chk = False
             else:
                 if a.startswith('env:'):
-                    e = a.split(':', 1)
+                    e = a.split(':', 1)[1]
                     self.token = self._getEnv(e)
                 else:
                     self.token = self._getFile(a)
         _logger.debug('Set token: {0}'.format(self.token))
-        self.client = hvac.Client(url = self.uri)
+        self.client = self._newClient()
         _logger.info('Initialized client.')
         self.client.token = self.token
         _logger.debug('Applied token.')
         if chk:
-            self.authCheck()
+            # The token itself is never looked up from the cache, but whether it's still valid (i.e. the lookup-self
+            # that authCheck() does) is.
+            self.identity = self.token
+            self.cache_secret = self.token
+            self.high_entropy = True
+            if self._getCachedToken():
+                return(None)
+            # Same as authCheck(), but we need the TTL anyways.
+            try:
+                data = self.client.auth.token.lookup_self()['data']
+            except (hvac.exceptions.Forbidden, hvac.exceptions.InvalidRequest):
+                _logger.debug('Could not authenticate to {0} using {1}.'.format(self.uri, self.name))
+                _logger.error('Could not authenticate')
+                raise RuntimeError('Could not authenticate')
+            self.storeToken(auth = {'client_token': self.token,
+                                    'lease_duration': data.get('ttl', 0),
+                                    'renewable': data.get('renewable', False)})
         return(None)
 
 
@@ -175,6 +367,8 @@ class UserPass(_BasicAuthBase):
         self.getClient()
 
     def getClient(self):
+        if self._getCachedToken():
+            return(None)
         resp = self.client.auth.userpass.login(username = self.username,
                                                password = self.password,
                                                mount_point = self.mount)
@@ -185,4 +379,5 @@ class UserPass(_BasicAuthBase):
             # Auth failed. We'll let authCheck() handle the error.
             pass
         self.authCheck()
+        self.storeToken(auth = resp.get('auth'))
         return(None)
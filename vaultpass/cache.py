@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+##
+from . import constants
+from . import lazy
+##
+requests = lazy.lazyImport('requests')
+
+
+_logger = logging.getLogger()
+
+
+def getCacheDir(*subdirs):
+    dirpath = os.path.join(constants.CACHE_DIR, *subdirs)
+    os.makedirs(dirpath, exist_ok = True, mode = 0o0700)
+    return(dirpath)
+
+
+def getKey(*parts):
+    # A stable, filesystem-safe cache key.
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode('utf-8')
+        h.update(p)
+        h.update(b'\x00')
+    return(h.hexdigest())
+
+
+def readFile(path):
+    try:
+        with open(path, 'rb') as fh:
+            return(fh.read())
+    except (FileNotFoundError, IsADirectoryError):
+        return(None)
+
+
+def readJSON(path):
+    data = readFile(path)
+    if data is None:
+        return(None)
+    try:
+        return(json.loads(data.decode('utf-8')))
+    except (ValueError, UnicodeDecodeError):
+        _logger.debug('Ignoring corrupt cache file {0}.'.format(path))
+        return(None)
+
+
+def writeFile(path, data):
+    # Atomic, and never readable by anyone else (even briefly).
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    dirpath = os.path.dirname(path)
+    fd, tmppath = tempfile.mkstemp(prefix = '.{0}.'.format(os.path.basename(path)), dir = dirpath)
+    try:
+        os.fchmod(fd, 0o0600)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmppath, path)
+    except Exception:
+        os.remove(tmppath)
+        raise
+    return(None)
+
+
+def writeJSON(path, obj):
+    writeFile(path, json.dumps(obj))
+    return(None)
+
+
+def fetchURL(url, subdir, max_age = None, timeout = 10):
+    # Fetch url, caching it locally. A cached copy younger than max_age seconds is used as-is; otherwise it is
+    # revalidated with If-None-Match/If-Modified-Since. If the server can't be reached (or errors), a stale copy is
+    # used if we have one. Returns the content and the (final) URL it came from.
+    dirpath = getCacheDir(subdir)
+    datapath = os.path.join(dirpath, getKey(url))
+    metapath = '{0}.json'.format(datapath)
+    data = readFile(datapath)
+    meta = readJSON(metapath)
+    if data is None or meta is None:
+        data = meta = None
+    if data is not None and max_age is not None and (time.time() - meta.get('fetched', 0)) < max_age:
+        _logger.debug('Using cached copy of {0}.'.format(url))
+        return(data, meta.get('url', url))
+    headers = {}
+    if meta:
+        # We have something to fall back on, so an unreachable (or black-holed) server shouldn't hold us up for long.
+        timeout = min(timeout, constants.REVALIDATE_TIMEOUT)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        req = requests.get(url, headers = headers, timeout = timeout)
+    except requests.exceptions.RequestException as e:
+        if data is not None:
+            _logger.warning('Could not reach {0}; using cached copy'.format(url))
+            _logger.debug('Fetching {0} failed: {1}'.format(url, e))
+            return(data, meta.get('url', url))
+        _logger.error('Could not fetch {0}'.format(url))
+        raise RuntimeError('Could not fetch {0}'.format(url))
+    if req.status_code == 304 and data is not None:
+        _logger.debug('Cached copy of {0} is still current.'.format(url))
+        meta['fetched'] = time.time()
+        writeJSON(metapath, meta)
+        return(data, meta.get('url', url))
+    if not req.ok:
+        if data is not None:
+            _logger.warning('Could not fetch {0}; using cached copy'.format(url))
+            _logger.debug('Fetching {0} returned HTTP {1}.'.format(url, req.status_code))
+            return(data, meta.get('url', url))
+        _logger.error('Could not fetch {0}'.format(url))
+        raise RuntimeError('Could not fetch {0}'.format(url))
+    meta = {'url': req.url,
+            'etag': req.headers.get('ETag'),
+            'last_modified': req.headers.get('Last-Modified'),
+            'fetched': time.time()}
+    writeFile(datapath, req.content)
+    writeJSON(metapath, meta)
+    return(req.content, req.url)
+
+
+def clearState(kind, key):
+    try:
+        os.remove(os.path.join(getCacheDir(kind), getKey(key)))
+    except FileNotFoundError:
+        pass
+    return(None)
+
+
+def readState(kind, key, max_age):
+    # Small facts about the server (mount types, seal status, etc.) that rarely change; None if missing or stale.
+    entry = readJSON(os.path.join(getCacheDir(kind), getKey(key)))
+    if not isinstance(entry, dict) or (time.time() - entry.get('stored', 0)) > max_age:
+        return(None)
+    return(entry.get('data'))
+
+
+def writeState(kind, key, data):
+    try:
+        writeJSON(os.path.join(getCacheDir(kind), getKey(key)), {'stored': time.time(), 'data': data})
+    except OSError as e:
+        _logger.debug('Could not write {0} cache: {1}'.format(kind, e))
+    return(None)
@@ -2,35 +2,193 @@ import base64
 import json
 import logging
 import os
-import pwd
 import re
+import signal
 # We COULD use pyperclip or pygtk or whatever for this, but we have enough external deps already.
 import subprocess
 import sys
 import time
 import warnings
 _logger = logging.getLogger()
+# The detached process that clears/restores the clipboard once the timeout is up; see _startTimer().
+_timer_module = 'vaultpass.clipboard'
+_pkg_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ##
-import psutil
-##
+from . import cache
 from . import constants
 
 
+def _copy(display, clipboard, data):
+    # Returns the PID of the xclip now holding data (it stays in the foreground with -quiet, so it's the one we
+    # started), or None if it couldn't take the selection.
+    proc = subprocess.Popen(['xclip',
+                             '-quiet',
+                             '-display', display,
+                             '-selection', clipboard],
+                            stdin = subprocess.PIPE,
+                            stdout = subprocess.DEVNULL,
+                            stderr = subprocess.DEVNULL,
+                            start_new_session = True)
+    try:
+        proc.stdin.write(data)
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass
+    try:
+        # If it's going to fail (no display, etc.), it does so right away.
+        rc = proc.wait(timeout = constants.XCLIP_START_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return(proc.pid)
+    if rc != 0:
+        _logger.debug('xclip exited with status {0}.'.format(rc))
+        return(None)
+    return(proc.pid)
+
+
+def _isXclip(pid, display, clipboard):
+    # Whether pid is an xclip holding (not reading) clipboard on display. Only /proc is read, and only for xclips.
+    procdir = '/proc/{0}'.format(pid)
+    try:
+        with open(os.path.join(procdir, 'comm'), 'rb') as fh:
+            if fh.read().strip() != b'xclip':
+                return(False)
+        if os.stat(procdir).st_uid != os.getuid():
+            return(False)
+        with open(os.path.join(procdir, 'cmdline'), 'rb') as fh:
+            cmdline = fh.read().decode('utf-8', 'replace').split('\x00')
+    except OSError:
+        return(False)
+    p_display = None
+    cbrd = 'primary'  # xclip's default
+    for idx, arg in enumerate(cmdline[:-1]):
+        if arg.startswith('-se'):
+            cbrd = cmdline[(idx + 1)]
+        elif arg.startswith('-d'):
+            p_display = cmdline[(idx + 1)]
+        elif arg.startswith('-o'):
+            return(False)
+    if p_display is None:
+        try:
+            with open(os.path.join(procdir, 'environ'), 'rb') as fh:
+                environ = fh.read().split(b'\x00')
+        except OSError:
+            return(False)
+        for e in environ:
+            if e.startswith(b'DISPLAY='):
+                p_display = e[8:].decode('utf-8', 'replace')
+                break
+    return(p_display == display and cbrd == clipboard)
+
+
 def getProc(display, clipboard):
-    real_uid = pwd.getpwnam(os.getlogin()).pw_uid
-    procs = []  # Normally I'd do this in a list comprehension but switching to a loop for readability.
-    for p in psutil.process_iter(attrs = ['name', 'cmdline', 'environ', 'uids']):
-        if p.name() != 'xclip':
-            continue
-        if p.uids().effective == real_uid:
-            p_display = p.environ().get('DISPLAY')
-            cbrd = None
-            for idx, arg in enumerate(p.cmdline()):
-                if arg.startswith('-se'):
-                    cbrd = p.cmdline()[(idx + 1)]
-                    break
-            if p_display == display and cbrd == clipboard:
-                return(p)
+    # The PID of the xclip holding clipboard on display: the one we started (see pasteClipboard()) if it's still
+    # there, otherwise whichever of the user's xclips /proc turns up.
+    state = cache.readJSON(_getStatePath(display, clipboard))
+    if isinstance(state, dict) and state.get('xclip') and _isXclip(state['xclip'], display, clipboard):
+        return(state['xclip'])
+    for pid in os.listdir('/proc'):
+        if pid.isdigit() and _isXclip(pid, display, clipboard):
+            return(int(pid))
+    return(None)
+
+
+def _getStatePath(display, clipboard):
+    return(os.path.join(cache.getCacheDir('clipboard'), cache.getKey(display, clipboard)))
+
+
+def _getStartTime(pid):
+    # In clock ticks since boot; together with the PID, this identifies a process (even across an exec()).
+    try:
+        with open('/proc/{0}/stat'.format(pid), 'rb') as fh:
+            stat = fh.read()
+    except OSError:
+        return(None)
+    return(int(stat.rsplit(b')', 1)[1].split()[19]))
+
+
+def _getTimer(statepath):
+    # The state ({'pid': ..., 'start': ..., 'deadline': ...}) of the pending clear for this display and clipboard, if
+    # it's still running.
+    state = cache.readJSON(statepath)
+    if not isinstance(state, dict) or not state.get('pid'):
+        return(None)
+    if _getStartTime(state['pid']) != state.get('start'):
+        # It's gone (and maybe something else has its PID now).
+        return(None)
+    return(state)
+
+
+def _runTimer():
+    # The body of the detached timer process. SIGUSR1 (already blocked; see _startTimer()) means the clipboard was
+    # copied to again, so the deadline is re-read.
+    req = json.loads(sys.stdin.buffer.read().decode('utf-8'))
+    statepath = _getStatePath(req['display'], req['clipboard'])
+    deadline = req['deadline']
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        if signal.sigtimedwait([signal.SIGUSR1], remaining) is not None:
+            state = cache.readJSON(statepath)
+            if isinstance(state, dict) and state.get('deadline'):
+                deadline = state['deadline']
+    restore = req.get('restore')
+    if restore is not None:
+        restore = base64.b64decode(restore)
+    clearClipboard(req['display'], req['clipboard'], restore = restore)
+    state = cache.readJSON(statepath)
+    if isinstance(state, dict) and state.get('pid') == os.getpid():
+        os.remove(statepath)
+    return(None)
+
+
+def _startTimer(display, clipboard, seconds, restore = None):
+    # Hands the clear/restore off to a detached process so the caller can exit right away. Returns its state (for
+    # the caller to write out).
+    deadline = time.time() + seconds
+    req = {'display': display,
+           'clipboard': clipboard,
+           'deadline': deadline,
+           'restore': (base64.b64encode(restore).decode('ascii') if restore is not None else None)}
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(i for i in (_pkg_root, env.get('PYTHONPATH')) if i)
+    # The child inherits the signal mask, so a SIGUSR1 sent before it's ready waits for it instead of killing it.
+    oldmask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1})
+    try:
+        proc = subprocess.Popen([sys.executable, '-m', _timer_module],
+                                stdin = subprocess.PIPE,
+                                stdout = subprocess.DEVNULL,
+                                stderr = subprocess.DEVNULL,
+                                env = env,
+                                start_new_session = True)
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, oldmask)
+    proc.stdin.write(json.dumps(req).encode('utf-8'))
+    proc.stdin.close()
+    _logger.debug('Started clipboard timer (PID {0}) for {1} seconds'.format(proc.pid, seconds))
+    return({'pid': proc.pid, 'start': _getStartTime(proc.pid), 'deadline': deadline})
+
+
+def clearClipboard(display, clipboard = constants.CLIPBOARD, restore = None):
+    # Put back what was in the clipboard before (restore), or if there wasn't anything, kill the xclip holding it.
+    if restore:
+        if not _copy(display, clipboard, restore):
+            _logger.warning('Could not restore clipboard')
+            _logger.debug('Could not restore clipboard "{0}" on display {1}.'.format(clipboard, display))
+            # We absolutely should warn about this.
+            warnings.warn('Could not restore clipboard; secret remains in clipboard!')
+    else:
+        pid = getProc(display, clipboard)
+        if not pid:
+            _logger.warning('Could not restore clipboard')
+            _logger.debug('Could not restore clipboard "{0}" on display {1}.'.format(clipboard, display))
+            # We absolutely should warn about this.
+            warnings.warn('Could not restore clipboard; secret remains in clipboard!')
+        else:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
     return(None)
 
 
@@ -42,10 +200,10 @@ def pasteClipboard(data,
     if clipboard not in constants.ALLOWED_CLIPBOARDS:
         _logger.error('Invalid clipboard name')
         _logger.debug(('The clipboard "{0}" is invalid. '
-                       'Must be one of: {1}.').format(', '.join((clipboard, constants.ALLOWED_CLIPBOARDS))))
+                       'Must be one of: {1}.').format(clipboard, ', '.join(constants.ALLOWED_CLIPBOARDS)))
         raise ValueError('Invalid clipboard')
     if isinstance(data, dict):
-        data = json.dumps(dict, indent = 4)
+        data = json.dumps(data, indent = 4)
     if not isinstance(data, str):
         data = str(data)
     _logger.debug('Copying to clipboard {0} for {1} seconds'.format(clipboard, seconds))
@@ -59,70 +217,54 @@ def pasteClipboard(data,
         # We don't have X, so we have no usable xclip.
         _logger.warning('Disabling clipboard copying because we don\'t have X')
         return(None)
-    exists = getProc(display)
+    statepath = _getStatePath(display, clipboard)
+    timer = _getTimer(statepath)
     current = None
-    if exists:
+    if timer:
+        if seconds is not None:
+            # A clear is already pending; it'll put back what was there before *that* copy, so just push it back.
+            timer['deadline'] = time.time() + seconds
+            cache.writeJSON(statepath, timer)
+            sig = signal.SIGUSR1
+        else:
+            # Otherwise it would clear this.
+            try:
+                os.remove(statepath)
+            except FileNotFoundError:
+                pass
+            sig = signal.SIGTERM
+        try:
+            os.kill(timer['pid'], sig)
+        except ProcessLookupError:
+            timer = None
+    if not timer and seconds is not None:
         cmd = subprocess.run(['xclip',
                               '-out',
                               '-display', display,
-                              '-selection', clipboard])
-        current = cmd.stdout
-        exists.kill()
-    cmd = subprocess.run(['xclip',
-                          '-display', display,
-                          '-selection', clipboard],
-                         input = data.encode('utf-8'),
-                         stdout = subprocess.PIPE,
-                         stderr = subprocess.PIPE)
-    if cmd.returncode != 0:
+                              '-selection', clipboard],
+                             stdout = subprocess.PIPE,
+                             stderr = subprocess.PIPE)
+        if cmd.returncode == 0:
+            current = cmd.stdout
+    xclip = _copy(display, clipboard, data.encode('utf-8'))
+    if not xclip:
         _logger.error('Could not write to clipboard')
         _logger.debug('Could not write to clipboard "{0}" on display {1}.'.format(clipboard, display))
-        for x in ('stdout', 'stderr'):
-            i = getattr(cmd, x)
-            if i:
-                i = i.decode('utf-8').strip()
-                if i != '':
-                    _logger.debug('{0}: {1}'.format(x.upper(), i))
         raise RuntimeError('Could not write to clipboard')
-    if printme:
-        print('Copied to clipboard "{0}".'.format(clipboard))
+    # Tracking our xclip means the timer doesn't have to go looking for it.
+    state = {'xclip': xclip}
     if seconds is not None:
-        if printme:
-            print('Active for {0} seconds...'.format(seconds))
-            for s in range(seconds, 0, -1):
-                sys.stdout.write('{0} seconds remaining...'.format(s))
-                sys.stdout.flush()
-                time.sleep(1)
-                sys.stdout.write('\r')
-            print('\033[2KClipboard cleared.')
-        else:
-            for s in range(seconds, 0, -1):
-                time.sleep(1)
-        if current:
-            cmd = subprocess.run(['xclip',
-                                  '-display', display,
-                                  '-selection', clipboard],
-                                 input = current,
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE)
-            if cmd.returncode != 0:
-                _logger.warning('Could not restore clipboard')
-                _logger.debug('Could not restore clipboard "{0}" on display {1}.'.format(clipboard, display))
-                for x in ('stdout', 'stderr'):
-                    i = getattr(cmd, x)
-                    if i:
-                        i = i.decode('utf-8').strip()
-                        if i != '':
-                            _logger.debug('{0}: {1}'.format(x.upper(), i))
-                # We absolutely should warn about this.
-                warnings.warn('Could not restore clipboard; secret remains in clipboard!')
+        if timer:
+            state.update(timer)
         else:
-            proc = getProc(display, clipboard)
-            if not proc:
-                _logger.warning('Could not restore clipboard')
-                _logger.debug('Could not restore clipboard "{0}" on display {1}.'.format(clipboard, display))
-                # We absolutely should warn about this.
-                warnings.warn('Could not restore clipboard; secret remains in clipboard!')
-            else:
-                proc.kill()
+            state.update(_startTimer(display, clipboard, seconds, restore = current))
+    cache.writeJSON(statepath, state)
+    if printme:
+        print('Copied to clipboard "{0}".'.format(clipboard))
+        if seconds is not None:
+            print('It will be cleared in {0} seconds.'.format(seconds))
     return(None)
+
+
+if __name__ == '__main__':
+    _runTimer()
@@ -1,17 +1,37 @@
-import copy
 import datetime
 import os
 import logging
 import re
 import shutil
 ##
-from . import gpg_handler
-import requests
+from . import cache
+from . import constants
+from . import keystore
+from . import lazy
+from . import metrics
+from . import profiler
 from lxml import etree
 
 
 # TODO: change filehandler of logger? https://stackoverflow.com/a/47447444
 _logger = logging.getLogger()
+# Only needed if there are GPG-encrypted elements.
+gpg_handler = lazy.lazyImport('.gpg_handler', __package__)
+# Compiled schemas (and their defaults parsers), keyed by (path, content hash); compiling one is not cheap.
+_xsd_cache = {}
+# Copies a document with every element's namespace removed.
+_strip_ns = etree.XSLT(etree.XML(b'''<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+    <xsl:template match="*">
+        <xsl:element name="{local-name()}">
+            <xsl:apply-templates select="@*|node()"/>
+        </xsl:element>
+    </xsl:template>
+    <xsl:template match="@*|text()|comment()|processing-instruction()">
+        <xsl:copy/>
+    </xsl:template>
+</xsl:stylesheet>'''))
+# Only configs read from a file or URL are cached; see Config.loadCache().
+_cached_types = ('local', 'remote')
 
 
 class Config(object):
@@ -23,52 +43,81 @@ class Config(object):
     xml = None
     namespaced_xml = None
     raw = None
+    base_url = None
+    includes = None
     xsd = None
     defaultsParser = None
     
     def __init__(self, xsd_path = None, *args, **kwargs):
+        self.xsd_path = xsd_path
         _logger.info('Instantiated {0}.'.format(type(self).__name__))
 
-    def main(self, validate = True, populate_defaults = True):
+    def main(self, validate = True, populate_defaults = True, use_cache = True):
         self.fetch()
-        self.parseRaw()
-        if populate_defaults:
-            self.populateDefaults()
-        if validate:
-            self.validate()
-        g = self.parseGpg()
-        if g:
-            # And do it again.
+        if not (use_cache and self.loadCache(validate = validate, populate_defaults = populate_defaults)):
+            self.parseRaw()
             if populate_defaults:
                 self.populateDefaults()
             if validate:
                 self.validate()
+            if use_cache:
+                self.saveCache(validate = validate, populate_defaults = populate_defaults)
+        # Only the decrypted elements themselves are defaulted/validated here; see parseGpg().
+        self.parseGpg(validate = validate, populate_defaults = populate_defaults)
+        self.parse()
         return(None)
 
     def decryptGpg(self, gpg_xml):
         home = gpg_xml.attrib.get('gpgHome')
-        tag = gpg_xml.tag
-        ns_search = './/{0}'.format(tag)
-        ns_xml = self.namespaced_xml.find(ns_search)
-        search = './/{0}'.format(self.stripNS(obj = ns_xml).tag)
-        xml = self.xml.find(search)
-        fpath = gpg_xml.text
-        if not self.gpg:
-            self.gpg = gpg_handler.GPG(home = home)
-        else:
-            self.gpg.gpg.home = home
-            self.gpg.initHome()
-        ns_dcrpt_xml = etree.fromstring(self.gpg.decrypt(fpath))
-        dcrpt_xml = self.stripNS(obj = ns_dcrpt_xml)
-        ns_xml.getparent().replace(ns_xml, ns_dcrpt_xml)
-        xml.getparent().replace(xml, dcrpt_xml)
-        self.parse()
-        return(None)
+        fpath = os.path.abspath(os.path.expanduser(gpg_xml.text))
+        timeout = int(gpg_xml.attrib.get('cacheTimeout', constants.GPG_CACHE_TIMEOUT))
+        # Decrypting can mean a pinentry/smartcard round trip, so the result is kept in the session keyring (and only
+        # there; it never touches disk) for a while, keyed by the ciphertext.
+        ciphertext = cache.readFile(fpath)
+        cache_name = None
+        if timeout and ciphertext is not None and keystore.isAvailable(file_fallback = False):
+            cache_name = 'gpg:{0}'.format(cache.getKey(ciphertext))
+            dcrpt = keystore.getEntry(cache_name, keyring = '@s', file_fallback = False)
+            if dcrpt is not None:
+                _logger.debug('Using cached decryption of {0}.'.format(fpath))
+                metrics.incr('vaultpass_cache_hits_total', (('cache', 'gpg'), ))
+                return(etree.fromstring(dcrpt.encode('utf-8')))
+            metrics.incr('vaultpass_cache_misses_total', (('cache', 'gpg'), ))
+        with profiler.phase('gpg decrypt'):
+            if not self.gpg:
+                self.gpg = gpg_handler.GPG(home = home)
+            else:
+                self.gpg.gpg.home = home
+                self.gpg.initHome()
+            if ciphertext is None:
+                dcrpt = self.gpg.decrypt(fpath)
+            else:
+                dcrpt = self.gpg.decryptData(ciphertext)
+            ns_dcrpt_xml = etree.fromstring(dcrpt)
+        if cache_name:
+            keystore.setEntry(cache_name,
+                              dcrpt.decode('utf-8'),
+                              timeout = timeout,
+                              keyring = '@s',
+                              file_fallback = False)
+        return(ns_dcrpt_xml)
 
     def fetch(self):  # Just a fail-safe; this is overridden by specific subclasses.
         pass
         return(None)
 
+    def getCacheKey(self, validate = True, populate_defaults = True):
+        # XIncluded files are checked separately (see loadCache()), since we can't know them without parsing. The XSD
+        # is hashed by content (the bundled one if none was given; a schemaLocation is part of self.raw anyways).
+        xsd_path = (os.path.abspath(os.path.expanduser(self.xsd_path)) if self.xsd_path else constants.XSD_PATH)
+        return(cache.getKey(constants.VERSION,
+                            self.raw,
+                            str(self.xsd_path),
+                            (_hashFile(xsd_path) or ''),
+                            str(validate),
+                            str(populate_defaults),
+                            (self.base_url or os.getcwd())))
+
     def getXSD(self, xsdpath = None):
         if not xsdpath:
             xsdpath = self.xsd_path
@@ -82,16 +131,13 @@ class Config(object):
             if not os.path.isfile(xsdpath):
                 _logger.error('The specified XSD path {0} does not exist on the local filesystem.'.format(xsdpath))
                 raise ValueError('Specified XSD path does not exist')
-            with open(xsdpath, 'rb') as fh:
-                raw_xsd = fh.read()
             base_url = os.path.split(xsdpath)[0]
         else:
             _logger.debug('No XSD path specified; getting it from the configuration file.')
-            xsi = self.xml.nsmap.get('xsi', 'http://www.w3.org/2001/XMLSchema-instance')
+            xsi = self.namespaced_xml.nsmap.get('xsi', 'http://www.w3.org/2001/XMLSchema-instance')
             _logger.debug('xsi: {0}'.format(xsi))
             schemaLocation = '{{{0}}}schemaLocation'.format(xsi)
-            schemaURL = self.xml.attrib.get(schemaLocation,
-                                            'https://schema.xml.r00t2.io/projects/vaultpass.xsd')
+            schemaURL = self.namespaced_xml.attrib.get(schemaLocation, constants.XSD_URLS[-1])
             _logger.debug('Detected schema map: {0}'.format(schemaURL))
             split_url = schemaURL.split()
             if len(split_url) == 2:  # a properly defined schemaLocation
@@ -105,34 +151,65 @@ class Config(object):
                 with open(schemaURL, 'rb') as fh:
                     raw_xsd = fh.read()
                 base_url = os.path.dirname(schemaURL)
+            elif schemaURL in constants.XSD_URLS:
+                _logger.debug('Using bundled XSD {0} for {1}'.format(constants.XSD_PATH, schemaURL))
+                xsdpath = constants.XSD_PATH
+                base_url = os.path.dirname(xsdpath)
             else:
                 _logger.debug('Fetching remote file: {0}'.format(schemaURL))
-                req = requests.get(schemaURL)
-                if not req.ok:
-                    _logger.error('Unable to fetch XSD.')
-                    raise RuntimeError('Could not download XSD')
-                raw_xsd = req.content
-                base_url = os.path.split(req.url)[0]  # This makes me feel dirty.
+                raw_xsd, base_url = cache.fetchURL(schemaURL, 'xsd', max_age = constants.XSD_CACHE_MAX_AGE)
+                base_url = os.path.split(base_url)[0]  # This makes me feel dirty.
+        key = (xsdpath, cache.getKey(raw_xsd) if raw_xsd is not None else None)
+        if key in _xsd_cache:
+            _logger.debug('Reusing compiled XSD.')
+            self.xsd, self.defaultsParser = _xsd_cache[key]
+            return(None)
+        if raw_xsd is None:
+            with open(xsdpath, 'rb') as fh:
+                raw_xsd = fh.read()
         _logger.debug('Loaded XSD at {0} ({1} bytes).'.format(xsdpath, len(raw_xsd)))
         _logger.debug('Parsed XML base URL: {0}'.format(base_url))
-        self.xsd = etree.XMLSchema(etree.XML(raw_xsd, base_url = base_url))
+        xsd_xml = etree.XML(raw_xsd, base_url = base_url)
+        self.xsd = etree.XMLSchema(xsd_xml)
+        self.defaultsParser = etree.XMLParser(schema = self.xsd, attribute_defaults = True)
+        _xsd_cache[key] = (self.xsd, self.defaultsParser)
         _logger.info('Rendered XSD.')
         return(None)
 
+    def loadCache(self, validate = True, populate_defaults = True):
+        # The cache holds the XIncluded (and defaulted/validated, if requested) config *before* GPG decryption, so
+        # nothing that was encrypted is ever written to disk in the clear. Configs passed in as strings/bytes aren't
+        # cached at all; there'd be nothing to tell when an entry is no longer needed.
+        if self.type not in _cached_types:
+            return(False)
+        cachepath = os.path.join(cache.getCacheDir('config'),
+                                 self.getCacheKey(validate = validate, populate_defaults = populate_defaults))
+        entry = cache.readJSON(cachepath)
+        if not isinstance(entry, dict) or not isinstance(entry.get('includes'), dict) or not entry.get('xml'):
+            _logger.debug('No cached configuration.')
+            return(False)
+        for fpath, fhash in entry['includes'].items():
+            if _hashFile(fpath) != fhash:
+                _logger.debug('XIncluded file {0} changed; ignoring cached configuration.'.format(fpath))
+                return(False)
+        self.parseRaw(raw = entry['xml'].encode('utf-8'))
+        self.includes = entry['includes']
+        try:
+            # Keeps an entry that's in use from being aged out by _pruneCache().
+            os.utime(cachepath)
+        except OSError:
+            pass
+        _logger.info('Loaded configuration from cache.')
+        return(True)
+
     def parse(self):
-        # This can used to "re-parse" the self.xml and self.namespaced_xml.
-        self.tree = self.xml.getroottree()
-        _logger.debug('Generated tree.')
+        # This can used to "re-parse" self.xml (the namespace-stripped view) from self.namespaced_xml.
         self.namespaced_tree = self.namespaced_xml.getroottree()
         _logger.debug('Generated namespaced tree.')
-        self.tree.xinclude()
-        _logger.debug('Parsed XInclude for tree.')
-        self.namespaced_tree.xinclude()
-        _logger.debug('Parsed XInclude for namespaced tree.')
         self.stripNS()
         return(None)
 
-    def parseGpg(self):
+    def parseGpg(self, validate = False, populate_defaults = False):
         gpg_elem_found = False
         search = []
         for x in self.gpg_elems:
@@ -140,45 +217,100 @@ class Config(object):
         search = '//*[{0}]'.format(' or '.join(search))
         gpg_elems = self.namespaced_xml.xpath(search)
         for e in gpg_elems:
-            self.decryptGpg(e)
+            gpg_elem_found = True
+            ns_dcrpt_xml = self.decryptGpg(e)
+            # The rest of the document was already defaulted/validated (once; it's cached that way), so only the
+            # decrypted element is. Its root must be a global element in the XSD (as auth and unseal are).
+            if populate_defaults:
+                ns_dcrpt_xml = self.populateDefaults(obj = ns_dcrpt_xml)
+            if validate:
+                self.validate(obj = ns_dcrpt_xml)
+            e.getparent().replace(e, ns_dcrpt_xml)
         return(gpg_elem_found)
 
-    def parseRaw(self, parser = None):
-        self.xml = etree.fromstring(self.raw, parser = parser)
-        _logger.debug('Generated xml.')
-        self.namespaced_xml = etree.fromstring(self.raw, parser = parser)
+    def parseRaw(self, parser = None, raw = None):
+        # The namespaced document is parsed (and XIncluded) exactly once; everything else is derived from it.
+        if raw is None:
+            raw = self.raw
+        self.namespaced_xml = etree.fromstring(raw, parser = parser, base_url = self.base_url)
         _logger.debug('Generated namespaced xml.')
-        self.parse()
+        self.includes = _getIncludes(self.namespaced_xml, (self.base_url or os.getcwd()))
+        self.namespaced_tree = self.namespaced_xml.getroottree()
+        self.namespaced_tree.xinclude()
+        self.namespaced_xml = self.namespaced_tree.getroot()
+        _logger.debug('Parsed XInclude for namespaced tree.')
         return(None)
 
-    def populateDefaults(self):
+    def populateDefaults(self, obj = None):
+        # If obj (an element) is given, a defaulted copy of it is returned instead.
         _logger.info('Populating missing values with defaults from XSD.')
         if not self.xsd:
             self.getXSD()
-        if not self.defaultsParser:
-            self.defaultsParser = etree.XMLParser(schema = self.xsd, attribute_defaults = True)
-        self.parseRaw(parser = self.defaultsParser)
+        if obj is not None:
+            return(etree.fromstring(etree.tostring(obj), parser = self.defaultsParser))
+        # The (already XIncluded) document is re-parsed through the schema; only done on a cache miss.
+        self.namespaced_xml = etree.fromstring(etree.tostring(self.namespaced_xml),
+                                               parser = self.defaultsParser,
+                                               base_url = self.base_url)
+        self.namespaced_tree = self.namespaced_xml.getroottree()
         return(None)
 
     def removeDefaults(self):
         _logger.info('Removing default values from missing values.')
         self.parseRaw()
+        self.parse()
+        return(None)
+
+    def saveCache(self, validate = True, populate_defaults = True):
+        if self.type not in _cached_types:
+            return(None)
+        if self.includes is None:
+            _logger.debug('Configuration XIncludes non-local resources; not caching.')
+            return(None)
+        cachedir = cache.getCacheDir('config')
+        cachename = self.getCacheKey(validate = validate, populate_defaults = populate_defaults)
+        cachepath = os.path.join(cachedir, cachename)
+        try:
+            cache.writeJSON(cachepath, {'includes': self.includes,
+                                        'xml': etree.tostring(self.namespaced_xml, encoding = 'unicode')})
+        except OSError as e:
+            _logger.warning('Could not cache configuration')
+            _logger.debug('Could not write {0}: {1}'.format(cachepath, e))
+            return(None)
+        _pruneCache(cachedir)
+        # Entries hold (possibly plaintext) tokens/unseal shards, so the one for the previous version of this
+        # config is removed rather than left to pile up.
+        srcpath = os.path.join(cache.getCacheDir('config', 'sources'),
+                               cache.getKey(self.type, self.source, str(validate), str(populate_defaults)))
+        prev = cache.readFile(srcpath)
+        if prev is not None:
+            prev = prev.decode('utf-8', 'replace').strip()
+        try:
+            if prev and prev != cachename and re.search(r'^[0-9a-f]{64}$', prev):
+                _logger.debug('Removing stale cached configuration {0}.'.format(prev))
+                os.remove(os.path.join(cachedir, prev))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _logger.debug('Could not remove stale cached configuration {0}: {1}'.format(prev, e))
+        try:
+            cache.writeFile(srcpath, cachename)
+        except OSError as e:
+            _logger.debug('Could not write {0}: {1}'.format(srcpath, e))
         return(None)
 
     def stripNS(self, obj = None):
         _logger.debug('Stripping namespace.')
-        # https://stackoverflow.com/questions/30232031/how-can-i-strip-namespaces-out-of-an-lxml-tree/30233635#30233635
-        xpathq = "descendant-or-self::*[namespace-uri()!='']"
+        # A single transform builds the stripped copy; no deepcopy() and rename pass needed.
         if obj is None:
-            _logger.debug('No XML object selected; using instance\'s xml and tree.')
-            for x in (self.tree, self.xml):
-                for e in x.xpath(xpathq):
-                    e.tag = etree.QName(e).localname
+            _logger.debug('No XML object selected; using instance\'s namespaced tree.')
+            self.tree = _strip_ns(self.namespaced_tree)
+            self.xml = self.tree.getroot()
         elif isinstance(obj, (etree._Element, etree._ElementTree)):
             _logger.debug('XML object provided: {0}'.format(etree.tostring(obj, with_tail = False).decode('utf-8')))
-            obj = copy.deepcopy(obj)
-            for e in obj.xpath(xpathq):
-                e.tag = etree.QName(e).localname
+            obj = _strip_ns(obj)
+            if isinstance(obj, etree._ElementTree):
+                obj = obj.getroot()
             return(obj)
         else:
             _logger.error('A non-XML object was provided.')
@@ -209,7 +341,6 @@ class Config(object):
             _logger.error(('obj parameter must be "tree", "xml", or of type '
                            'lxml.etree._Element or lxml.etree._ElementTree'))
             raise TypeError('Invalid obj type')
-        obj = copy.deepcopy(obj)
         strxml = etree.tostring(obj,
                                 encoding = 'utf-8',
                                 xml_declaration = True,
@@ -220,30 +351,24 @@ class Config(object):
         return(strxml)
 
     def updateAuth(self, unseal_shard, token):
+        # Only the namespaced document is edited; the stripped view is derived from it afterwards.
         nsmap = self.namespaced_xml.nsmap
-        unseal_ns_xml = self.namespaced_xml.find('.//{{{0}}}unseal'.format(nsmap[None]))
-        unseal_xml = self.xml.find('.//unseal')
-        auth_ns_xml = self.namespaced_xml.find('.//{{{0}}}auth'.format(nsmap[None]))
-        auth_xml = self.xml.find('.//auth')
-        token_ns_xml = auth_ns_xml.find('.//{{{0}}}token'.format(nsmap[None]))
-        token_xml = auth_xml.find('.//token')
-        if token_xml is None:
+        ns = '{{{0}}}'.format(nsmap[None])
+        unseal_ns_xml = self.namespaced_xml.find('.//{0}unseal'.format(ns))
+        auth_ns_xml = self.namespaced_xml.find('.//{0}auth'.format(ns))
+        token_ns_xml = auth_ns_xml.find('.//{0}token'.format(ns))
+        if token_ns_xml is None:
             # Config is using a non-token auth, so we replace it.
-            newauth_xml = etree.Element('auth')
-            newauth_ns_xml = etree.Element('auth', nsmap = nsmap)
-            token_xml = etree.SubElement(newauth_xml, 'token')
-            token_ns_xml = etree.SubElement(newauth_ns_xml, 'token', nsmap = nsmap)
-            auth_xml.getparent().replace(auth_xml, newauth_xml)
+            newauth_ns_xml = etree.Element('{0}auth'.format(ns), nsmap = nsmap)
+            token_ns_xml = etree.SubElement(newauth_ns_xml, '{0}token'.format(ns))
             auth_ns_xml.getparent().replace(auth_ns_xml, newauth_ns_xml)
-        if unseal_xml is None:
+        if unseal_ns_xml is None:
             # And we need to add the unseal as well.
-            server_xml = self.xml.find('.//server')
-            server_ns_xml = self.namespaced_xml.find('.//{{{0}}}server'.format(nsmap[None]))
-            unseal_xml = etree.SubElement(server_xml, 'unseal')
-            unseal_ns_xml = etree.SubElement(server_ns_xml, 'unseal')
-        unseal_xml.text = unseal_shard
+            server_ns_xml = self.namespaced_xml.find('.//{0}server'.format(ns))
+            unseal_ns_xml = etree.Element('{0}unseal'.format(ns))
+            uri_ns_xml = server_ns_xml.find('{0}uri'.format(ns))
+            server_ns_xml.insert((0 if uri_ns_xml is None else (server_ns_xml.index(uri_ns_xml) + 1)), unseal_ns_xml)
         unseal_ns_xml.text = unseal_shard
-        token_xml.text = token
         token_ns_xml.text = token
         self.parse()
         if isinstance(self, LocalFile):
@@ -253,11 +378,14 @@ class Config(object):
                 fh.write(self.toString())
         return(None)
 
-    def validate(self):
+    def validate(self, obj = None):
         if not self.xsd:
             self.getXSD()
-        _logger.debug('Checking validation against namespaced tree.')
-        self.xsd.assertValid(self.namespaced_tree)
+        if obj is None:
+            _logger.debug('Checking validation against namespaced tree.')
+            obj = self.namespaced_tree
+        with profiler.phase('xsd validation'):
+            self.xsd.assertValid(obj)
         return(None)
 
 
@@ -276,6 +404,7 @@ class LocalFile(Config):
             raise ValueError('Config file does not exist'.format(self.source))
         with open(self.source, 'rb') as fh:
             self.raw = fh.read()
+        self.base_url = self.source
         _logger.debug('Fetched configuration ({0} bytes).'.format(len(self.raw)))
         return(None)
 
@@ -287,11 +416,9 @@ class RemoteFile(Config):
         self.source = uri
 
     def fetch(self):
-        r = requests.get(self.source)
-        if not r.ok():
-            _logger.error('Could not fetch {0}'.format(self.source))
-            raise RuntimeError('Could not download XML')
-        self.raw = r.content
+        # Revalidated (If-None-Match/If-Modified-Since) rather than downloaded each time, and if the server can't be
+        # reached the last copy we got is used.
+        self.raw, url = cache.fetchURL(self.source, 'remote', max_age = constants.REMOTE_CONFIG_MAX_AGE)
         _logger.debug('Fetched configuration ({0} bytes).'.format(len(self.raw)))
         return(None)
 
@@ -320,12 +447,67 @@ class ConfigBin(Config):
         return(None)
 
 
+def _getIncludes(xml, base_url, includes = None):
+    # Returns {path: sha256} for every file XIncluded (recursively) by xml, or None if anything non-local is.
+    if includes is None:
+        includes = {}
+    base_dir = (os.path.dirname(base_url) if not os.path.isdir(base_url) else base_url)
+    for e in xml.iter('{{{0}}}include'.format(constants.XINCLUDE_NS)):
+        href = e.attrib.get('href')
+        if not href:
+            continue
+        if re.search(r'^[A-Za-z][A-Za-z0-9+.-]*://', href) and not href.startswith('file://'):
+            return(None)
+        fpath = os.path.abspath(os.path.join(base_dir, re.sub(r'^file://', r'', href)))
+        if fpath in includes:
+            continue
+        includes[fpath] = _hashFile(fpath)
+        if includes[fpath] is not None and e.attrib.get('parse', 'xml') == 'xml':
+            try:
+                included = etree.parse(fpath).getroot()
+            except etree.XMLSyntaxError:
+                continue
+            if _getIncludes(included, fpath, includes = includes) is None:
+                return(None)
+    return(includes)
+
+
+def _hashFile(fpath):
+    data = cache.readFile(fpath)
+    if data is None:
+        return(None)
+    return(cache.getKey(data))
+
+
+def _pruneCache(cachedir):
+    # Ages out entries (and source pointers) that haven't been written or loaded in a while; e.g. those left behind
+    # by config files that were since moved or removed.
+    cutoff = datetime.datetime.now().timestamp() - constants.CONFIG_CACHE_MAX_AGE
+    for dirpath in (cachedir, os.path.join(cachedir, 'sources')):
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            continue
+        for e in entries:
+            if not re.search(r'^[0-9a-f]{64}$', e.name):
+                continue
+            try:
+                if e.is_file(follow_symlinks = False) and e.stat(follow_symlinks = False).st_mtime < cutoff:
+                    _logger.debug('Removing expired cached configuration {0}.'.format(e.name))
+                    os.remove(e.path)
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                _logger.debug('Could not remove expired cached configuration {0}: {1}'.format(e.name, exc))
+    return(None)
+
+
 detector = {'raw': (re.compile(r'^\s*(?P<xml><(\?xml|vaultpass)\s+.*)\s*$', re.DOTALL | re.MULTILINE), ConfigStr),
             'remote': (re.compile(r'^(?P<uri>(?P<scheme>(https?|ftps?)://)(?P<path>.*))\s*$'), RemoteFile),
             'local': (re.compile(r'^(file://)?(?P<path>(/?[^/]+)+/?)$'), LocalFile)}
 
 
-def getConfig(cfg_ref, validate = True, populate_defaults = True, xsd_path = None):
+def getConfig(cfg_ref, validate = True, populate_defaults = True, xsd_path = None, use_cache = True):
     cfgobj = None
     # This is kind of gross.
     for configtype, (pattern, configClass) in detector.items():
@@ -345,5 +527,7 @@ def getConfig(cfg_ref, validate = True, populate_defaults = True, xsd_path = Non
                 break
     if cfgobj:
         _logger.info('Parsing configuration.')
-        cfgobj.main(validate = validate, populate_defaults = (populate_defaults if validate else False))
+        cfgobj.main(validate = validate,
+                    populate_defaults = (populate_defaults if validate else False),
+                    use_cache = use_cache)
     return(cfgobj)
@@ -0,0 +1,476 @@
+import concurrent.futures
+import itertools
+import logging
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+##
+import requests
+import requests.adapters
+import urllib3.exceptions
+##
+from . import cache
+from . import constants
+from . import governor
+from . import metrics
+from . import profiler
+from . import retry
+
+
+_logger = logging.getLogger()
+_session = None
+_read_methods = ('GET', 'LIST')
+# Reads of these are never sent to read nodes (auth, health/seal status, mounts, etc.).
+_active_only_paths = ('/v1/auth/', '/v1/sys/')
+_conn_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class _PoolAdapter(requests.adapters.HTTPAdapter):
+    # All pools share one SSL context, so the TLS configuration (and CA store) is only built once. The pooled,
+    # kept-alive connections are what actually save us the handshakes.
+    def __init__(self, ssl_context = None, *args, **kwargs):
+        self.ssl_context = ssl_context
+        self._pool_kwargs = kwargs
+        self._noverify = None
+        super().__init__(*args, **kwargs)
+
+    def close(self):
+        if self._noverify is not None:
+            self._noverify.close()
+        return(super().close())
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context:
+            kwargs['ssl_context'] = self.ssl_context
+        return(super().init_poolmanager(*args, **kwargs))
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.ssl_context:
+            kwargs['ssl_context'] = self.ssl_context
+        return(super().proxy_manager_for(*args, **kwargs))
+
+    def send(self, request, **kwargs):
+        if self.ssl_context and kwargs.get('verify', True) is False:
+            # The shared context checks hostnames, which can't be turned off per connection; unverified requests get
+            # their own (plain) pools instead.
+            if self._noverify is None:
+                self._noverify = requests.adapters.HTTPAdapter(**self._pool_kwargs)
+            return(self._noverify.send(request, **kwargs))
+        return(super().send(request, **kwargs))
+
+
+class Session(requests.Session):
+    pool_size = constants.DEFAULT_POOL_SIZE
+    keepalive = True
+    connect_timeout = constants.DEFAULT_CONNECT_TIMEOUT
+    read_timeout = constants.DEFAULT_READ_TIMEOUT
+    tls_reuse = True
+    # Set by auth when using a cached token; called (once, unless keep_reauth is set; see auth._AuthBase.keepAlive())
+    # with the rejected token to log in again if Vault rejects it.
+    reauth = None
+    keep_reauth = False
+    # Clients are built with base_uri; requests to it are actually sent to nodes[0], the best (healthy, lowest latency)
+    # of the configured nodes, and fail over to the next on connection errors. See setURIs().
+    base_uri = None
+    nodes = ()
+    # Secret reads/lists can also be spread across these (e.g. performance standbys); see setReaders().
+    read_nodes = ()
+    read_balance = 'roundRobin'
+    consistency_window = constants.READ_CONSISTENCY_WINDOW
+
+    def __init__(self, conn_xml = None, retry_xml = None, concurrency_xml = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.xml = conn_xml
+        self._reauth_lock = threading.Lock()
+        self.retry = retry.RetryPolicy(retry_xml = retry_xml)
+        self.governor = governor.getGovernor(concurrency_xml = concurrency_xml)
+        self._hedge_pool = None
+        self._hedge_lock = threading.Lock()
+        self._nodes_lock = threading.Lock()
+        self._read_rr = itertools.count()
+        self._read_inflight = {}
+        self._read_down = {}
+        # Read-your-writes: the X-Vault-Index of our last write, or (if Vault didn't send one) a time until which reads
+        # go to the active node.
+        self._vault_index = None
+        self._pinned_until = 0
+        # hvac.Client takes verify from the session it's given (and only reads VAULT_CACERT/VAULT_CAPATH without one).
+        self.verify = _getVerify()
+        self.parseConf()
+        self.mountAdapter()
+
+    def _hedged(self, method, url, threshold, *args, **kwargs):
+        # Fire the read; if it hasn't answered within the threshold, fire a duplicate and take whichever wins.
+        with self._hedge_lock:
+            if not self._hedge_pool:
+                self._hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.pool_size,
+                                                                         thread_name_prefix = 'vaultpass-hedge')
+        first = self._hedge_pool.submit(self._send, method, url, *args, **kwargs)
+        try:
+            return(first.result(timeout = threshold))
+        except concurrent.futures.TimeoutError:
+            pass
+        _logger.debug('{0} {1} exceeded {2:.3f}s; sending hedged request.'.format(method, url, threshold))
+        metrics.incr('vaultpass_hedged_requests_total')
+        second = self._hedge_pool.submit(self._send, method, url, *args, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(_closeFuture)
+                    return(f.result())
+                error = f.exception()
+        raise error
+
+    def _send(self, method, url, *args, **kwargs):
+        start = self.governor.acquire()
+        resp = None
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+        finally:
+            latency = time.monotonic() - start
+            status = (resp.status_code if resp is not None else None)
+            self.governor.release(start, status_code = status)
+            if profiler.isEnabled() or metrics.isEnabled():
+                _instrument(method, url, resp, latency)
+        if method in _read_methods and resp.ok:
+            self.retry.reads.add(latency)
+        return(resp)
+
+    def _failover(self, url):
+        # Moves the node url was sent to to the back of the line. Returns False if there's nowhere else to go.
+        with self._nodes_lock:
+            if len(self.nodes) < 2:
+                return(False)
+            for node in self.nodes:
+                if url.startswith(node + '/'):
+                    break
+            else:
+                return(False)
+            if node == self.nodes[0]:
+                self.nodes = self.nodes[1:] + [node]
+                cache.writeState('nodes', '\x00'.join(self.uris), self.nodes)
+            _logger.warning('Could not connect to {0}; failing over to {1}'.format(node, self.nodes[0]))
+        return(True)
+
+    def _pickReader(self):
+        now = time.monotonic()
+        with self._nodes_lock:
+            if now < self._pinned_until:
+                return(None)
+            readers = [n for n in self.read_nodes if self._read_down.get(n, 0) <= now]
+            if not readers:
+                return(None)
+            if self.read_balance == 'leastLoaded':
+                node = min(readers, key = (lambda n: self._read_inflight.get(n, 0)))
+            else:
+                node = readers[next(self._read_rr) % len(readers)]
+            self._read_inflight[node] = self._read_inflight.get(node, 0) + 1
+        return(node)
+
+    def _releaseReader(self, node):
+        with self._nodes_lock:
+            self._read_inflight[node] -= 1
+        return(None)
+
+    def _route(self, method, url):
+        # Returns the URL to actually send to and, if it's one, the read node it's sent to.
+        if not self.base_uri or not url.startswith(self.base_uri + '/'):
+            return(url, None)
+        path = url[len(self.base_uri):]
+        if self.read_nodes and method in _read_methods and not path.startswith(_active_only_paths):
+            reader = self._pickReader()
+            if reader is not None:
+                return((reader + path), reader)
+        nodes = self.nodes
+        if not nodes or nodes[0] == self.base_uri:
+            return(url, None)
+        return((nodes[0] + path), None)
+
+    def _wrote(self, resp):
+        # Called after a successful write, so that our later reads see it even if they go to a read node.
+        if not self.read_nodes:
+            return(None)
+        index = resp.headers.get('X-Vault-Index')
+        with self._nodes_lock:
+            if index:
+                self._vault_index = index
+            else:
+                self._pinned_until = time.monotonic() + self.consistency_window
+        return(None)
+
+    def _checkAuth(self, url, resp):
+        # Returns a new token if resp shows a cached token was rejected and we could log in again, otherwise None.
+        token = resp.request.headers.get('X-Vault-Token')
+        if not token:
+            # Unauthenticated (e.g. sys/seal-status); says nothing about the token.
+            return(None)
+        if resp.status_code < 400:
+            if not self.keep_reauth:
+                with self._reauth_lock:
+                    self.reauth = None  # The token's good.
+            return(None)
+        if resp.status_code != 403:
+            return(None)
+        # A 403 is also just "permission denied" (e.g. on sys/mounts); only a failed lookup-self means it's the token.
+        lookup_url = '{0}/v1/auth/token/lookup-self'.format(url.split('/v1/', 1)[0])
+        if url.split('?', 1)[0] == lookup_url:
+            lookup = resp
+        else:
+            lookup = self._request('GET', lookup_url, headers = {'X-Vault-Token': token}, timeout = self.timeout)
+            lookup.close()
+        with self._reauth_lock:
+            reauth = self.reauth
+            if reauth is None or lookup.status_code != 403:
+                if lookup.ok and not self.keep_reauth:
+                    self.reauth = None
+                return(None)
+            if not self.keep_reauth:
+                self.reauth = None
+        _logger.info('Token was rejected; authenticating again.')
+        return(reauth(token))
+
+    def request(self, method, url, *args, **kwargs):
+        resp = self._request(method, url, *args, **kwargs)
+        if self.reauth is not None:
+            token = self._checkAuth(url, resp)
+            if token:
+                resp.close()
+                headers = dict(kwargs.get('headers') or {})
+                headers['X-Vault-Token'] = token
+                kwargs['headers'] = headers
+                resp = self._request(method, url, *args, **kwargs)
+        return(resp)
+
+    def _request(self, method, url, *args, **kwargs):
+        method = method.upper()
+        attempt = 0
+        failovers = 0
+        while True:
+            threshold = None
+            if method in _read_methods:
+                threshold = self.retry.hedgeThreshold()
+            target, reader = self._route(method, url)
+            send_kwargs = kwargs
+            if reader is not None and self._vault_index:
+                # The read node waits until it has our last write (or forwards the request to the active node).
+                send_kwargs = dict(kwargs)
+                send_kwargs['headers'] = dict(kwargs.get('headers') or {})
+                send_kwargs['headers']['X-Vault-Index'] = self._vault_index
+                send_kwargs['headers']['X-Vault-Inconsistent'] = 'forward-active-node'
+            try:
+                if threshold is not None:
+                    resp = self._hedged(method, target, threshold, *args, **send_kwargs)
+                else:
+                    resp = self._send(method, target, *args, **send_kwargs)
+            except _conn_errors as e:
+                if reader is not None:
+                    # Take it out of rotation for a while and use the active node instead.
+                    _logger.warning('Could not connect to read node {0}; not using it for now'.format(reader))
+                    with self._nodes_lock:
+                        self._read_down[reader] = time.monotonic() + constants.SERVER_STATE_TTL
+                    continue
+                if not (retry.isIdempotent(method) or _notSent(e)):
+                    # It may have gotten there (and been acted on) before the connection went away.
+                    raise
+                # Another node is tried right away (once each) before backing off and retrying.
+                if failovers < (len(self.nodes) - 1) and self._failover(target):
+                    failovers += 1
+                    metrics.incr('vaultpass_retries_total', (('reason', 'failover'), ))
+                    continue
+                attempt += 1
+                if attempt >= self.retry.attempts:
+                    raise
+                delay = self.retry.delay((attempt - 1))
+                metrics.incr('vaultpass_retries_total', (('reason', 'connection'), ))
+                _logger.warning('Connection error talking to Vault; retrying')
+                _logger.debug('{0} {1} failed ({2}); retry {3}/{4} in {5:.2f}s.'.format(method,
+                                                                                         url,
+                                                                                         e,
+                                                                                         attempt,
+                                                                                         (self.retry.attempts - 1),
+                                                                                         delay))
+                time.sleep(delay)
+                continue
+            finally:
+                if reader is not None:
+                    self._releaseReader(reader)
+            if not self.retry.isRetryable(resp.status_code, method = method):
+                if method not in _read_methods and resp.ok:
+                    self._wrote(resp)
+                return(resp)
+            attempt += 1
+            if attempt >= self.retry.attempts:
+                return(resp)
+            retry_after = resp.headers.get('Retry-After')
+            try:
+                retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                retry_after = None
+            delay = self.retry.delay((attempt - 1), retry_after = retry_after)
+            metrics.incr('vaultpass_retries_total', (('reason', str(resp.status_code)), ))
+            _logger.warning('Transient error from Vault; retrying')
+            _logger.debug('{0} {1} returned {2}; retry {3}/{4} in {5:.2f}s.'.format(method,
+                                                                                    url,
+                                                                                    resp.status_code,
+                                                                                    attempt,
+                                                                                    (self.retry.attempts - 1),
+                                                                                    delay))
+            resp.close()
+            time.sleep(delay)
+
+    @property
+    def timeout(self):
+        return((self.connect_timeout, self.read_timeout))
+
+    def mountAdapter(self):
+        ssl_context = None
+        if self.tls_reuse and self.verify is not False:
+            if isinstance(self.verify, str) and os.path.isdir(self.verify):
+                ssl_context = ssl.create_default_context(capath = self.verify)
+            elif isinstance(self.verify, str):
+                ssl_context = ssl.create_default_context(cafile = self.verify)
+            else:
+                ssl_context = ssl.create_default_context()
+        adapter = _PoolAdapter(ssl_context = ssl_context,
+                               pool_connections = self.pool_size,
+                               pool_maxsize = self.pool_size)
+        for proto in ('http://', 'https://'):
+            self.mount(proto, adapter)
+        if not self.keepalive:
+            self.headers['Connection'] = 'close'
+        _logger.debug(('Mounted connection pool (size {0}, keep-alive {1}, '
+                       'shared TLS context {2}).').format(self.pool_size, self.keepalive, self.tls_reuse))
+        return(None)
+
+    def probeNodes(self):
+        # Every node's health is checked at once; the healthy ones come first, fastest first.
+        def _probe(uri):
+            start = time.monotonic()
+            try:
+                resp = super(Session, self).request('GET',
+                                                    '{0}/v1/sys/health'.format(uri),
+                                                    params = {'standbyok': 'true', 'perfstandbyok': 'true'},
+                                                    timeout = (self.connect_timeout, self.connect_timeout))
+            except requests.exceptions.RequestException as e:
+                _logger.debug('Health check of {0} failed: {1}'.format(uri, e))
+                return(None)
+            latency = time.monotonic() - start
+            resp.close()
+            _logger.debug('Health check of {0}: HTTP {1} in {2:.3f}s.'.format(uri, resp.status_code, latency))
+            if resp.status_code != 200:
+                return(None)
+            return(latency)
+
+        with profiler.phase('node probe'):
+            latencies = self.governor.map(_probe, self.uris)
+        healthy = sorted((latency, idx) for idx, latency in enumerate(latencies) if latency is not None)
+        order = [self.uris[idx] for latency, idx in healthy]
+        order.extend(u for u, latency in zip(self.uris, latencies) if latency is None)
+        return(order)
+
+    def pinReads(self, window = None):
+        # Send reads to the active node for a while, e.g. because something else just wrote.
+        with self._nodes_lock:
+            self._pinned_until = time.monotonic() + (self.consistency_window if window is None else window)
+        return(None)
+
+    def setReaders(self, reads_xml = None):
+        if reads_xml is None:
+            return(None)
+        self.read_nodes = [u.text.rstrip('/') for u in reads_xml.findall('uri')]
+        self.read_balance = reads_xml.attrib.get('balance', self.read_balance)
+        try:
+            self.consistency_window = float(reads_xml.attrib.get('consistencyWindow', self.consistency_window))
+        except ValueError:
+            _logger.error('Invalid read consistency window')
+            _logger.debug('The consistencyWindow ("{0}") is invalid.'.format(reads_xml.attrib['consistencyWindow']))
+            raise ValueError('Invalid read consistency window')
+        _logger.debug('Sending reads to {0} ({1}).'.format(', '.join(self.read_nodes), self.read_balance))
+        return(None)
+
+    def setURIs(self, uris):
+        # uris[0] is the one clients should be built with.
+        self.uris = [u.rstrip('/') for u in uris]
+        self.base_uri = self.uris[0]
+        if len(self.uris) < 2:
+            self.nodes = list(self.uris)
+            return(None)
+        key = '\x00'.join(self.uris)
+        nodes = cache.readState('nodes', key, constants.SERVER_STATE_TTL)
+        if not nodes or sorted(nodes) != sorted(self.uris):
+            nodes = self.probeNodes()
+            cache.writeState('nodes', key, nodes)
+        self.nodes = nodes
+        _logger.debug('Using {0} (of {1}).'.format(self.nodes[0], ', '.join(self.uris)))
+        return(None)
+
+    def parseConf(self):
+        if self.xml is None:
+            return(None)
+        for attr, name, conv in (('pool_size', 'poolSize', int),
+                                 ('keepalive', 'keepAlive', retry.toBool),
+                                 ('connect_timeout', 'connectTimeout', float),
+                                 ('read_timeout', 'readTimeout', float),
+                                 ('tls_reuse', 'tlsSessionReuse', retry.toBool)):
+            val = self.xml.attrib.get(name)
+            if val is None:
+                continue
+            try:
+                setattr(self, attr, conv(val))
+            except (ValueError, KeyError):
+                _logger.error('Invalid connection setting')
+                _logger.debug('The connection setting {0} ("{1}") is invalid.'.format(name, val))
+                raise ValueError('Invalid connection setting')
+        return(None)
+
+
+def _closeFuture(future):
+    if future.exception() is None:
+        future.result().close()
+    return(None)
+
+
+def _getVerify():
+    # What hvac.Client would use: VAULT_CACERT takes precedence over VAULT_CAPATH.
+    return(os.environ.get('VAULT_CACERT') or os.environ.get('VAULT_CAPATH') or True)
+
+
+def _instrument(method, url, resp, latency):
+    status = None
+    nbytes = 0
+    sent = 0
+    if resp is not None:
+        status = resp.status_code
+        nbytes = len(resp.content)
+        sent = len(resp.request.body or b'')
+    profiler.record(method, url, status, nbytes, latency)
+    if metrics.isEnabled():
+        endpoint = (('endpoint', profiler.endpointClass(method, urllib.parse.urlsplit(url).path)), )
+        metrics.incr('vaultpass_requests_total', (endpoint + (('status', str(status)), )))
+        metrics.incr('vaultpass_request_bytes_total', endpoint, value = sent)
+        metrics.incr('vaultpass_response_bytes_total', endpoint, value = nbytes)
+        metrics.observe('vaultpass_request_duration_seconds', endpoint, latency)
+    return(None)
+
+
+def _notSent(e):
+    # Whether a connection error happened before the request could have reached Vault (refused, or couldn't connect
+    # in time), so even a write can be sent again.
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return(True)
+    reason = getattr((e.args[0] if e.args else None), 'reason', None)
+    return(isinstance(reason, urllib3.exceptions.NewConnectionError))
+
+
+def getSession(conn_xml = None, retry_xml = None, concurrency_xml = None):
+    # There's one pool per process; every client (and thread) shares it.
+    global _session
+    if _session is None:
+        _session = Session(conn_xml = conn_xml, retry_xml = retry_xml, concurrency_xml = concurrency_xml)
+    return(_session)
@@ -9,9 +9,55 @@ SUPPORTED_ENGINES = ('kv1', 'kv2', 'cubbyhole')
 # SUPPORTED_OUTPUT_FORMATS = ('pretty', 'yaml', 'json', 'tree')
 SUPPORTED_OUTPUT_FORMATS = ('pretty', 'yaml', 'json')
 DEFAULT_LOGFILE = os.path.abspath(os.path.expanduser('~/.cache/vaultpass/vaultpass.log'))
+CACHE_DIR = os.path.abspath(os.path.expanduser('~/.cache/vaultpass'))
+# The schema is bundled; these are the published locations of it, which we never need to fetch.
+XSD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vaultpass.xsd')
+XSD_URLS = ('http://schema.xml.r00t2.io/projects/vaultpass.xsd',
+            'https://schema.xml.r00t2.io/projects/vaultpass.xsd')
+XSD_CACHE_MAX_AGE = 86400  # For third-party schemas; seconds before a cached copy is revalidated.
+REMOTE_CONFIG_MAX_AGE = 0  # Likewise for remote configuration files; i.e. always (but cheaply) revalidated.
+# When revalidating either of those, how long (seconds) to wait on the server before just using the cached copy.
+REVALIDATE_TIMEOUT = 1
+CONFIG_CACHE_MAX_AGE = 2592000  # Cached (parsed) configurations not used for this long (seconds) are removed.
+XINCLUDE_NS = 'http://www.w3.org/2001/XInclude'
 DEFAULT_LOGLEVEL_NAME = 'WARNING'
 DEFAULT_LOGLEVEL = getattr(logging, DEFAULT_LOGLEVEL_NAME)
 DEFAULT_MOUNT = 'secret'
+# HTTP connection pool/timeouts (seconds) for talking to Vault.
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+# Retrying transient failures from Vault.
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF = 0.25
+DEFAULT_RETRY_MAX_BACKOFF = 10
+DEFAULT_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# The adaptive concurrency limit shared by all parallel operations.
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 16
+# Cached Vault tokens (seconds); they're renewed in the background once less than this fraction of their TTL is left,
+# and not used at all with less than TOKEN_MIN_TTL left.
+TOKEN_RENEW_FRACTION = 0.33
+TOKEN_MIN_TTL = 60
+# The agent looks after its token itself (see auth._AuthBase.keepAlive()); if it can't reach Vault to, it tries again
+# after this many seconds.
+TOKEN_UPKEEP_RETRY = 30
+# How long (seconds) to trust cached mount types and seal/init status before asking the server again.
+SERVER_STATE_TTL = 300
+# After a write, reads go to the active node for this long (seconds) if Vault didn't give us an X-Vault-Index to send.
+READ_CONSISTENCY_WINDOW = 2
+# How long (seconds) decrypted *Gpg config elements are kept in the session keyring by default (if keyctl is available).
+GPG_CACHE_TIMEOUT = 900
+# The agent's socket; its directory is created 0700. XDG_RUNTIME_DIR is per-user tmpfs (and cleaned up on logout).
+if os.environ.get('XDG_RUNTIME_DIR'):
+    AGENT_SOCKET = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'vaultpass', 'agent.sock')
+else:
+    AGENT_SOCKET = os.path.join(CACHE_DIR, 'agent', 'agent.sock')
+# Seconds to wait for the agent to accept a connection before just doing it ourselves.
+AGENT_CONNECT_TIMEOUT = 0.5
+# The agent's in-memory cache of secrets read: how long (seconds) they're kept and how many. 0 for either disables it.
+SECRET_CACHE_TTL = 30
+SECRET_CACHE_SIZE = 256
 ALPHA_LOWER_PASS_CHARS = string.ascii_lowercase
 ALPHA_UPPER_PASS_CHARS = string.ascii_uppercase
 ALPHA_PASS_CHARS = ALPHA_LOWER_PASS_CHARS + ALPHA_UPPER_PASS_CHARS
@@ -26,8 +72,15 @@ SELECTED_PASS_CHARS = ALL_PASS_CHARS
 SELECTED_PASS_NOSYMBOL_CHARS = ALPHANUM_PASS_CHARS
 # xclip(1)
 ALLOWED_CLIPBOARDS = ('primary', 'secondary', 'clipboard')
+# How long (in seconds) to wait to see whether xclip managed to take the selection.
+XCLIP_START_TIMEOUT = 0.05
 CLIPBOARD = 'clipboard'
 GENERATED_LENGTH = 25  # I personally would prefer 32, but Pass compatibility...
+# Passphrases (generate -w); the first of these wordlists that exists is used unless one is specified.
+PASSPHRASE_DELIMITER = ' '
+WORDLISTS = ('/usr/share/dict/eff_large_wordlist.txt',
+             '/usr/share/eff-wordlists/eff_large_wordlist.txt',
+             '/usr/share/dict/words')
 EDITOR = 'vi'  # vi is on ...every? single distro and UNIX/UNIX-like, to my knowledge.
 GPG_HOMEDIR = '~/.gnupg'
 SELECTED_GPG_HOMEDIR = GPG_HOMEDIR
@@ -0,0 +1,127 @@
+import concurrent.futures
+import logging
+import threading
+import time
+##
+from . import constants
+
+
+_logger = logging.getLogger()
+_governor = None
+_thread_prefix = 'vaultpass-worker'
+# Responses that mean "back off", regardless of latency.
+_overload_statuses = (429, 503)
+
+
+class Governor(object):
+    # An AIMD ("additive increase, multiplicative decrease") concurrency limit shared by every request to Vault, plus
+    # an optional token bucket for a hard requests-per-second ceiling. The connection.Session acquires a slot for
+    # every HTTP request it sends; bulk operations fan out via map() and all draw from the same budget.
+    min_limit = 1
+    max_limit = constants.DEFAULT_MAX_CONCURRENCY
+    limit = constants.DEFAULT_INITIAL_CONCURRENCY
+    max_rps = None
+    latency_target = None  # None means "derive it from the observed baseline".
+    latency_tolerance = 2.0
+
+    def __init__(self, concurrency_xml = None):
+        self.xml = concurrency_xml
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        self.last_decrease = 0.0
+        self.baseline = None  # A slow-moving average of request latency.
+        self.samples = 0
+        self.tokens = None
+        self.last_refill = time.monotonic()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.parseConf()
+        if self.max_rps:
+            self.tokens = float(self.max_rps)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.max_rps), (self.tokens + ((now - self.last_refill) * self.max_rps)))
+        self.last_refill = now
+        return(None)
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = None
+                if self.in_flight < int(self.limit):
+                    if not self.max_rps:
+                        break
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    wait = (1 - self.tokens) / self.max_rps
+                self.cond.wait(timeout = wait)
+            self.in_flight += 1
+        return(time.monotonic())
+
+    def map(self, func, iterable):
+        # Like the builtin map(), but concurrent (and eager); results are returned in order.
+        if threading.current_thread().name.startswith(_thread_prefix):
+            # Nested fan-out from inside a worker could starve the pool, so just run it inline.
+            return([func(i) for i in iterable])
+        with self._pool_lock:
+            if not self._pool:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.max_limit,
+                                                                   thread_name_prefix = _thread_prefix)
+        return(list(self._pool.map(func, iterable)))
+
+    def parseConf(self):
+        if self.xml is None:
+            return(None)
+        try:
+            for attr, name, conv in (('limit', 'initial', float),
+                                     ('max_limit', 'max', int),
+                                     ('max_rps', 'maxRps', float),
+                                     ('latency_target', 'latencyTarget', float)):
+                val = self.xml.attrib.get(name)
+                if val is None:
+                    continue
+                setattr(self, attr, conv(val))
+        except ValueError:
+            _logger.error('Invalid concurrency setting')
+            _logger.debug('The concurrency configuration ({0}) is invalid.'.format(dict(self.xml.attrib)))
+            raise ValueError('Invalid concurrency setting')
+        if self.max_limit < self.min_limit:
+            _logger.error('Invalid concurrency setting')
+            _logger.debug('The max concurrency ({0}) must be at least {1}.'.format(self.max_limit, self.min_limit))
+            raise ValueError('Invalid concurrency setting')
+        self.limit = max(self.min_limit, min(self.limit, self.max_limit))
+        return(None)
+
+    def release(self, start, status_code = None):
+        latency = time.monotonic() - start
+        with self.cond:
+            self.in_flight -= 1
+            self.samples += 1
+            if self.baseline is None:
+                self.baseline = latency
+            else:
+                self.baseline += (latency - self.baseline) * 0.05
+            target = self.latency_target
+            if target is None and self.samples >= 10:
+                target = self.baseline * self.latency_tolerance
+            if status_code in _overload_statuses or (target is not None and latency > target):
+                # Only back off once per "generation"; requests that started before the last decrease were sent
+                # under the old limit and shouldn't shrink it again.
+                if start > self.last_decrease:
+                    self.limit = max(self.min_limit, (self.limit / 2))
+                    self.last_decrease = time.monotonic()
+                    _logger.debug('Concurrency limit decreased to {0:.2f}.'.format(self.limit))
+            else:
+                self.limit = min(self.max_limit, (self.limit + (1 / self.limit)))
+            self.cond.notify_all()
+        return(None)
+
+
+def getGovernor(concurrency_xml = None):
+    global _governor
+    if _governor is None:
+        _governor = Governor(concurrency_xml = concurrency_xml)
+    return(_governor)
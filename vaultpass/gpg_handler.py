@@ -34,6 +34,54 @@ class GPG(object):
         decrypted = rslt[0]
         return(decrypted)
 
+    def encryptData(self, data, keys):
+        # keys are from getKeys().
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        _logger.debug('Encrypting {0} bytes to {1} key(s)'.format(len(data), len(keys)))
+        rslt = self.gpg.encrypt(data, recipients = keys, sign = False)
+        encrypted = rslt[0]
+        return(encrypted)
+
+    def getKey(self, pattern):
+        # The one usable, valid (i.e. trusted) public key whose fingerprint, key ID, or a full user ID or email is
+        # pattern. keylist() substring-matches, so e.g. "bob" would also find "mallory-bob@example.com".
+        want = pattern.strip().lower()
+        keyid = (want[2:] if want.startswith('0x') else want)
+        if not (len(keyid) in (8, 16, 40) and all(c in '0123456789abcdef' for c in keyid)):
+            keyid = None
+        email = want.strip('<>')
+        matches = {}
+        for k in self.gpg.keylist(pattern = pattern):
+            if keyid and (k.fpr.lower() == keyid or any(sk.keyid.lower().endswith(keyid) for sk in k.subkeys)):
+                uids = k.uids
+            else:
+                uids = [u for u in k.uids if u.uid.lower() == want or (u.email or '').lower() == email]
+            if uids:
+                matches[k.fpr] = (k, uids)
+        if len(matches) != 1:
+            _logger.error('Could not find exactly one GPG key')
+            _logger.debug('{0} public keys match {1} exactly: {2}'.format(len(matches), pattern, ', '.join(matches)))
+            raise ValueError('Could not find exactly one GPG key')
+        k, uids = list(matches.values())[0]
+        if k.revoked or k.expired or k.disabled or k.invalid or not k.can_encrypt:
+            _logger.error('GPG key is not usable')
+            _logger.debug('The public key {0} ({1}) cannot be encrypted to.'.format(k.fpr, pattern))
+            raise ValueError('GPG key is not usable')
+        if not any(u.validity >= gpg.constants.validity.FULL for u in uids):
+            _logger.error('GPG key is not trusted')
+            _logger.debug(('The public key {0} ({1}) is not fully valid; certify it (or set its owner trust) '
+                           'first.').format(k.fpr, pattern))
+            raise ValueError('GPG key is not trusted')
+        return(k)
+
+    def getKeys(self, recipients):
+        keys = {}
+        for r in recipients:
+            k = self.getKey(r)
+            keys[k.fpr] = k
+        return(list(keys.values()))
+
     def initHome(self):
         if not self.home:
             h = os.environ.get('GNUPGHOME')
@@ -0,0 +1,161 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+##
+from . import cache
+##
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    _has_cryptography = True
+except ImportError:
+    _has_cryptography = False
+
+
+_logger = logging.getLogger()
+_keyctl = shutil.which('keyctl')
+_prefix = 'vaultpass:'
+_kdf_rounds = 100000
+
+
+# Small, short-lived secrets (tokens, decrypted config elements) that are expensive to get again. They're kept in the
+# Linux kernel keyring (via keyutils' keyctl) if available, which is per-user and never touches disk. Otherwise they go
+# in a 0600 file under the cache dir, but only encrypted (with a key derived from a secret the caller already has, so
+# the file is useless on its own). If the secret is already high-entropy (a token, a UUID), the (slow) KDF is skipped.
+# Callers that have no such secret can use the keyring only (file_fallback = False), e.g. the session keyring (@s),
+# which goes away on logout.
+def _deriveKey(name, secret, high_entropy = False):
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    if high_entropy:
+        key = hashlib.sha256(name.encode('utf-8') + b'\x00' + secret).digest()
+    else:
+        kdf = PBKDF2HMAC(algorithm = hashes.SHA256(),
+                         length = 32,
+                         salt = name.encode('utf-8'),
+                         iterations = _kdf_rounds)
+        key = kdf.derive(secret)
+    return(base64.urlsafe_b64encode(key))
+
+
+def _getVerifier(name, secret, high_entropy = False):
+    # Stored inside the entry (never in its name, which anyone who can list the keyring or cache dir can see), so a
+    # changed secret (e.g. a new password in the config) doesn't get the old entry back. Salted and stretched like
+    # _deriveKey(), but with a different salt so it can't stand in for the file's encryption key.
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    salt = '{0}:verifier'.format(name).encode('utf-8')
+    if high_entropy:
+        return(hmac.new(salt, secret, hashlib.sha256).hexdigest())
+    return(hashlib.pbkdf2_hmac('sha256', secret, salt, _kdf_rounds).hex())
+
+
+def _run(*args, data = None):
+    try:
+        cmd = subprocess.run([_keyctl] + [str(a) for a in args],
+                             input = data,
+                             stdout = subprocess.PIPE,
+                             stderr = subprocess.PIPE)
+    except OSError as e:
+        _logger.debug('Could not run keyctl: {0}'.format(e))
+        return(None)
+    if cmd.returncode != 0:
+        return(None)
+    return(cmd.stdout)
+
+
+def _keyringSearch(name, keyring = '@u'):
+    keyid = _run('search', keyring, 'user', '{0}{1}'.format(_prefix, name))
+    if not keyid:
+        return(None)
+    return(keyid.decode('utf-8').strip())
+
+
+def _getPath(name):
+    return(os.path.join(cache.getCacheDir('keystore'), name))
+
+
+def delEntry(name, keyring = '@u'):
+    if _keyctl:
+        keyid = _keyringSearch(name, keyring = keyring)
+        if keyid:
+            _run('unlink', keyid, keyring)
+    try:
+        os.remove(_getPath(name))
+    except FileNotFoundError:
+        pass
+    return(None)
+
+
+def getEntry(name, secret = None, high_entropy = False, keyring = '@u', file_fallback = True):
+    # Returns the stored object, or None if there isn't one (or it expired or can't be decrypted).
+    data = None
+    if _keyctl:
+        keyid = _keyringSearch(name, keyring = keyring)
+        if keyid:
+            data = _run('pipe', keyid)
+    elif _has_cryptography and file_fallback:
+        data = cache.readFile(_getPath(name))
+        if data:
+            try:
+                data = Fernet(_deriveKey(name, secret, high_entropy = high_entropy)).decrypt(data)
+            except InvalidToken:
+                _logger.debug('Could not decrypt keystore entry {0}; ignoring it.'.format(name))
+                return(None)
+    if not data:
+        return(None)
+    try:
+        obj = json.loads(data.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        _logger.debug('Ignoring corrupt keystore entry {0}.'.format(name))
+        return(None)
+    if obj.get('expires') is not None and obj['expires'] <= time.time():
+        _logger.debug('Keystore entry {0} has expired.'.format(name))
+        delEntry(name, keyring = keyring)
+        return(None)
+    if secret is not None and not hmac.compare_digest(str(obj.get('verifier')),
+                                                      _getVerifier(name, secret, high_entropy = high_entropy)):
+        _logger.debug('Keystore entry {0} was stored with a different secret; ignoring it.'.format(name))
+        return(None)
+    return(obj.get('data'))
+
+
+def isAvailable(file_fallback = True):
+    return(bool(_keyctl or (_has_cryptography and file_fallback)))
+
+
+def setEntry(name, obj, secret = None, timeout = None, high_entropy = False, keyring = '@u', file_fallback = True):
+    # timeout is in seconds; the kernel keyring enforces it by itself, and we check it on read for files.
+    expires = (time.time() + timeout) if timeout else None
+    entry = {'data': obj, 'expires': expires}
+    if secret is not None:
+        entry['verifier'] = _getVerifier(name, secret, high_entropy = high_entropy)
+    data = json.dumps(entry).encode('utf-8')
+    if _keyctl:
+        keyid = _run('padd', 'user', '{0}{1}'.format(_prefix, name), keyring, data = data)
+        if keyid is None:
+            _logger.debug('Could not add {0} to the kernel keyring.'.format(name))
+            return(False)
+        if timeout:
+            _run('timeout', keyid.decode('utf-8').strip(), int(timeout))
+        return(True)
+    if not file_fallback:
+        _logger.debug('keyctl is not available; not storing {0}.'.format(name))
+        return(False)
+    if not _has_cryptography:
+        _logger.debug('Neither keyctl nor the cryptography module are available; not storing {0}.'.format(name))
+        return(False)
+    data = Fernet(_deriveKey(name, secret, high_entropy = high_entropy)).encrypt(data)
+    try:
+        cache.writeFile(_getPath(name), data)
+    except OSError as e:
+        _logger.debug('Could not write keystore entry {0}: {1}'.format(name, e))
+        return(False)
+    return(True)
@@ -0,0 +1,29 @@
+import importlib
+import importlib.util
+import types
+
+
+class LazyModule(types.ModuleType):
+    # A stand-in for a module that isn't actually imported until one of its attributes is first used. The CLI is run
+    # constantly (completion, fzf wrappers, etc.) and most operations only need a few of the (heavy) modules.
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        mod = self.__dict__['_lazy_module']
+        if mod is None:
+            mod = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = mod
+        return(mod)
+
+    def __dir__(self):
+        return(dir(self._load()))
+
+    def __getattr__(self, attr):
+        return(getattr(self._load(), attr))
+
+
+def lazyImport(name, package = None):
+    # e.g. "hvac" or (relative to package) ".mounts".
+    return(LazyModule(importlib.util.resolve_name(name, package)))
@@ -1,15 +1,7 @@
 import logging
-import logging.handlers
 import os
 ##
 from . import constants
-##
-try:
-    # https://www.freedesktop.org/software/systemd/python-systemd/journal.html#journalhandler-class
-    from systemd import journal
-    _has_journald = True
-except ImportError:
-    _has_journald = False
 
 
 def prepLogfile(path = constants.DEFAULT_LOGFILE):
@@ -24,34 +16,60 @@ def prepLogfile(path = constants.DEFAULT_LOGFILE):
     return(path)
 
 
-_cfg_args = {'handlers': [],
-             'level': constants.DEFAULT_LOGLEVEL}
-if _has_journald:
-    # There were some weird changes somewhere along the line.
+class DeferredHandler(logging.Handler):
+    # Stands in for the real handlers (the journal and the logfile), which are only set up when the first record
+    # actually gets through the log level; most runs never log anything, so they never pay for the setup (or touch the
+    # logfile at all).
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handlers = None
+
+    def emit(self, record):
+        if self.handlers is None:  # handle() already holds self.lock.
+            self.handlers = getHandlers()
+        for h in self.handlers:
+            if record.levelno >= h.level:
+                h.handle(record)
+        return(None)
+
+
+def getHandlers():
+    import logging.handlers
+    handlers = []
     try:
-        # But it's *probably* this one.
-        h = journal.JournalHandler()
-    except AttributeError:
-        h = journal.JournaldLogHandler()
-    # Systemd includes times, so we don't need to.
+        # https://www.freedesktop.org/software/systemd/python-systemd/journal.html#journalhandler-class
+        from systemd import journal
+        _has_journald = True
+    except ImportError:
+        _has_journald = False
+    if _has_journald:
+        # There were some weird changes somewhere along the line.
+        try:
+            # But it's *probably* this one.
+            h = journal.JournalHandler()
+        except AttributeError:
+            h = journal.JournaldLogHandler()
+        # Systemd includes times, so we don't need to.
+        h.setFormatter(logging.Formatter(style = '{',
+                                         fmt = ('{name}:{levelname}:{name}:{filename}:'
+                                                '{funcName}:{lineno}: {message}')))
+        handlers.append(h)
+    # Logfile
+    h = logging.handlers.RotatingFileHandler(prepLogfile(),
+                                             encoding = 'utf8',
+                                             # Disable rotating for now.
+                                             # maxBytes = 50000000000,
+                                             # backupCount = 30
+                                             )
     h.setFormatter(logging.Formatter(style = '{',
-                                     fmt = ('{name}:{levelname}:{name}:{filename}:'
+                                     fmt = ('{asctime}:'
+                                            '{levelname}:{name}:{filename}:'
                                             '{funcName}:{lineno}: {message}')))
-    _cfg_args['handlers'].append(h)
-# Logfile
-h = logging.handlers.RotatingFileHandler(prepLogfile(),
-                                         encoding = 'utf8',
-                                         # Disable rotating for now.
-                                         # maxBytes = 50000000000,
-                                         # backupCount = 30
-                                         )
-h.setFormatter(logging.Formatter(style = '{',
-                                 fmt = ('{asctime}:'
-                                        '{levelname}:{name}:{filename}:'
-                                        '{funcName}:{lineno}: {message}')))
-_cfg_args['handlers'].append(h)
-
-logging.basicConfig(**_cfg_args)
+    handlers.append(h)
+    return(handlers)
+
+
+logging.basicConfig(handlers = [DeferredHandler()], level = constants.DEFAULT_LOGLEVEL)
 logger = logging.getLogger('VaultPass')
 
 logger.info('Logging initialized.')
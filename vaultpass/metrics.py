@@ -0,0 +1,175 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+_logger = logging.getLogger()
+_metrics = None
+_formats = ('prometheus', 'json')
+_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_help = {'vaultpass_requests_total': 'Requests sent to Vault, by endpoint class and HTTP status.',
+         'vaultpass_request_bytes_total': 'Request body bytes sent to Vault, by endpoint class.',
+         'vaultpass_response_bytes_total': 'Response body bytes received from Vault, by endpoint class.',
+         'vaultpass_request_duration_seconds': 'Latency of requests to Vault, by endpoint class.',
+         'vaultpass_retries_total': 'Requests to Vault that were retried, by reason.',
+         'vaultpass_hedged_requests_total': 'Duplicate (hedged) reads sent to Vault.',
+         'vaultpass_cache_hits_total': 'Cache hits, by cache.',
+         'vaultpass_cache_misses_total': 'Cache misses, by cache.',
+         'vaultpass_phase_duration_seconds': 'Duration of each phase of a run.',
+         'vaultpass_operation_duration_seconds': 'Duration of each operation.'}
+
+
+class Metrics(object):
+    # Counters and histograms, keyed by (name, labels) where labels is a tuple of (key, value) pairs. Written out
+    # once, at exit; the hot path is a dict update under a lock.
+    def __init__(self, path, fmt = 'prometheus'):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.fmt = fmt
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def incr(self, name, labels = (), value = 1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        return(None)
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [([0] * (len(_buckets) + 1)), 0.0, 0]
+            h[0][bisect.bisect_left(_buckets, value)] += 1
+            h[1] += value
+            h[2] += 1
+        return(None)
+
+    def renderJSON(self):
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': val}
+                        for (name, labels), val in sorted(self.counters.items())]
+            histograms = [{'name': name,
+                           'labels': dict(labels),
+                           'buckets': dict(zip([str(b) for b in _buckets] + ['+Inf'], _cumulative(h[0]))),
+                           'sum': h[1],
+                           'count': h[2]}
+                          for (name, labels), h in sorted(self.histograms.items())]
+        return(json.dumps({'start': self.start,
+                           'end': time.time(),
+                           'counters': counters,
+                           'histograms': histograms},
+                          indent = 4))
+
+    def renderPrometheus(self):
+        lines = []
+        seen = set()
+
+        def _header(name, mtype):
+            if name not in seen:
+                seen.add(name)
+                lines.append('# HELP {0} {1}'.format(name, _help.get(name, name)))
+                lines.append('# TYPE {0} {1}'.format(name, mtype))
+            return(None)
+
+        with self.lock:
+            for (name, labels), val in sorted(self.counters.items()):
+                _header(name, 'counter')
+                lines.append('{0}{1} {2}'.format(name, _labelStr(labels), val))
+            for (name, labels), h in sorted(self.histograms.items()):
+                _header(name, 'histogram')
+                for le, count in zip([str(b) for b in _buckets] + ['+Inf'], _cumulative(h[0])):
+                    lines.append('{0}_bucket{1} {2}'.format(name, _labelStr(labels + (('le', le), )), count))
+                lines.append('{0}_sum{1} {2}'.format(name, _labelStr(labels), h[1]))
+                lines.append('{0}_count{1} {2}'.format(name, _labelStr(labels), h[2]))
+        _header('vaultpass_last_run_timestamp_seconds', 'gauge')
+        lines.append('vaultpass_last_run_timestamp_seconds {0}'.format(self.start))
+        return('\n'.join(lines) + '\n')
+
+    def write(self):
+        if self.fmt == 'json':
+            out = self.renderJSON()
+        else:
+            out = self.renderPrometheus()
+        dirpath = os.path.dirname(self.path)
+        os.makedirs(dirpath, exist_ok = True)
+        # The textfile collector may read at any time, so the file has to be replaced atomically.
+        fd, tmppath = tempfile.mkstemp(prefix = '.vaultpass.metrics.', dir = dirpath)
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(out)
+            os.chmod(tmppath, 0o0644)
+            os.replace(tmppath, self.path)
+        except Exception:
+            os.remove(tmppath)
+            raise
+        _logger.debug('Wrote metrics to {0}.'.format(self.path))
+        return(None)
+
+
+def _cumulative(counts):
+    total = 0
+    rslt = []
+    for c in counts:
+        total += c
+        rslt.append(total)
+    return(rslt)
+
+
+def _labelStr(labels):
+    if not labels:
+        return('')
+    pairs = ['{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels]
+    return('{{{0}}}'.format(','.join(pairs)))
+
+
+def _writeMetrics():
+    if _metrics is None:
+        return(None)
+    try:
+        _metrics.write()
+    except OSError as e:
+        _logger.error('Could not write metrics')
+        _logger.debug('Could not write metrics to {0}: {1}'.format(_metrics.path, e))
+    return(None)
+
+
+def enable(metrics_xml):
+    global _metrics
+    if _metrics is not None:
+        return(_metrics)
+    fmt = metrics_xml.attrib.get('format', 'prometheus').lower()
+    if fmt not in _formats:
+        _logger.error('Invalid metrics format')
+        _logger.debug('The metrics format ("{0}") must be one of: {1}'.format(fmt, ', '.join(_formats)))
+        raise ValueError('Invalid metrics format')
+    if not metrics_xml.text or not metrics_xml.text.strip():
+        _logger.error('No metrics path')
+        raise ValueError('No metrics path')
+    _metrics = Metrics(metrics_xml.text.strip(), fmt = fmt)
+    atexit.register(_writeMetrics)
+    _logger.debug('Enabled {0} metrics export to {1}.'.format(fmt, _metrics.path))
+    return(_metrics)
+
+
+def incr(name, labels = (), value = 1):
+    if _metrics is not None:
+        _metrics.incr(name, labels = labels, value = value)
+    return(None)
+
+
+def isEnabled():
+    return(_metrics is not None)
+
+
+def observe(name, labels, value):
+    if _metrics is not None:
+        _metrics.observe(name, labels, value)
+    return(None)
@@ -2,13 +2,20 @@ import copy
 import logging
 import re
 import shutil
+import threading
 import time
 import warnings
 ##
 import dpath.util  # https://pypi.org/project/dpath/
 import hvac.exceptions
+from hvac.api.vault_api_base import VaultApiBase
+from lxml import etree
 ##
+from . import cache
 from . import constants
+from . import governor
+from . import metrics
+from . import profiler
 
 
 _logger = logging.getLogger()
@@ -20,68 +27,134 @@ _kv_re = re.compile(r'^kv(?:-v)?(?P<version>[0-9]+)$')
 # TODO: for all write operations, modify handler call to first check if path exists and patch if it does?
 
 
-class CubbyHandler(object):
-    # There is no upstream support for directly reading cubby. So we do it ourselves.
-    # TODO: custom class/handler? https://hvac.readthedocs.io/en/stable/advanced_usage.html#custom-requests-http-adapter
-    def __init__(self, client):
-        self.client = client
+class CubbyHandler(VaultApiBase):
+    # There is no upstream support for directly reading cubby, so this is a custom API class riding on the client's
+    # adapter (https://hvac.readthedocs.io/en/stable/advanced_usage.html).
+    # Cubbyholes are scoped to the token, so the list/read cache is too. A write to a cubbyhole path replaces the
+    # whole secret, so updates merge against the cached (or freshly read) data and then write exactly once.
+    def __init__(self, adapter):
+        super().__init__(adapter)
+        self._cache = {}
+        # The governor's workers share this handler; the network calls themselves are made without holding it.
+        self._lock = threading.Lock()
+
+    def _getCache(self, kind):
+        # Must be called with the lock held.
+        token = self._adapter.token
+        if token not in self._cache:
+            # A new token (e.g. after login or init) can't see the old token's cubbyhole.
+            self._cache = {token: {'list': {}, 'read': {}}}
+        return(self._cache[token][kind])
+
+    def _getURI(self, path, mount_point):
+        path = path.strip('/')
+        uri = '/v1/{0}/{1}'.format(mount_point.strip('/'), path)
+        return(uri)
+
+    def _invalidate(self, path, mount_point):
+        # Must be called with the lock held.
+        path = path.strip('/')
+        self._getCache('read').pop((mount_point, path), None)
+        # The parent listings may gain or lose an entry.
+        lcache = self._getCache('list')
+        for k in list(lcache.keys()):
+            if k[0] != mount_point:
+                continue
+            if k[1] == '' or path == k[1] or path.startswith('{0}/'.format(k[1])):
+                del(lcache[k])
+        return(None)
+
+    def _parseResp(self, resp):
+        # Depending on the hvac version/adapter in use, we get either a dict or a requests.Response.
+        if isinstance(resp, dict) or resp is None:
+            return(resp)
+        if resp.status_code == 204 or not resp.content:
+            return(None)
+        return(resp.json())
+
+    def clearCache(self):
+        with self._lock:
+            self._cache = {}
+        return(None)
 
     def create_or_update_secret(self, *args, **kwargs):
         # Alias function
         return(self.write_secret(*args, **kwargs))
 
     def list_secrets(self, path, mount_point = 'cubbyhole', *args, **kwargs):
-        path = path.lstrip('/')
-        uri = 'v1/{0}/{1}'.format(mount_point, path)
-        resp = self.client._adapter.list(url = uri)
-        return(resp.json())
+        key = (mount_point, path.strip('/'))
+        with self._lock:
+            cache = self._getCache('list')
+            if key in cache:
+                _logger.debug('Using cached listing for {0}:{1}'.format(mount_point, path))
+                metrics.incr('vaultpass_cache_hits_total', (('cache', 'cubbyhole'), ))
+                return(copy.deepcopy(cache[key]))
+        metrics.incr('vaultpass_cache_misses_total', (('cache', 'cubbyhole'), ))
+        resp = self._parseResp(self._adapter.list(url = self._getURI(path, mount_point)))
+        with self._lock:
+            self._getCache('list')[key] = copy.deepcopy(resp)
+        return(resp)
 
     def read_secret(self, path, mount_point = 'cubbyhole', *args, **kwargs):
-        path = path.lstrip('/')
-        uri = 'v1/{0}/{1}'.format(mount_point, path)
-        resp = self.client._adapter.get(url = uri)
-        return(resp.json())
+        key = (mount_point, path.strip('/'))
+        with self._lock:
+            cache = self._getCache('read')
+            if key in cache:
+                _logger.debug('Using cached secret for {0}:{1}'.format(mount_point, path))
+                metrics.incr('vaultpass_cache_hits_total', (('cache', 'cubbyhole'), ))
+                return(copy.deepcopy(cache[key]))
+        metrics.incr('vaultpass_cache_misses_total', (('cache', 'cubbyhole'), ))
+        resp = self._parseResp(self._adapter.get(url = self._getURI(path, mount_point)))
+        with self._lock:
+            self._getCache('read')[key] = copy.deepcopy(resp)
+        return(resp)
 
     def remove_secret(self, path, mount_point = 'cubbyhole', *args, **kwargs):
-        path = path.lstrip('/')
-        uri = 'v1/{0}/{1}'.format(mount_point, path)
-        resp = self.client._adapter.delete(url = uri)
-        return(resp.json())
+        resp = self._parseResp(self._adapter.delete(url = self._getURI(path, mount_point)))
+        with self._lock:
+            self._invalidate(path, mount_point)
+        return(resp)
 
     def update_secret(self, secret, path, mount_point = 'cubbyhole', *args, **kwargs):
-        existing = self.read_secret(path, mount_point)
-        data = existing.get('data')
-        if not data:
-            resp = self.write_secret(path, secret, mount_point = mount_point)
-        else:
-            data.update(secret)
-            self.remove_secret(path, mount_point)
-            resp = self.write_secret(path, data, mount_point)
+        data = {}
+        try:
+            existing = self.read_secret(path, mount_point)
+            if existing:
+                data = existing.get('data') or {}
+        except hvac.exceptions.InvalidPath:
+            pass
+        data.update(secret)
+        # A cubbyhole write replaces the secret wholesale, so there is no need to delete it first.
+        resp = self.write_secret(path, data, mount_point = mount_point)
         return(resp)
 
     def write_secret(self, path, secret, mount_point = 'cubbyhole', *args, **kwargs):
-        path = path.lstrip('/')
-        args = {'path': 'v1/{0}'.format('/'.join((mount_point, path)))}
-        for k, v in secret.items():
-            if k in args.keys():
-                _logger.error('Cannot use reserved secret name')
-                _logger.debug('Cannot use secret name {0} as it is reserved'.format(k))
-                raise ValueError('Cannot use reserved secret name')
-            args[k] = v
-        resp = self.client.write(**args)
+        resp = self._parseResp(self._adapter.post(url = self._getURI(path, mount_point), json = secret))
+        with self._lock:
+            self._invalidate(path, mount_point)
+            # We know exactly what's there now.
+            self._getCache('read')[(mount_point, path.strip('/'))] = {'data': copy.deepcopy(secret)}
         return(resp)
 
 
 class MountHandler(object):
     internal_mounts = ('identity', 'sys')
 
-    def __init__(self, client, mounts_xml = None):
+    def __init__(self, client, mounts_xml = None, cache_key = None):
         self.client = client
-        self.cubbyhandler = CubbyHandler(self.client)
+        self.cubbyhandler = CubbyHandler(self.client.adapter)
         self.xml = mounts_xml
         self.mounts = {}
         self.paths = {}
         self.flatpaths = set()
+        self._lock = threading.Lock()
+        # Held for a whole tree walk, so that (in the agent) walks and clearPaths() don't interleave.
+        self._walk_lock = threading.RLock()
+        # If given, the discovered mounts are cached (for constants.SERVER_STATE_TTL) under this (plus the config).
+        self.cache_key = None
+        self.from_cache = False
+        if cache_key is not None:
+            self.cache_key = cache.getKey(cache_key, (etree.tostring(self.xml) if self.xml is not None else b''))
         self.getSysMounts()
 
     def createMount(self, mount_name, mount_type = 'kv2'):
@@ -116,10 +189,19 @@ class MountHandler(object):
             time.sleep(2)
         return(created)
 
+    def clearCache(self):
+        if self.cache_key is not None:
+            cache.clearState('mounts', self.cache_key)
+        return(None)
+
     def getMountType(self, mount):
         if not self.mounts:
             self.getSysMounts()
         mtype = self.mounts.get(mount)
+        if not mtype and self.from_cache:
+            _logger.debug('Mount {0} not in cached mounts; refreshing.'.format(mount))
+            self.getSysMounts(refresh = True)
+            mtype = self.mounts.get(mount)
         if not mtype:
             _logger.error('Mount not found in defined mounts')
             _logger.debug('The mount {0} was not found in the defined mounts.'.format(mount))
@@ -131,9 +213,24 @@ class MountHandler(object):
         fullpath = '/'.join((mount, relpath))
         if not self.paths:
             self.getSecretsTree()
-        obj = dpath.util.get(self.paths, fullpath, None)
+        with self._lock:
+            obj = copy.deepcopy(dpath.util.get(self.paths, fullpath, None))
         return(obj)
 
+    def clearPaths(self):
+        # Forget the walked tree (and cubbyhole listings); e.g. after secrets were moved/removed by another process.
+        with self._walk_lock:
+            with self._lock:
+                self.paths = {}
+                self.flatpaths = set()
+            self.cubbyhandler.clearCache()
+        return(None)
+
+    def getFlatPaths(self):
+        # A copy; the live set may be added to by another thread's tree walk.
+        with self._lock:
+            return(set(self.flatpaths))
+
     def getSecretNames(self, path, mount, version = None):
         reader = None
         mtype = self.getMountType(mount)
@@ -161,6 +258,56 @@ class MountHandler(object):
             secrets_list = []
         return(secrets_list)
 
+    def _walkPath(self, path, mount, version = None):
+        # Fetch a single node of the tree. Returns the child paths (if any) to walk next.
+        mtype = self.getMountType(mount)
+        handler = None
+        args = {'path': path,
+                'mount_point': mount}
+        relpath = path.replace('//', '/').lstrip('/')
+        fullpath = '/'.join((mount, relpath)).replace('//', '/').lstrip('/')
+        if mtype == 'cubbyhole':
+            handler = self.cubbyhandler
+        elif mtype == 'kv1':
+            handler = self.client.secrets.kv.v1
+        elif mtype == 'kv2':
+            handler = self.client.secrets.kv.v2
+        flatpath = path.rstrip('/')
+        with self._lock:
+            self.flatpaths.add(mount)
+            self.flatpaths.add('/'.join((mount, flatpath)))
+            if mount not in self.paths.keys():
+                self.paths[mount] = {}
+        try:
+            _logger.debug('Fetching path {0} on mount {1}...'.format(path, mount))
+            paths = handler.list_secrets(**args)
+        except hvac.exceptions.InvalidPath:
+            # It's a secret name or doesn't exist.
+            _logger.debug('Path {0} on mount {1} is a secret, not a subdir.'.format(path, mount))
+            names = self.getSecretNames(path, mount, version = version)
+            with self._lock:
+                dpath.util.new(self.paths, fullpath, names)
+            return([])
+        # if 'data' not in paths.keys() or 'keys' not in paths['data'].keys():
+        try:
+            paths_list = paths['data']['keys']
+        except (KeyError, TypeError):
+            _logger.warning('Mount has no secrets/subdirs')
+            _logger.debug('The mount {0} has no secrets or subdirectories'.format(mount))
+            warnings.warn('Mount has no secrets/subdirs')
+            return([])
+        children = []
+        for p in paths_list:
+            p_relpath = '/'.join((relpath, p)).replace('//', '/').lstrip('/')
+            _logger.debug(('Queueing tree walk. '
+                           'path={0} '
+                           'fullpath={1} '
+                           'relpath={2} '
+                           'p={3} '
+                           'p_relpath={4}').format(path, fullpath, relpath, p, p_relpath))
+            children.append((p_relpath, mount))
+        return(children)
+
     def getSecretsTree(self, path = '/', mounts = None, version = None):
         if not mounts:
             mounts = self.mounts
@@ -168,92 +315,95 @@ class MountHandler(object):
             mounts = list(mounts.keys())
         if not isinstance(mounts, list):
             mounts = [mounts]
-        for mount in mounts:
-            mtype = self.getMountType(mount)
-            handler = None
-            args = {'path': path,
-                    'mount_point': mount}
-            relpath = path.replace('//', '/').lstrip('/')
-            fullpath = '/'.join((mount, relpath)).replace('//', '/').lstrip('/')
-            if mtype == 'cubbyhole':
-                handler = self.cubbyhandler
-            elif mtype == 'kv1':
-                handler = self.client.secrets.kv.v1
-            elif mtype == 'kv2':
-                if not any(((version is None), isinstance(version, int))):
-                    _logger.error('version parameter must be an integer or None')
-                    _logger.debug('The version parameter ({0}) must be an integer or None'.format(version))
-                    raise ValueError('version parameter must be an integer or None')
-                handler = self.client.secrets.kv.v2
-            self.flatpaths.add(mount)
-            flatpath = path.rstrip('/')
-            self.flatpaths.add('/'.join((mount, flatpath)))
-            if mount not in self.paths.keys():
-                self.paths[mount] = {}
-            try:
-                _logger.debug('Fetching path {0} on mount {1}...'.format(path, mount))
-                paths = handler.list_secrets(**args)
-            except hvac.exceptions.InvalidPath:
-                # It's a secret name or doesn't exist.
-                _logger.debug('Path {0} on mount {1} is a secret, not a subdir.'.format(path, mount))
-                dpath.util.new(self.paths, fullpath, self.getSecretNames(path, mount, version = version))
-                continue
-            # if 'data' not in paths.keys() or 'keys' not in paths['data'].keys():
-            try:
-                paths_list = paths['data']['keys']
-            except (KeyError, TypeError):
-                _logger.warning('Mount has no secrets/subdirs')
-                _logger.debug('The mount {0} has no secrets or subdirectories'.format(mount))
-                warnings.warn('Mount has no secrets/subdirs')
-                continue
-            for p in paths_list:
-                p_relpath = '/'.join((relpath, p)).replace('//', '/').lstrip('/')
-                p_fullpath = '/'.join((fullpath, p)).replace('//', '/').lstrip('/')
-                _logger.debug(('Recursing getSecretsTree. '
-                               'path={0} '
-                               'fullpath={1} '
-                               'relpath={2} '
-                               'p={3} '
-                               'p_relpath={4} '
-                               'p_fullpath={5}').format(path,
-                                                        fullpath,
-                                                        relpath,
-                                                        p,
-                                                        p_relpath,
-                                                        p_fullpath))
-                self.getSecretsTree(path = p_relpath, mounts = mount)
+        if not any(((version is None), isinstance(version, int))):
+            _logger.error('version parameter must be an integer or None')
+            _logger.debug('The version parameter ({0}) must be an integer or None'.format(version))
+            raise ValueError('version parameter must be an integer or None')
+        # Walk the tree breadth-first; each level is fetched concurrently (within the governor's budget).
+        gov = governor.getGovernor()
+        frontier = [(path, mount) for mount in mounts]
+        with self._walk_lock, profiler.phase('tree walk'):
+            while frontier:
+                results = gov.map((lambda i: self._walkPath(i[0], i[1], version = version)), frontier)
+                frontier = [child for children in results for child in children]
+        return(None)
+
+    def _addMount(self, mount, mount_info):
+        r = _mount_re.search(mount)
+        if r:
+            mount = r.group('mount')
+        if mount in self.internal_mounts:
+            return(None)
+        # Get the mount type.
+        mtype = mount_info['type']
+        if mtype == 'kv':
+            mntopts = mount_info['options']
+            if mntopts and isinstance(mntopts, dict):
+                mver = mntopts.get('version')
+                if mver == '2':
+                    mtype = 'kv2'
+                elif mver == '1':
+                    mtype = 'kv1'
+        self.mounts[mount] = mtype
+        _logger.debug('Added mountpoint {0} to mounts list with type {1}'.format(mount, mtype))
         return(None)
 
-    def getSysMounts(self):
+    def _getUIMount(self, mount):
+        # Unlike sys/mounts, this is available to any token with a capability on (something in) the mount.
+        try:
+            resp = self.client.adapter.get('/v1/sys/internal/ui/mounts/{0}'.format(mount.strip('/')))
+        except (hvac.exceptions.Forbidden, hvac.exceptions.InvalidPath, hvac.exceptions.InvalidRequest):
+            _logger.debug('Could not look up mount {0} via sys/internal/ui/mounts.'.format(mount))
+            return(None)
+        return(resp.get('data'))
+
+    def getSysMounts(self, refresh = False):
+        if self.cache_key is not None and not refresh:
+            cached = cache.readState('mounts', self.cache_key, constants.SERVER_STATE_TTL)
+            if cached:
+                self.mounts = cached
+                self.from_cache = True
+                _logger.debug('Using cached mounts: {0}'.format(self.mounts))
+                return(None)
+        self.from_cache = False
+        self.mounts = {}  # Otherwise a mount removed since it was cached would stick around.
         try:
             for mount, mount_info in self.client.sys.list_mounted_secrets_engines()['data'].items():
-                r = _mount_re.search(mount)
-                if r:
-                    mount = r.group('mount')
-                if mount in self.internal_mounts:
-                    continue
-                # Get the mount type.
-                mtype = mount_info['type']
-                if mtype == 'kv':
-                    mntopts = mount_info['options']
-                    if mntopts and isinstance(mntopts, dict):
-                        mver = mntopts.get('version')
-                        if mver == '2':
-                            mtype = 'kv2'
-                        elif mver == '1':
-                            mtype = 'kv1'
-                self.mounts[mount] = mtype
-                _logger.debug('Added mountpoint {0} to mounts list with type {1}'.format(mount, mtype))
+                self._addMount(mount, mount_info)
         except hvac.exceptions.Forbidden:
-            _logger.warning('Client does not have permission to read /sys/mounts.')
+            _logger.warning('Client does not have permission to read /sys/mounts; using sys/internal/ui/mounts.')
+            self.getUIMounts()
         # TODO: should I blindly merge in instead?
-        if self.xml:
+        if self.xml is not None:
             for mount in self.xml.findall('.//mount'):
                 mname = mount.text
                 mtype = mount.attrib.get('type', 'kv2')
                 if mname not in self.mounts.keys():
                     self.mounts[mname] = mtype
                     _logger.debug('Added mountpoint {0} to mounts list with type {1}'.format(mount, mtype))
+        if self.cache_key is not None:
+            cache.writeState('mounts', self.cache_key, self.mounts)
+        return(None)
+
+    def getUIMounts(self):
+        # The listing has every secrets engine the token can use, in one request...
+        try:
+            listing = self.client.adapter.get('/v1/sys/internal/ui/mounts')
+            for mount, mount_info in listing['data'].get('secret', {}).items():
+                self._addMount(mount, mount_info)
+        except (hvac.exceptions.Forbidden, hvac.exceptions.InvalidPath, KeyError, TypeError):
+            _logger.debug('Could not list mounts via sys/internal/ui/mounts.')
+        # ...but configured mounts that weren't in it are looked up directly (concurrently) so we get their real type.
+        if self.xml is None:
+            return(None)
+        missing = [m.text for m in self.xml.findall('.//mount') if m.text.strip('/') not in self.mounts]
+        if not missing:
+            return(None)
+        gov = governor.getGovernor()
+        with profiler.phase('ui mount lookup'):
+            for mount_info in gov.map(self._getUIMount, missing):
+                if mount_info and mount_info.get('path'):
+                    self._addMount(mount_info['path'], mount_info)
         return(None)
 
     def printer(self, path = '/', mounts = None, output = None, indent = 4):
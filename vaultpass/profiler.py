@@ -0,0 +1,133 @@
+import atexit
+import contextlib
+import logging
+import sys
+import threading
+import time
+import urllib.parse
+##
+from . import metrics
+
+
+_logger = logging.getLogger()
+_profiler = None
+
+
+class Profiler(object):
+    # Records every HTTP call to Vault and the duration of each phase of a run, and renders a summary.
+    def __init__(self):
+        self.calls = []
+        self.phases = []
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+
+    def addPhase(self, name, duration):
+        with self.lock:
+            self.phases.append((name, duration))
+        return(None)
+
+    def record(self, method, url, status_code, nbytes, latency):
+        with self.lock:
+            self.calls.append((method, urllib.parse.urlsplit(url).path, status_code, nbytes, latency))
+        return(None)
+
+    def report(self):
+        lines = ['VaultPass profile (total {0:.1f} ms)'.format((time.monotonic() - self.start) * 1000)]
+        with self.lock:
+            phases = list(self.phases)
+            calls = list(self.calls)
+        lines.append('')
+        lines.append('{0:<24} {1:>6} {2:>12}'.format('PHASE', 'COUNT', 'TOTAL (ms)'))
+        totals = {}
+        for name, duration in phases:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = ((count + 1), (total + duration))
+        for name, (count, total) in totals.items():
+            lines.append('{0:<24} {1:>6} {2:>12.1f}'.format(name, count, (total * 1000)))
+        lines.append('')
+        lines.append('{0:<40} {1:>6} {2:>10} {3:>9} {4:>9} {5:>9}  {6}'.format('ENDPOINT',
+                                                                               'COUNT',
+                                                                               'BYTES',
+                                                                               'p50 (ms)',
+                                                                               'p95 (ms)',
+                                                                               'p99 (ms)',
+                                                                               'STATUSES'))
+        classes = {}
+        for method, path, status, nbytes, latency in calls:
+            c = classes.setdefault(endpointClass(method, path), {'latencies': [], 'bytes': 0, 'statuses': {}})
+            c['latencies'].append(latency)
+            c['bytes'] += nbytes
+            c['statuses'][status] = c['statuses'].get(status, 0) + 1
+        for name, c in sorted(classes.items(), key = (lambda i: -sum(i[1]['latencies']))):
+            lats = sorted(c['latencies'])
+            p50, p95, p99 = ((percentile(lats, pct) * 1000) for pct in (50, 95, 99))
+            statuses = ', '.join('{0}x{1}'.format(k, v) for k, v in sorted(c['statuses'].items()))
+            lines.append('{0:<40} {1:>6} {2:>10} {3:>9.1f} {4:>9.1f} {5:>9.1f}  {6}'.format(name,
+                                                                                            len(lats),
+                                                                                            c['bytes'],
+                                                                                            p50,
+                                                                                            p95,
+                                                                                            p99,
+                                                                                            statuses))
+        lines.append('')
+        lines.append('{0} request(s) to Vault.'.format(len(calls)))
+        return('\n'.join(lines))
+
+
+def _printReport():
+    if _profiler:
+        print(_profiler.report(), file = sys.stderr)
+    return(None)
+
+
+def enable():
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+        atexit.register(_printReport)
+        _logger.debug('Enabled profiling.')
+    return(_profiler)
+
+
+def endpointClass(method, path):
+    # e.g. "GET sys/mounts", "LIST secret/metadata", "POST auth/ldap". Secret names are never included.
+    parts = [i for i in path.split('/') if i]
+    if parts and parts[0] == 'v1':
+        parts = parts[1:]
+    if parts and parts[0] in ('auth', 'sys'):
+        parts = parts[0:2]
+    elif len(parts) > 1 and parts[1] in ('data', 'metadata', 'delete', 'undelete', 'destroy'):
+        parts = parts[0:2]
+    else:
+        parts = parts[0:1]
+    return('{0} {1}'.format(method, '/'.join(parts)))
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return(0.0)
+    idx = min((len(ordered) - 1), int(round((pct / 100.0) * (len(ordered) - 1))))
+    return(ordered[idx])
+
+
+@contextlib.contextmanager
+def phase(name):
+    # Only recorded if profiling and/or metrics were enabled.
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start
+        if _profiler is not None:
+            _profiler.addPhase(name, duration)
+        metrics.observe('vaultpass_phase_duration_seconds', (('phase', name), ), duration)
+
+
+def record(method, url, status_code, nbytes, latency):
+    if _profiler is not None:
+        _profiler.record(method, url, status_code, nbytes, latency)
+    return(None)
+
+
+def isEnabled():
+    return(_profiler is not None)
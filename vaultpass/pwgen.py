@@ -2,11 +2,16 @@
 # See also:
 # http://stackoverflow.com/questions/5480131/will-python-systemrandom-os-urandom-always-have-enough-entropy-for-good-crypto
 import argparse
-import random
+import concurrent.futures
+import itertools
+import os
 import re
+import secrets
+import sys
 import warnings
 ##
 from . import constants
+from . import wordlist
 ##
 try:
     import passlib.context
@@ -14,8 +19,8 @@ try:
     has_passlib = True
 except ImportError:
     # TODO: adler32 and crc32 via zlib module?
-    import hashlib
     has_passlib = False
+import hashlib
 
 
 if has_passlib:
@@ -26,6 +31,101 @@ else:
 # By default, complex is symbols and mixed-case alphanumeric. simple is mixed-case alphanumeric.
 charsets = {'simple': constants.ALPHANUM_PASS_CHARS,
             'complex': constants.ALL_PASS_CHARS}
+# How many random bytes to draw from the OS at once when generating passwords in bulk.
+_chunk_size = 65536
+# How many passwords (per worker) are handed to the hashing process pool at once.
+_hash_batch = 256
+# Per-process CryptContexts, keyed by the tuple of hash names.
+_contexts = {}
+
+
+def genChars(chars, passlen, count = None):
+    # Yields count (or, if None, endless) passwords of passlen characters from chars. Random bytes are drawn in bulk
+    # and mapped onto chars with bytes.translate() (i.e. in C); bytes that would bias the result (those past the last
+    # whole multiple of len(chars)) are deleted rather than wrapped around, so every character is equally likely.
+    nchars = len(chars)
+    if not nchars:
+        raise ValueError('No characters to generate a password from')
+    if passlen < 1:
+        raise ValueError('Password length must be at least 1 (got {0})'.format(passlen))
+    try:
+        charbytes = chars.encode('ascii')
+    except UnicodeEncodeError:
+        charbytes = None
+    if charbytes is None or nchars > 256:
+        # Can't be done bytewise; the slow (but still unbiased) way.
+        while count is None or count > 0:
+            yield(''.join(secrets.choice(chars) for _ in range(passlen)))
+            if count is not None:
+                count -= 1
+        return(None)
+    limit = 256 - (256 % nchars)
+    table = bytes(charbytes[b % nchars] for b in range(limit)) + bytes(256 - limit)
+    rejects = bytes(range(limit, 256))
+    buf = b''
+    while count is None or count > 0:
+        want = passlen * (count if count is not None else 1)
+        while len(buf) < passlen:
+            # Ask for a bit more than is needed to make up for the rejected bytes.
+            nbytes = min(max((want - len(buf)) * 256 // limit + 64, 256), _chunk_size)
+            buf += os.urandom(nbytes).translate(table, rejects)
+        npws = len(buf) // passlen
+        if count is not None:
+            npws = min(npws, count)
+            count -= npws
+        for idx in range(npws):
+            yield(buf[(idx * passlen):((idx + 1) * passlen)].decode('ascii'))
+        buf = buf[(npws * passlen):]
+    return(None)
+
+
+def genPhrases(words, nwords, delimiter = constants.PASSPHRASE_DELIMITER, count = None):
+    # Like genChars(), but passphrases of nwords words from a wordlist.Wordlist.
+    while count is None or count > 0:
+        yield(delimiter.join(words.sample(nwords)))
+        if count is not None:
+            count -= 1
+    return(None)
+
+
+def _hashPW(pw, hashnames):
+    # Runs in the hashing pool's worker processes (or in-process for a single password).
+    hashes = {}
+    if has_passlib:
+        ctx = _contexts.get(hashnames)
+        if ctx is None:
+            ctx = passlib.context.CryptContext(schemes = list(hashnames))
+            _contexts[hashnames] = ctx
+        for h in hashnames:
+            if h.endswith('_crypt'):
+                try:
+                    hashes[h] = ctx.hash(pw, scheme = h, rounds = 5000)
+                except TypeError:
+                    hashes[h] = ctx.hash(pw, scheme = h)
+            else:
+                hashes[h] = ctx.hash(pw, scheme = h)
+    else:
+        for h in hashnames:
+            # A new hash object each time; they're stateful.
+            hashes[h] = hashlib.new(h, pw.encode('utf-8')).hexdigest()
+    return(hashes)
+
+
+def genHashes(passwords, hashnames, workers = None):
+    # Yields (password, {hashname: hash}) for each of passwords, in order. Hashing (crypt schemes especially) is
+    # CPU-bound, so it's spread across a pool of processes (one per CPU by default).
+    hashnames = tuple(hashnames)
+    nworkers = (workers or os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = nworkers) as pool:
+        passwords = iter(passwords)
+        while True:
+            batch = list(itertools.islice(passwords, (_hash_batch * nworkers)))
+            if not batch:
+                break
+            results = pool.map(_hashPW, batch, itertools.repeat(hashnames), chunksize = _hash_batch // 4)
+            for pw, hashes in zip(batch, results):
+                yield(pw, hashes)
+    return(None)
 
 
 class genPass(object):
@@ -38,6 +138,9 @@ class genPass(object):
                  backslashes = True,
                  human = False,
                  hashes = None,
+                 words = None,
+                 wordlist_path = None,
+                 delimiter = constants.PASSPHRASE_DELIMITER,
                  *args,
                  **kwargs):
         if not chars:
@@ -54,6 +157,10 @@ class genPass(object):
         self.passlen = passlen
         self.backslashes = backslashes
         self.human = human
+        # If set, passphrases of this many words are generated instead.
+        self.words = words
+        self.wordlist_path = wordlist_path
+        self.delimiter = delimiter
         self.buildCharSet()
 
     def buildCharSet(self):
@@ -75,7 +182,7 @@ class genPass(object):
     def buildHashers(self):
         if self.hashnames:
             if not isinstance(self.hashnames, list):
-                _hashes = [self.hashnames]
+                self.hashnames = [self.hashnames]
             for h in self.hashnames:
                 if h not in supported_hashes:
                     warnings.warn('Hash algorithm {0} is not a supported hash algorithm'.format(h))
@@ -85,8 +192,8 @@ class genPass(object):
                 self.hasher = passlib.context.CryptContext(schemes = list(self.hashes.keys()))
             else:
                 self.hasher = {}
-                for h in self.hashnames:
-                    self.hasher[h] = getattr(hashlib, h)
+                for h in self.hashes.keys():
+                    self.hasher[h] = hashlib.new
         return(None)
 
     def generate(self):
@@ -94,10 +201,14 @@ class genPass(object):
         self.genHash()
         return(None)
 
+    def genPasswords(self, count = None):
+        # A stream of passwords (or passphrases) for bulk generation; see genChars()/genPhrases().
+        if self.words:
+            return(genPhrases(wordlist.getWordlist(self.wordlist_path), self.words, self.delimiter, count = count))
+        return(genChars(self.chars, self.passlen, count = count))
+
     def genPW(self):
-        self.pw = ''
-        for _ in range(self.passlen):
-            self.pw += random.SystemRandom().choice(self.chars)
+        self.pw = next(self.genPasswords(count = 1))
         return(None)
 
     def genHash(self):
@@ -106,19 +217,7 @@ class genPass(object):
             return(None)
         if not self.pw:
             self.genPW()
-        for h in self.hashes.keys():
-            if has_passlib:
-                if h.endswith('_crypt'):
-                    try:
-                        self.hashes[h] = self.hasher.hash(self.pw, scheme = h, rounds = 5000)
-                    except TypeError:
-                        self.hashes[h] = self.hasher.hash(self.pw, scheme = h)
-                else:
-                    self.hashes[h] = self.hasher.hash(self.pw, scheme = h)
-            else:
-                _hasher = self.hasher[h]
-                _hasher.update(self.pw.encode('utf-8'))
-                self.hashes[h] = _hasher.hexdigest()
+        self.hashes = _hashPW(self.pw, tuple(self.hashes.keys()))
         return(None)
 
 
@@ -175,6 +274,31 @@ def parseArgs():
                       help = ('If specified, also generate hashes for the generated password. '
                               'Pass this argument multiple times for multiple hash types. Use -HL/--hash-list for '
                               'supported hash algorithms'))
+    args.add_argument('-w', '--words',
+                      dest = 'words',
+                      metavar = 'WORDS',
+                      type = int,
+                      default = None,
+                      help = ('If specified, generate passphrases of this many words (from -W/--wordlist) instead of '
+                              'passwords'))
+    args.add_argument('-W', '--wordlist',
+                      dest = 'wordlist_path',
+                      metavar = 'PATH',
+                      default = None,
+                      help = ('The wordlist (one word per line, or diceware-style) to generate passphrases from. '
+                              'The default is the first of: {0}').format(', '.join(constants.WORDLISTS)))
+    args.add_argument('-d', '--delimiter',
+                      dest = 'delimiter',
+                      default = constants.PASSPHRASE_DELIMITER,
+                      help = ('What to put between the words of a passphrase. '
+                              'Default: "{0}"').format(constants.PASSPHRASE_DELIMITER))
+    args.add_argument('-j', '--jobs',
+                      dest = 'workers',
+                      metavar = 'JOBS',
+                      type = int,
+                      default = None,
+                      help = ('How many processes to hash passwords with (if generating more than one with -H/--hash). '
+                              'The default is one per CPU'))
     args.add_argument('-HL', '--hash-list',
                       dest = 'only_hashlist',
                       action = 'store_true',
@@ -188,13 +312,30 @@ def main():
         print('SUPPORTED HASH ALGORITHMS:\n')
         print(' *', '\n * '.join(supported_hashes))
         return(None)
-    for _ in range(0, args['passcount']):
-        p = genPass(**args)
+    p = genPass(**args)
+    p.buildHashers()
+    if not p.hashes:
+        # The fast path; passwords are written out in batches as they're generated.
+        batch = []
+        for pw in p.genPasswords(count = args['passcount']):
+            batch.append(pw)
+            if len(batch) >= 1024:
+                sys.stdout.write('\n'.join(batch) + '\n')
+                batch = []
+        if batch:
+            sys.stdout.write('\n'.join(batch) + '\n')
+        return(None)
+    if args['passcount'] == 1:
+        # Not worth starting a pool for.
         p.generate()
-        print(p.pw)
-        if p.hashes:
+        results = [(p.pw, p.hashes)]
+    else:
+        results = genHashes(p.genPasswords(count = args['passcount']), p.hashes.keys(), workers = args['workers'])
+    for pw, hashes in results:
+        print(pw)
+        if hashes:
             print('\nHASHES:')
-            for h, val in p.hashes.items():
+            for h, val in hashes.items():
                 print('{0}: {1}'.format(h, val))
             print()
     return(None)
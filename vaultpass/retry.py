@@ -0,0 +1,105 @@
+import collections
+import logging
+import random
+import threading
+##
+from . import constants
+
+
+_logger = logging.getLogger()
+_bool_map = {'true': True, '1': True, 'false': False, '0': False}
+# Sending these again can't do anything the first one didn't (LIST is Vault's).
+_idempotent_methods = ('GET', 'HEAD', 'LIST', 'OPTIONS')
+
+
+class LatencyWindow(object):
+    # A rolling window of observed latencies, used to figure out when a read is "slow enough" to hedge.
+    def __init__(self, size = 200, min_samples = 20):
+        self.samples = collections.deque(maxlen = size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+        return(None)
+
+    def percentile(self, pct):
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return(None)
+            ordered = sorted(self.samples)
+        idx = min((len(ordered) - 1), int(round((pct / 100.0) * (len(ordered) - 1))))
+        return(ordered[idx])
+
+
+class RetryPolicy(object):
+    attempts = constants.DEFAULT_RETRY_ATTEMPTS
+    backoff = constants.DEFAULT_RETRY_BACKOFF
+    max_backoff = constants.DEFAULT_RETRY_MAX_BACKOFF
+    statuses = constants.DEFAULT_RETRY_STATUSES
+    hedge = False
+    hedge_after = None  # None means "use the observed p95".
+
+    def __init__(self, retry_xml = None):
+        self.xml = retry_xml
+        self.reads = LatencyWindow()
+        self.parseConf()
+
+    def delay(self, attempt, retry_after = None):
+        # "Full jitter" exponential backoff; https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        ceiling = min(self.max_backoff, (self.backoff * (2 ** attempt)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            # The server knows better than we do.
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return(delay)
+
+    def hedgeThreshold(self):
+        if not self.hedge:
+            return(None)
+        if self.hedge_after is not None:
+            return(self.hedge_after)
+        return(self.reads.percentile(95))
+
+    def isRetryable(self, status_code, method = 'GET'):
+        # Only a 429 says for sure the request wasn't acted on; anything else (e.g. a 502 from a proxy) can come after
+        # a login, unseal, or write went through, so those are only retried for idempotent methods.
+        if status_code not in self.statuses:
+            return(False)
+        return(isIdempotent(method) or status_code == 429)
+
+    def parseConf(self):
+        if self.xml is None:
+            return(None)
+        try:
+            for attr, name, conv in (('attempts', 'attempts', int),
+                                     ('backoff', 'backoff', float),
+                                     ('max_backoff', 'maxBackoff', float),
+                                     ('hedge', 'hedge', toBool),
+                                     ('hedge_after', 'hedgeAfter', float)):
+                val = self.xml.attrib.get(name)
+                if val is None:
+                    continue
+                setattr(self, attr, conv(val))
+            statuses = self.xml.attrib.get('statuses')
+            if statuses is not None:
+                self.statuses = frozenset(int(i) for i in statuses.replace(',', ' ').split())
+        except (ValueError, KeyError):
+            _logger.error('Invalid retry setting')
+            _logger.debug('The retry configuration ({0}) is invalid.'.format(dict(self.xml.attrib)))
+            raise ValueError('Invalid retry setting')
+        if self.attempts < 1:
+            _logger.error('Invalid retry setting')
+            _logger.debug('The retry attempts ({0}) must be at least 1.'.format(self.attempts))
+            raise ValueError('Invalid retry setting')
+        return(None)
+
+
+def isIdempotent(method):
+    return(method.upper() in _idempotent_methods)
+
+
+def toBool(val):
+    # For boolean XSD attributes.
+    return(_bool_map[val.strip().lower()])
@@ -0,0 +1,128 @@
+import collections
+import json
+import logging
+import threading
+import time
+##
+from . import constants
+from . import metrics
+
+
+_logger = logging.getLogger()
+
+
+def _keyMatches(key, mount, path):
+    kmount, kpath = key
+    if mount is not None and kmount != mount:
+        return(False)
+    if path is not None:
+        if kpath.strip('/') != path and not kpath.strip('/').startswith(path + '/'):
+            return(False)
+    return(True)
+
+
+class _Flight(object):
+    # A read in progress that other callers for the same key wait on.
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.raw = None
+        self.error = None
+
+
+class SecretCache(object):
+    # A small LRU (with a TTL) of secret reads, keyed by (mount, path). Values are kept serialized in bytearrays so they
+    # can be overwritten with zeroes when they're evicted/invalidated instead of lingering until the GC gets to them.
+    # Concurrent reads of the same key that miss are collapsed into one read from Vault.
+    def __init__(self, ttl = constants.SECRET_CACHE_TTL, size = constants.SECRET_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.flights = {}
+        # Bumped by invalidate()/clear(); a read that started before either is handed to its callers but not cached.
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        # Must be called with the lock held.
+        expires, buf = self.entries.pop(key)
+        buf[:] = bytes(len(buf))
+        return(None)
+
+    def _store(self, key, raw, generation):
+        buf = bytearray(raw.encode('utf-8'))
+        with self._lock:
+            if generation != self.generation:
+                _logger.debug('Cache invalidated during read; not caching it.')
+                buf[:] = bytes(len(buf))
+                return(None)
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, buf)
+            while len(self.entries) > self.size:
+                self._drop(next(iter(self.entries)))
+        return(None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            # Later callers start a new read rather than wait on one that may predate a write.
+            self.flights.clear()
+            for key in list(self.entries.keys()):
+                self._drop(key)
+        return(None)
+
+    def get(self, mount, path, loader):
+        # Returns a copy of the cached read of mount/path, or (once, no matter how many callers are waiting on it) the
+        # result of loader().
+        key = (mount, path)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, buf = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    metrics.incr('vaultpass_cache_hits_total', (('cache', 'secret'), ))
+                    return(json.loads(buf.decode('utf-8')))
+                self._drop(key)
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.flights[key] = flight
+                generation = self.generation
+        if not leader:
+            _logger.debug('Waiting on in-flight read of {0}/{1}'.format(mount, path))
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return(json.loads(flight.raw))
+        metrics.incr('vaultpass_cache_misses_total', (('cache', 'secret'), ))
+        try:
+            flight.data = loader()
+            # Waiters get their own copy of this (not of flight.data, which the caller is free to modify).
+            flight.raw = json.dumps(flight.data)
+            self._store(key, flight.raw, generation)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+        return(flight.data)
+
+    def invalidate(self, mount = None, path = None):
+        # Everything (no mount), everything in a mount (no path), or a path and everything under it.
+        if path is not None:
+            path = path.strip('/')
+        with self._lock:
+            self.generation += 1
+            for key in list(self.entries.keys()):
+                if _keyMatches(key, mount, path):
+                    self._drop(key)
+            for key in list(self.flights.keys()):
+                if _keyMatches(key, mount, path):
+                    del self.flights[key]
+        return(None)
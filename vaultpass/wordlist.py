@@ -0,0 +1,111 @@
+import logging
+import math
+import mmap
+import os
+import secrets
+import struct
+##
+from . import cache
+from . import constants
+
+
+_logger = logging.getLogger()
+_offset = struct.Struct('<Q')
+# Opened wordlists, by path.
+_wordlists = {}
+
+
+class Wordlist(object):
+    # A (possibly huge) wordlist, one word per line. Lines may also be in diceware format ("11111<TAB>word"); only the
+    # last field is used. Neither the list nor its index are read into Python objects: both are mmap'd, and the index
+    # (the offset of each line, as little-endian uint64s) is built once and cached by the list's path, size, and mtime.
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.fh = None
+        self.mm = None
+        self.idx = None
+        self.count = 0
+        self.open()
+
+    def _buildIndex(self, idxpath):
+        _logger.debug('Indexing wordlist {0}'.format(self.path))
+        offsets = bytearray()
+        pos = 0
+        size = len(self.mm)
+        while pos < size:
+            end = self.mm.find(b'\n', pos)
+            if end == -1:
+                end = size
+            if self.mm[pos:end].strip():
+                offsets += _offset.pack(pos)
+            pos = end + 1
+        cache.writeFile(idxpath, bytes(offsets))
+        return(None)
+
+    def close(self):
+        for m in (self.idx, self.mm):
+            if m is not None:
+                m.close()
+        if self.fh is not None:
+            self.fh.close()
+        self.idx = self.mm = self.fh = None
+        return(None)
+
+    def entropy(self, nwords):
+        # In bits.
+        return(nwords * math.log2(self.count))
+
+    def getWord(self, n):
+        start = _offset.unpack_from(self.idx, (n * _offset.size))[0]
+        end = self.mm.find(b'\n', start)
+        if end == -1:
+            end = len(self.mm)
+        return(self.mm[start:end].split()[-1].decode('utf-8'))
+
+    def open(self):
+        if not os.path.isfile(self.path):
+            _logger.error('Wordlist does not exist')
+            _logger.debug('The wordlist {0} does not exist.'.format(self.path))
+            raise ValueError('Wordlist does not exist')
+        self.fh = open(self.path, 'rb')
+        st = os.fstat(self.fh.fileno())
+        if not st.st_size:
+            _logger.error('Wordlist is empty')
+            _logger.debug('The wordlist {0} is empty.'.format(self.path))
+            raise ValueError('Wordlist is empty')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access = mmap.ACCESS_READ)
+        idxpath = os.path.join(cache.getCacheDir('wordlists'),
+                               cache.getKey(self.path, str(st.st_size), str(st.st_mtime_ns)))
+        if not os.path.isfile(idxpath):
+            self._buildIndex(idxpath)
+        with open(idxpath, 'rb') as fh:
+            if not os.fstat(fh.fileno()).st_size:
+                _logger.error('Wordlist has no words')
+                _logger.debug('The wordlist {0} has no (non-blank) lines.'.format(self.path))
+                raise ValueError('Wordlist has no words')
+            self.idx = mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ)
+        self.count = len(self.idx) // _offset.size
+        _logger.debug('Opened wordlist {0} ({1} words).'.format(self.path, self.count))
+        return(None)
+
+    def sample(self, nwords):
+        # Uniformly, with replacement.
+        return([self.getWord(secrets.randbelow(self.count)) for _ in range(nwords)])
+
+
+def findWordlist():
+    for path in constants.WORDLISTS:
+        if os.path.isfile(path):
+            return(path)
+    _logger.error('No wordlist found')
+    _logger.debug('None of the default wordlists ({0}) exist; specify one.'.format(', '.join(constants.WORDLISTS)))
+    raise ValueError('No wordlist found')
+
+
+def getWordlist(path = None):
+    if path is None:
+        path = findWordlist()
+    path = os.path.abspath(os.path.expanduser(path))
+    if path not in _wordlists:
+        _wordlists[path] = Wordlist(path)
+    return(_wordlists[path])